@@ -0,0 +1,101 @@
+"""Benchmarks ChunkedPacket encoding of large binary payloads.
+
+Compares the view-based chunk encoder against the previous slicing encoder,
+which copied every chunk out of the payload. Each case runs in a fresh
+process so that peak RSS is measured independently.
+
+    python benchmarks/bench_chunking.py --sizes 100 500 1000 2000
+"""
+
+import argparse
+import multiprocessing as mp
+import resource
+import time
+
+from engineio import packet as eio_packet
+
+from volview_server.chunking.chunking_packet import (
+    CHUNK_SIZE,
+    ChunkedPacket,
+    ChunkViewPacket,
+)
+
+MiB = 1024 * 1024
+
+
+class LegacyChunkedPacket(ChunkedPacket):
+    @staticmethod
+    def _chunk_bytes(binary, chunk_size):
+        return [binary[o : o + chunk_size] for o in range(0, len(binary), chunk_size)]
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(packet_class, size_mib, result_queue):
+    payload = b"\x01" * (size_mib * MiB)
+    baseline_rss = peak_rss_mib()
+
+    start = time.perf_counter()
+    pkt = packet_class(data=["event", {"values": payload}])
+    encoded = [
+        chunk
+        for msg in pkt.encode()
+        for chunk in packet_class.chunk_message(msg, CHUNK_SIZE)
+    ]
+    encode_time = time.perf_counter() - start
+
+    # emulate the transport writer, which encodes and sends one
+    # engine.io packet at a time.
+    start = time.perf_counter()
+    sent = 0
+    for msg in encoded:
+        if isinstance(msg, memoryview):
+            eio_pkt = ChunkViewPacket(msg)
+        else:
+            eio_pkt = eio_packet.Packet(eio_packet.MESSAGE, msg)
+        sent += len(eio_pkt.encode())
+    write_time = time.perf_counter() - start
+
+    result_queue.put(
+        (encode_time, write_time, peak_rss_mib() - baseline_rss, len(encoded), sent)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100, 500, 1000, 2000],
+        help="Payload sizes in MiB",
+    )
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    print(
+        f"{'encoder':<8} {'size':>8} {'msgs':>6} {'encode':>10} "
+        f"{'write':>10} {'extra peak RSS':>15}"
+    )
+    for size_mib in args.sizes:
+        for name, packet_class in (
+            ("copy", LegacyChunkedPacket),
+            ("view", ChunkedPacket),
+        ):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_case, args=(packet_class, size_mib, queue))
+            proc.start()
+            encode_time, write_time, extra_rss, num_msgs, _ = queue.get()
+            proc.join()
+            print(
+                f"{name:<8} {size_mib:>5}MiB {num_msgs:>6} "
+                f"{encode_time * 1000:>8.1f}ms {write_time * 1000:>8.1f}ms "
+                f"{extra_rss:>12.1f}MiB"
+            )
+
+
+if __name__ == "__main__":
+    main()
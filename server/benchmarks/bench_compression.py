@@ -0,0 +1,227 @@
+"""Benchmarks image payload compression end to end.
+
+Each transfer is a real RPC round trip: a client calls an RpcServer endpoint
+that returns an image payload, and the server compresses the payload with the
+codec that the client negotiated. The client connects through a relay that
+paces the bytes in each direction at a given link bandwidth, so the time of a
+transfer includes compression, sending the compressed bytes at that
+bandwidth, chunk reassembly, and decompression. "none" negotiates no codec.
+
+Limits: the server, the relay and the client share one process and event
+loop, as in suite.py, so bandwidths above what the loopback relay sustains
+are capped by it. The link adds no latency. The client decompresses with the
+server's Python codecs, not the browser's.
+
+    python benchmarks/bench_compression.py --size 256 --bandwidths 100 1000 10000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+from aiohttp import web
+
+from suite import RESULT_TIMEOUT, ChunkingAsyncClient
+from volview_server import VolViewApi
+from volview_server.rpc_server import RpcServer
+from volview_server.transformers.compression import (
+    available_codecs,
+    decompress_payload,
+)
+
+# largest piece of data the relay forwards at once
+RELAY_READ_SIZE = 64 * 1024  # bytes
+
+
+def make_ct(size: int):
+    # smooth anatomy-like intensity field with acquisition noise
+    rng = np.random.default_rng(0)
+    z, y, x = np.ogrid[-1 : 1 : size * 1j, -1 : 1 : size * 1j, -1 : 1 : size * 1j]
+    body = (x**2 + y**2 < 0.8).astype(np.int16) * 1000 - 1000
+    organs = ((x - 0.2) ** 2 + y**2 + z**2 < 0.1) * 60
+    noise = rng.normal(0, 20, (size, size, size)).astype(np.int16)
+    return (body + organs + noise).astype(np.int16)
+
+
+def make_labelmap(size: int):
+    z, y, x = np.ogrid[-1 : 1 : size * 1j, -1 : 1 : size * 1j, -1 : 1 : size * 1j]
+    labels = np.zeros((size, size, size), dtype=np.uint8)
+    labels[(x - 0.3) ** 2 + y**2 + z**2 < 0.05] = 1
+    labels[(x + 0.3) ** 2 + y**2 + z**2 < 0.08] = 2
+    return labels
+
+
+def make_payload(array: np.ndarray):
+    return {
+        "vtkClass": "vtkImageData",
+        "pointData": {
+            "arrays": [
+                {
+                    "data": {
+                        "vtkClass": "vtkDataArray",
+                        "values": array.tobytes(),
+                    }
+                }
+            ]
+        },
+    }
+
+
+def payload_size(payload):
+    return len(payload["pointData"]["arrays"][0]["data"]["values"])
+
+
+class ThrottledRelay:
+    """Forwards TCP connections to a port, at a bandwidth in each direction."""
+
+    def __init__(self, target_port: int, bandwidth: float):
+        self.target_port = target_port
+        # bandwidth is in Mbit/s
+        self.bytes_per_second = bandwidth * 1e6 / 8
+        self.port = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._on_connection, "localhost", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _on_connection(self, client_reader, client_writer):
+        server_reader, server_writer = await asyncio.open_connection(
+            "localhost", self.target_port
+        )
+        await asyncio.gather(
+            self._pipe(client_reader, server_writer),
+            self._pipe(server_reader, client_writer),
+        )
+
+    async def _pipe(self, reader, writer):
+        sent_at = time.perf_counter()
+        try:
+            while data := await reader.read(RELAY_READ_SIZE):
+                # data arrives once the link has had time to send it
+                sent_at = max(sent_at, time.perf_counter())
+                sent_at += len(data) / self.bytes_per_second
+                await asyncio.sleep(sent_at - time.perf_counter())
+                writer.write(data)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def start_server(volumes):
+    api = VolViewApi()
+
+    @api.expose
+    def get_volume(name):
+        return volumes[name]
+
+    server = RpcServer(api, async_mode="aiohttp")
+    app = web.Application(client_max_size=server.sio.eio.max_http_buffer_size)
+    server.sio.attach(app)
+    server.setup()
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+async def time_transfers(port: int, codec: str, name: str, repeats: int):
+    """Times round trips of a volume, and returns (seconds, ratio, decompress)."""
+    client = ChunkingAsyncClient()
+    results = asyncio.Queue()
+    client.on("rpc:result", results.put_nowait)
+    codecs = "" if codec == "none" else codec
+    await client.connect(
+        f"http://localhost:{port}?clientId=bench-{codec}&codecs={codecs}",
+        transports=["websocket"],
+    )
+
+    times = []
+    try:
+        for repeat in range(repeats):
+            start = time.perf_counter()
+            await client.emit(
+                "rpc:call", {"rpcId": str(repeat), "name": "get_volume", "args": [name]}
+            )
+            result = await asyncio.wait_for(results.get(), RESULT_TIMEOUT)
+            if not result["ok"]:
+                raise RuntimeError(result["error"])
+            received = result["data"]
+            decompress_start = time.perf_counter()
+            payload = decompress_payload(received)
+            end = time.perf_counter()
+            times.append(end - start)
+    finally:
+        await client.disconnect()
+
+    ratio = payload_size(payload) / payload_size(received)
+    return statistics.median(times), ratio, end - decompress_start
+
+
+async def run(args):
+    volumes = {
+        "CT int16": make_payload(make_ct(args.size)),
+        "labelmap uint8": make_payload(make_labelmap(args.size)),
+    }
+    runner, server_port = await start_server(volumes)
+
+    header = f"{'volume':<16} {'codec':<8} {'ratio':>6} {'decomp':>8}"
+    for bandwidth in args.bandwidths:
+        header += f" {f'@{bandwidth:g}Mb/s':>12}"
+    print(header)
+
+    try:
+        for name in volumes:
+            for codec in ["none", *available_codecs()]:
+                times = []
+                for bandwidth in args.bandwidths:
+                    relay = ThrottledRelay(server_port, bandwidth)
+                    await relay.start()
+                    try:
+                        seconds, ratio, decompress_time = await time_transfers(
+                            relay.port, codec, name, args.repeats
+                        )
+                    finally:
+                        await relay.close()
+                    times.append(seconds)
+
+                decomp = "-" if codec == "none" else f"{decompress_time * 1000:.0f}ms"
+                row = f"{name:<16} {codec:<8} {ratio:>6.1f} {decomp:>8}"
+                for seconds in times:
+                    row += f" {seconds * 1000:>10.0f}ms"
+                print(row)
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=256, help="Volume edge length")
+    parser.add_argument(
+        "--bandwidths",
+        type=float,
+        nargs="+",
+        default=[100, 1000, 10000],
+        help="Link bandwidths in Mbit/s",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Transfers per case, of which the median is reported",
+    )
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Benchmarks the dispatch overhead of trivial endpoint calls.
+
+Calls RpcApi.invoke_rpc() directly, without socket.io, for an async and a
+non-async "add" endpoint, with and without argument transforms. Extra
+routers with unrelated endpoints are registered first, to show how lookups
+scale with the number of endpoints.
+
+    python benchmarks/bench_dispatch.py --routers 0 100 --calls 20000
+"""
+
+import argparse
+import asyncio
+import time
+
+from volview_server import RpcRouter, VolViewApi
+
+
+def make_api(routers: int, endpoints_per_router: int):
+    api = VolViewApi()
+    for index in range(routers):
+        router = RpcRouter()
+        for endpoint in range(endpoints_per_router):
+            router.add_endpoint(f"router{index}_endpoint{endpoint}", abs)
+        api.add_router(router)
+
+    # registered after the routers, so that it is found last
+    last_router = RpcRouter()
+
+    async def add(a, b):
+        return a + b
+
+    def add_sync(a, b):
+        return a + b
+
+    last_router.add_endpoint("add", add)
+    last_router.add_endpoint("add_raw", add, transform_args=False)
+    last_router.add_endpoint("add_sync", add_sync)
+    api.add_router(last_router)
+    return api
+
+
+async def calls_per_second(api: VolViewApi, name: str, calls: int):
+    for _ in range(100):
+        await api.invoke_rpc(name, 1, 2)
+    start = time.perf_counter()
+    for _ in range(calls):
+        await api.invoke_rpc(name, 1, 2)
+    return calls / (time.perf_counter() - start)
+
+
+async def main(routers, endpoints_per_router, calls):
+    names = ("add", "add_raw", "add_sync")
+    print(f"{'routers':>8} " + " ".join(f"{name:>12}" for name in names))
+    for count in routers:
+        api = make_api(count, endpoints_per_router)
+        rates = [await calls_per_second(api, name, calls) for name in names]
+        print(f"{count:>8} " + " ".join(f"{rate:>10.0f}/s" for rate in rates))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--routers",
+        type=int,
+        nargs="+",
+        default=[0, 100],
+        help="Numbers of extra routers to register",
+    )
+    parser.add_argument("--endpoints-per-router", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(main(args.routers, args.endpoints_per_router, args.calls))
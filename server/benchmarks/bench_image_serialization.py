@@ -0,0 +1,158 @@
+"""Benchmarks the peak memory of serializing and deserializing ITK images.
+
+Compares itk_to_vtk_image, which references ITK's pixel buffer, against the
+previous serializer, which flattened the pixels and then copied them into
+bytes. Deserialization compares vtk_to_itk_image copies against views of
+the received buffer, running a median filter on the result. Each case runs
+in a fresh process so that peak RSS is measured independently, and the extra
+peak RSS is reported relative to the volume.
+
+    python benchmarks/bench_image_serialization.py --sizes 128 256 512
+"""
+
+import argparse
+import multiprocessing as mp
+import resource
+import time
+
+import itk
+from engineio import packet as eio_packet
+
+from volview_server.chunking.chunking_packet import (
+    CHUNK_SIZE,
+    ChunkedPacket,
+    ChunkViewPacket,
+)
+from volview_server.transformers.image_data import itk_to_vtk_image, vtk_to_itk_image
+
+MiB = 1024 * 1024
+
+
+def legacy_itk_to_vtk_image(itk_image):
+    serialized = itk_to_vtk_image(itk_image)
+    values = itk.GetArrayViewFromImage(itk_image).flatten(order="C")
+    serialized["pointData"]["arrays"][0]["data"]["values"] = values.tobytes()
+    return serialized
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_case(serialize, size, result_queue):
+    # allocate the image in ITK, so no freed numpy buffer lowers the peak
+    image = itk.Image[itk.SS, 3].New()
+    image.SetRegions([size, size, size])
+    image.Allocate()
+    image.FillBuffer(1)
+    baseline_rss = peak_rss_mib()
+
+    start = time.perf_counter()
+    pkt = ChunkedPacket(data=["event", serialize(image)])
+    encoded = [
+        chunk
+        for msg in pkt.encode()
+        for chunk in ChunkedPacket.chunk_message(msg, CHUNK_SIZE)
+    ]
+    del pkt
+    serialize_time = time.perf_counter() - start
+
+    # emulate the transport writer, which encodes and sends one
+    # engine.io packet at a time.
+    start = time.perf_counter()
+    for msg in encoded:
+        if isinstance(msg, memoryview):
+            eio_pkt = ChunkViewPacket(msg)
+        else:
+            eio_pkt = eio_packet.Packet(eio_packet.MESSAGE, msg)
+        eio_pkt.encode()
+    write_time = time.perf_counter() - start
+
+    result_queue.put((serialize_time, write_time, peak_rss_mib() - baseline_rss))
+
+
+def run_deserialize_case(view, size, result_queue):
+    image = itk.Image[itk.SS, 3].New()
+    image.SetRegions([size, size, size])
+    image.Allocate()
+    image.FillBuffer(1)
+    serialized = itk_to_vtk_image(image)
+    # a received payload, which the chunking server reassembles into a bytearray
+    data_array = serialized["pointData"]["arrays"][0]["data"]
+    data_array["values"] = bytearray(data_array["values"])
+    del image
+    # loading the filter module takes a lot of memory, so load it up front
+    ImageType = itk.Image[itk.SS, 3]
+    median_filter = itk.MedianImageFilter[ImageType, ImageType].New()
+    baseline_rss = peak_rss_mib()
+
+    start = time.perf_counter()
+    itk_image = vtk_to_itk_image(serialized, view=view)
+    deserialize_time = time.perf_counter() - start
+
+    # the median filter's output is one more volume in both cases
+    median_filter.SetInput(itk_image)
+    median_filter.SetRadius(1)
+    start = time.perf_counter()
+    median_filter.Update()
+    filter_time = time.perf_counter() - start
+
+    result_queue.put((deserialize_time, filter_time, peak_rss_mib() - baseline_rss))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[128, 256, 512],
+        help="Volume edge lengths of int16 images",
+    )
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    print(
+        f"{'serializer':<10} {'volume':>9} {'serialize':>10} {'write':>10} "
+        f"{'extra peak RSS':>15} {'x volume':>9}"
+    )
+    for size in args.sizes:
+        volume_mib = size**3 * 2 / MiB
+        for name, serialize in (
+            ("copy", legacy_itk_to_vtk_image),
+            ("view", itk_to_vtk_image),
+        ):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_case, args=(serialize, size, queue))
+            proc.start()
+            serialize_time, write_time, extra_rss = queue.get()
+            proc.join()
+            print(
+                f"{name:<10} {volume_mib:>6.0f}MiB {serialize_time * 1000:>8.1f}ms "
+                f"{write_time * 1000:>8.1f}ms {extra_rss:>12.1f}MiB "
+                f"{extra_rss / volume_mib:>8.2f}x"
+            )
+
+    print()
+    print(
+        f"{'deserializer':<12} {'volume':>9} {'deserialize':>12} {'median':>10} "
+        f"{'extra peak RSS':>15} {'x volume':>9}"
+    )
+    for size in args.sizes:
+        volume_mib = size**3 * 2 / MiB
+        for name, view in (("copy", False), ("view", True)):
+            queue = ctx.Queue()
+            proc = ctx.Process(target=run_deserialize_case, args=(view, size, queue))
+            proc.start()
+            deserialize_time, filter_time, extra_rss = queue.get()
+            proc.join()
+            print(
+                f"{name:<12} {volume_mib:>6.0f}MiB {deserialize_time * 1000:>10.1f}ms "
+                f"{filter_time * 1000:>8.1f}ms {extra_rss:>12.1f}MiB "
+                f"{extra_rss / volume_mib:>8.2f}x"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Benchmarks passing ITK images to and from worker processes.
+
+Compares the ProcessExecutor behind expose(..., executor="process"), which
+passes images through shared memory, against the previous approach of
+serializing images to vtk.js dicts and pickling them through a
+ProcessPoolExecutor. The worker returns a copy of its input image, so the
+timings measure the transfer overhead of a call.
+
+    python benchmarks/bench_process_pool.py --sizes 64 128 256
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import itk
+import numpy as np
+
+from volview_server.process_executor import ProcessExecutor
+from volview_server.transformers.image_data import itk_to_vtk_image, vtk_to_itk_image
+
+MiB = 1024 * 1024
+
+
+def copy_image(itk_image):
+    output = itk.GetImageFromArray(itk.GetArrayViewFromImage(itk_image))
+    output.CopyInformation(itk_image)
+    return output
+
+
+def copy_serialized_image(serialized):
+    return itk_to_vtk_image(copy_image(vtk_to_itk_image(serialized)))
+
+
+def make_image(size):
+    pixels = np.random.default_rng(0).integers(
+        0, 1000, (size, size, size), dtype=np.int16
+    )
+    return itk.GetImageFromArray(pixels)
+
+
+async def time_calls(call, repeat):
+    await call()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await call()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+async def main(sizes, repeat):
+    loop = asyncio.get_running_loop()
+    pickle_pool = ProcessPoolExecutor(1)
+    shared_pool = ProcessExecutor(1)
+    shared_pool.start()
+
+    print(f"{'volume':>9} {'pickled':>10} {'shared':>10} {'speedup':>8}")
+    for size in sizes:
+        image = make_image(size)
+
+        async def pickled():
+            serialized = await loop.run_in_executor(
+                pickle_pool, copy_serialized_image, itk_to_vtk_image(image)
+            )
+            return vtk_to_itk_image(serialized)
+
+        async def shared():
+            return await shared_pool.run(copy_image, image)
+
+        pickled_time = await time_calls(pickled, repeat)
+        shared_time = await time_calls(shared, repeat)
+        volume_mib = size**3 * 2 / MiB
+        print(
+            f"{volume_mib:>6.0f}MiB {pickled_time * 1000:>8.1f}ms "
+            f"{shared_time * 1000:>8.1f}ms {pickled_time / shared_time:>7.1f}x"
+        )
+
+    pickle_pool.shutdown()
+    shared_pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[64, 128, 256],
+        help="Volume edge lengths of int16 images",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.sizes, args.repeat))
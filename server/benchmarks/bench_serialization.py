@@ -0,0 +1,98 @@
+"""Benchmarks RpcApi.serialize_object against the previous per-node pipe().
+
+The previous implementation called every serializer on every node, and the
+image serializer raised and caught a ConvertError for each node that was not
+an image. The outputs of both implementations are checked to be equal.
+
+    python benchmarks/bench_serialization.py --repeat 5
+"""
+
+import argparse
+import statistics
+import time
+
+import itk
+import numpy as np
+
+from volview_server.api import RpcApi
+from volview_server.transformers import pipe, transform_object
+from volview_server.transformers.exceptions import ConvertError
+from volview_server.transformers.image_data import itk_to_vtk_image
+
+
+def legacy_convert_itk_to_vtkjs_image(obj):
+    try:
+        return itk_to_vtk_image(obj)
+    except ConvertError:
+        return obj
+
+
+def legacy_serialize_object(obj):
+    return transform_object(obj, lambda o: pipe(o, legacy_convert_itk_to_vtkjs_image))
+
+
+def make_cases():
+    rng = np.random.default_rng(0)
+    image = itk.image_from_array(np.zeros((64, 64, 64), dtype=np.int16))
+    return {
+        "100k ints": list(range(100_000)),
+        "100k points": rng.random((100_000, 3)).tolist(),
+        "json records": [
+            {
+                "id": str(i),
+                "name": f"segment {i}",
+                "visible": True,
+                "color": [255, 0, 0, 255],
+                "bounds": [0.0, 1.0, 0.0, 1.0, 0.0, 1.0],
+                "tags": {"label": i, "source": "server"},
+            }
+            for i in range(10_000)
+        ],
+        "ndarray 1M": rng.random(1_000_000),
+        "image + meta": {"image": image, "name": "ct", "spacing": [1.0, 1.0, 1.0]},
+    }
+
+
+def time_it(fn, obj, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(obj)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def assert_same(a, b):
+    if isinstance(a, np.ndarray):
+        assert isinstance(b, np.ndarray) and np.array_equal(a, b)
+    elif isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for key in a:
+            assert_same(a[key], b[key])
+    elif isinstance(a, list):
+        assert isinstance(b, list) and len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y)
+    else:
+        assert a == b
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    api = RpcApi()
+    print(f"{'case':<14} {'pipe':>10} {'dispatch':>10} {'speedup':>8}")
+    for name, obj in make_cases().items():
+        assert_same(legacy_serialize_object(obj), api.serialize_object(obj))
+        legacy = time_it(legacy_serialize_object, obj, args.repeat)
+        current = time_it(api.serialize_object, obj, args.repeat)
+        print(
+            f"{name:<14} {legacy * 1000:>8.1f}ms {current * 1000:>8.1f}ms "
+            f"{legacy / current:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
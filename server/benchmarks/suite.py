@@ -0,0 +1,594 @@
+"""Benchmarks the server's transfer and RPC hot paths.
+
+Covers chunked packet encoding and reassembly, ITK <-> vtk.js image round
+trips, transforming large nested payloads, and RPC and stream round trips
+through an in-process socket.io client. Each case runs in a fresh process, so
+that its peak RSS is measured independently. For each case, the suite
+reports latency percentiles over the repeats, throughput, and the extra peak
+RSS of the case over its setup.
+
+Results can be saved as a baseline, and later runs are compared against it.
+A case regresses once its median latency or extra peak RSS grows by more
+than the tolerance.
+
+    python benchmarks/suite.py --save-baseline
+    python benchmarks/suite.py --image-sizes 64 128 256 512 1024 --only 'image.*'
+"""
+
+import argparse
+import asyncio
+import fnmatch
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue as queue_module
+import resource
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, NamedTuple
+
+import itk
+import numpy as np
+import socketio
+from aiohttp import web
+from engineio import packet as eio_packet
+
+from volview_server import VolViewApi
+from volview_server.chunking import ChunkingAsyncServer
+from volview_server.chunking.chunking_packet import (
+    CHUNK_SIZE,
+    CHUNKED_PACKET_TYPE,
+    ChunkedPacket,
+    ChunkViewPacket,
+)
+from volview_server.chunking.chunking_server import ChunkingState
+from volview_server.image_stream import stream_image
+from volview_server.rpc_server import RpcServer
+from volview_server.transformers.image_data import itk_to_vtk_image, vtk_to_itk_image
+
+MiB = 1024 * 1024
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DTYPES = ("uint8", "int16", "float32")
+# seconds to wait for an RPC or stream result before failing the case
+RESULT_TIMEOUT = 60
+# seconds to wait for a case process to report its results
+CASE_TIMEOUT = 600
+
+
+class Case(NamedTuple):
+    name: str
+    # builds the case's state, and returns a function that runs one repeat
+    # and returns the number of bytes it processed.
+    setup: Callable[..., Callable[[], int]]
+    args: tuple
+
+
+def reset_peak_rss():
+    """Resets the peak RSS to the current RSS, where the OS supports it.
+
+    Otherwise, the peak RSS of a case includes the temporaries of its setup.
+    """
+    try:
+        # Linux: clears VmHWM
+        with open("/proc/self/clear_refs", "w") as fp:
+            fp.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mib():
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KiB on Linux, and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (MiB if sys.platform == "darwin" else 1024)
+
+
+def current_rss_mib():
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mib()
+
+
+def percentile(sorted_values: List[float], fraction: float):
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+# chunking
+
+
+def setup_chunk_encode(size_mib: int):
+    payload = np.ones(size_mib * MiB, dtype=np.uint8)
+
+    def run():
+        pkt = ChunkedPacket(data=["event", {"values": payload}])
+        sent = 0
+        for msg in pkt.encode():
+            for chunk in ChunkedPacket.chunk_message(msg, CHUNK_SIZE):
+                # emulate the transport writer
+                if isinstance(chunk, memoryview):
+                    eio_pkt = ChunkViewPacket(chunk)
+                else:
+                    eio_pkt = eio_packet.Packet(eio_packet.MESSAGE, chunk)
+                sent += len(eio_pkt.encode())
+        return sent
+
+    return run
+
+
+def setup_chunk_reassemble(size_mib: int):
+    server = ChunkingAsyncServer()
+    payload = b"\x01" * (size_mib * MiB)
+    chunks = [payload[o : o + CHUNK_SIZE] for o in range(0, len(payload), CHUNK_SIZE)]
+
+    def run():
+        state = ChunkingState([len(chunks)])
+        for chunk in chunks:
+            server._add_chunk(state, chunk)
+        return len(server._reconstruct_chunks(state))
+
+    return run
+
+
+# images
+
+
+def make_image(size: int, dtype: str):
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 200, (size, size, size), dtype=np.uint8).astype(dtype)
+    return itk.GetImageFromArray(pixels)
+
+
+def setup_image_round_trip(size: int, dtype: str):
+    image = make_image(size, dtype)
+    nbytes = itk.GetArrayViewFromImage(image).nbytes
+
+    def run():
+        serialized = itk_to_vtk_image(image)
+        vtk_to_itk_image(serialized)
+        return nbytes
+
+    return run
+
+
+# transforms
+
+
+def make_nested_payload():
+    image = make_image(32, "int16")
+    return {
+        "studies": [
+            {
+                "id": f"study-{i}",
+                "tags": {f"tag{j}": j * 0.5 for j in range(50)},
+                "series": [
+                    {"uid": f"{i}.{j}", "slices": list(range(200)), "image": image}
+                    for j in range(5)
+                ],
+                "measurements": [[float(k), float(k + 1)] for k in range(200)],
+            }
+            for i in range(100)
+        ]
+    }
+
+
+def setup_transform(direction: str):
+    api = VolViewApi()
+    payload = make_nested_payload()
+    nbytes = 100 * 5 * itk.GetArrayViewFromImage(make_image(32, "int16")).nbytes
+    if direction == "serialize":
+        fn = api.serialize_object
+    else:
+        payload = api.serialize_object(payload)
+        fn = api.deserialize_object
+
+    def run():
+        fn(payload)
+        return nbytes
+
+    return run
+
+
+# RPC round trips
+
+
+class ChunkingAsyncClient(socketio.AsyncClient):
+    """A socket.io client that reassembles chunked messages."""
+
+    def __init__(self, **kwargs):
+        super().__init__(serializer=ChunkedPacket, **kwargs)
+        self._chunking_info: List[int] = []
+        self._chunks = []
+
+    async def _handle_eio_message(self, data):
+        if self._chunking_info:
+            self._chunks.append(data)
+            if len(self._chunks) == self._chunking_info[0]:
+                chunks, self._chunks = self._chunks, []
+                self._chunking_info.pop(0)
+                if isinstance(chunks[0], str):
+                    data = "".join(chunks)
+                else:
+                    data = b"".join(chunks)
+                await super()._handle_eio_message(data)
+        elif isinstance(data, str) and data[:1] == CHUNKED_PACKET_TYPE:
+            self._chunking_info = json.loads(data[1:])
+        else:
+            await super()._handle_eio_message(data)
+
+
+class RoundTripHarness:
+    """Runs an RpcServer and a client on one event loop."""
+
+    def __init__(self, api: VolViewApi):
+        self.loop = asyncio.new_event_loop()
+        self.server = RpcServer(api, async_mode="aiohttp")
+        self.client = ChunkingAsyncClient()
+        self.results: Dict[str, asyncio.Queue] = {}
+        self._next_id = 0
+        self.loop.run_until_complete(self._start())
+
+    async def _start(self):
+        app = web.Application(client_max_size=self.server.sio.eio.max_http_buffer_size)
+        self.server.sio.attach(app)
+        self.server.setup()
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "localhost", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        @self.client.on("rpc:result")
+        async def on_rpc_result(data):
+            self.results[data["rpcId"]].put_nowait(data)
+
+        @self.client.on("stream:result")
+        async def on_stream_result(data):
+            self.results[data["rpcId"]].put_nowait(data)
+            if not data.get("done", True):
+                await self.client.emit(
+                    "stream:credit", {"rpcId": data["rpcId"], "credits": 1}
+                )
+
+        await self.client.connect(
+            f"http://localhost:{port}?clientId=bench", transports=["websocket"]
+        )
+
+    async def _next_result(self, queue: asyncio.Queue):
+        try:
+            return await asyncio.wait_for(queue.get(), RESULT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise RuntimeError(f"No result after {RESULT_TIMEOUT}s") from None
+
+    def _new_id(self):
+        self._next_id += 1
+        rpc_id = str(self._next_id)
+        self.results[rpc_id] = asyncio.Queue()
+        return rpc_id
+
+    async def call(self, name: str, *args):
+        rpc_id = self._new_id()
+        await self.client.emit(
+            "rpc:call", {"rpcId": rpc_id, "name": name, "args": list(args)}
+        )
+        result = await self._next_result(self.results[rpc_id])
+        del self.results[rpc_id]
+        if not result["ok"]:
+            raise RuntimeError(result["error"])
+        return result["data"]
+
+    async def stream(self, name: str, *args, window: int = 8):
+        rpc_id = self._new_id()
+        await self.client.emit(
+            "stream:call",
+            {"rpcId": rpc_id, "name": name, "args": list(args), "window": window},
+        )
+        queue = self.results[rpc_id]
+        items = []
+        while True:
+            result = await self._next_result(queue)
+            if not result["ok"]:
+                raise RuntimeError(result["error"])
+            if result["done"]:
+                break
+            items.append(result["data"])
+        del self.results[rpc_id]
+        return items
+
+    def run(self, coro):
+        return self.loop.run_until_complete(coro)
+
+
+def setup_rpc_small():
+    api = VolViewApi()
+
+    @api.expose
+    async def add(a, b):
+        return a + b
+
+    harness = RoundTripHarness(api)
+
+    def run():
+        harness.run(harness.call("add", 1, 2))
+        return 0
+
+    return run
+
+
+def setup_rpc_image(size: int):
+    api = VolViewApi()
+    image = make_image(size, "int16")
+
+    @api.expose
+    async def get_image():
+        return image
+
+    harness = RoundTripHarness(api)
+    nbytes = itk.GetArrayViewFromImage(image).nbytes
+
+    def run():
+        harness.run(harness.call("get_image"))
+        return nbytes
+
+    return run
+
+
+def setup_stream_image(size: int):
+    api = VolViewApi()
+    image = make_image(size, "int16")
+
+    @api.expose
+    async def stream_volume():
+        async for message in stream_image(image):
+            yield message
+
+    harness = RoundTripHarness(api)
+    nbytes = itk.GetArrayViewFromImage(image).nbytes
+
+    def run():
+        harness.run(harness.stream("stream_volume"))
+        return nbytes
+
+    return run
+
+
+def make_cases(args) -> List[Case]:
+    cases = []
+    for size_mib in args.chunk_sizes:
+        cases.append(
+            Case(f"chunking.encode[{size_mib}MiB]", setup_chunk_encode, (size_mib,))
+        )
+        cases.append(
+            Case(
+                f"chunking.reassemble[{size_mib}MiB]",
+                setup_chunk_reassemble,
+                (size_mib,),
+            )
+        )
+    for size in args.image_sizes:
+        for dtype in DTYPES:
+            cases.append(
+                Case(
+                    f"image.round_trip[{dtype} {size}^3]",
+                    setup_image_round_trip,
+                    (size, dtype),
+                )
+            )
+    for direction in ("serialize", "deserialize"):
+        cases.append(
+            Case(f"transform.{direction}[nested]", setup_transform, (direction,))
+        )
+    cases.append(Case("rpc.round_trip[small]", setup_rpc_small, ()))
+    for size in args.rpc_image_sizes:
+        cases.append(Case(f"rpc.round_trip[int16 {size}^3]", setup_rpc_image, (size,)))
+        cases.append(
+            Case(f"stream.round_trip[int16 {size}^3]", setup_stream_image, (size,))
+        )
+    return [
+        case
+        for case in cases
+        if not args.only or any(fnmatch.fnmatch(case.name, p) for p in args.only)
+    ]
+
+
+def run_case(case: Case, repeat: int, result_queue):
+    run = case.setup(*case.args)
+    reset_peak_rss()
+    baseline_rss = current_rss_mib()
+    # warm up
+    run()
+
+    times = []
+    nbytes = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        nbytes += run()
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    total = sum(times)
+    result_queue.put(
+        {
+            "p50": statistics.median(times),
+            "p90": percentile(times, 0.9),
+            "p99": percentile(times, 0.99),
+            "throughput": nbytes / MiB / total if nbytes and total else None,
+            "peak_mib": peak_rss_mib() - baseline_rss,
+        }
+    )
+
+
+def wait_for_case(proc, result_queue, timeout: float):
+    """Waits for the results of a case process.
+
+    Returns None if the process exits without results, such as after a crash
+    or an error, or if it takes longer than timeout seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            return result_queue.get(timeout=1)
+        except queue_module.Empty:
+            if not proc.is_alive():
+                # results may have arrived as the process exited
+                try:
+                    return result_queue.get(timeout=1)
+                except queue_module.Empty:
+                    return None
+    proc.kill()
+    return None
+
+
+def format_change(value, baseline_value):
+    if value is None or not baseline_value:
+        return ""
+    return f"{(value - baseline_value) / baseline_value * 100:+.0f}%"
+
+
+def compare(name, result, baseline, tolerance):
+    """Gets the regressions of a case against its baseline."""
+    if baseline is None:
+        return []
+    regressions = []
+    if result["p50"] > baseline["p50"] * (1 + tolerance):
+        regressions.append(
+            f"{name}: p50 {format_change(result['p50'], baseline['p50'])}"
+        )
+    # small allocations are noise in the peak RSS
+    if result["peak_mib"] > max(baseline["peak_mib"] * (1 + tolerance), 1):
+        change = format_change(result["peak_mib"], baseline["peak_mib"])
+        regressions.append(f"{name}: peak RSS {change}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument(
+        "--chunk-sizes",
+        type=int,
+        nargs="+",
+        default=[64, 256],
+        help="Payload sizes in MiB of the chunking cases",
+    )
+    parser.add_argument(
+        "--image-sizes",
+        type=int,
+        nargs="+",
+        default=[64, 128, 256],
+        help="Volume edge lengths of the image round trip cases",
+    )
+    parser.add_argument(
+        "--rpc-image-sizes",
+        type=int,
+        nargs="+",
+        default=[128, 256],
+        help="Volume edge lengths of the RPC and stream image cases",
+    )
+    parser.add_argument(
+        "--only", nargs="+", help="Glob patterns of the case names to run"
+    )
+    parser.add_argument(
+        "--case-timeout",
+        type=float,
+        default=CASE_TIMEOUT,
+        help="Seconds after which a case fails",
+    )
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Saves the results as the baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative change beyond which a case regresses",
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["cases"]
+
+    ctx = mp.get_context("spawn")
+    results = {}
+    regressions = []
+    failures = []
+    print(
+        f"{'case':<34} {'p50':>9} {'p90':>9} {'p99':>9} {'MiB/s':>8} "
+        f"{'peak':>8} {'vs p50':>7} {'vs peak':>7}"
+    )
+    for case in make_cases(args):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run_case, args=(case, args.repeat, queue))
+        proc.start()
+        result = wait_for_case(proc, queue, args.case_timeout)
+        proc.join()
+        if result is None:
+            print(f"{case.name:<34} failed with exit code {proc.exitcode}")
+            failures.append(case.name)
+            continue
+        results[case.name] = result
+
+        base = baseline.get(case.name, {})
+        throughput = result["throughput"]
+        throughput = f"{throughput:.0f}" if throughput else "-"
+        print(
+            f"{case.name:<34} {result['p50'] * 1000:>7.2f}ms "
+            f"{result['p90'] * 1000:>7.2f}ms {result['p99'] * 1000:>7.2f}ms "
+            f"{throughput:>8} "
+            f"{result['peak_mib']:>5.0f}MiB "
+            f"{format_change(result['p50'], base.get('p50')):>7} "
+            f"{format_change(result['peak_mib'], base.get('peak_mib')):>7}"
+        )
+        regressions.extend(
+            compare(case.name, result, baseline.get(case.name), args.tolerance)
+        )
+
+    if args.save_baseline:
+        baseline.update(results)
+        with open(args.baseline, "w") as fp:
+            json.dump(
+                {
+                    "machine": {
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "cpus": os.cpu_count(),
+                    },
+                    "cases": baseline,
+                },
+                fp,
+                indent=2,
+            )
+        print(f"Saved baseline to {args.baseline}")
+
+    if failures:
+        print("\nFailed cases:")
+        for name in failures:
+            print(f"  {name}")
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+    if failures or regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
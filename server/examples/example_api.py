@@ -1,17 +1,23 @@
 import asyncio
 from dataclasses import dataclass, field
-from concurrent.futures import ProcessPoolExecutor
 
 import aiohttp
 import itk
 
-from volview_server import VolViewApi, get_current_client_store, get_current_session
-from volview_server.transformers import (
-    convert_itk_to_vtkjs_image,
-    convert_vtkjs_to_itk_image,
+from volview_server import (
+    VolViewApi,
+    get_client_image,
+    get_current_client_store,
+    get_current_session,
 )
 
-volview = VolViewApi()
+
+def load_filters():
+    # loads the filter modules in each worker process ahead of the first call
+    itk.MedianImageFilter
+
+
+volview = VolViewApi(process_initializer=load_filters)
 
 ## basic examples ##
 
@@ -40,8 +46,6 @@ async def number_stream():
 
 ## median filter example ##
 
-process_pool = ProcessPoolExecutor(4)
-
 
 @dataclass
 class ClientState:
@@ -49,8 +53,7 @@ class ClientState:
     blurred_ids: set = field(init=False, default_factory=set)
 
 
-def do_median_filter(serialized_img, radius):
-    img = convert_vtkjs_to_itk_image(serialized_img)
+def do_median_filter(img, radius):
     ImageType = type(img)
 
     median_filter = itk.MedianImageFilter[ImageType, ImageType].New()
@@ -58,17 +61,7 @@ def do_median_filter(serialized_img, radius):
     median_filter.SetRadius(radius)
     median_filter.Update()
 
-    output = median_filter.GetOutput()
-    return convert_itk_to_vtkjs_image(output)
-
-
-async def run_median_filter_process(img, radius: int):
-    serialized_img = convert_itk_to_vtkjs_image(img)
-    loop = asyncio.get_event_loop()
-    serialized_output = await loop.run_in_executor(
-        process_pool, do_median_filter, serialized_img, radius
-    )
-    return convert_vtkjs_to_itk_image(serialized_output)
+    return median_filter.GetOutput()
 
 
 def associate_images(state, image_id, blurred_id):
@@ -90,7 +83,6 @@ async def show_image(img_id: str):
 
 @volview.expose("medianFilter")
 async def median_filter(img_id, radius):
-    # Use image-cache store directly (recommended approach)
     cache_store = get_current_client_store("image-cache")
     state = get_current_session(default_factory=ClientState)
 
@@ -99,14 +91,15 @@ async def median_filter(img_id, radius):
     # the blur operation on the original image.
     base_image_id = get_base_image(state, img_id)
 
-    img = await cache_store.getVtkImageData(base_image_id)
+    # Only fetches the image if the server has not cached its current contents
+    img = await get_client_image(base_image_id)
 
     if img is None:
         raise ValueError(f"No image found for ID: {base_image_id}")
 
     # we need to run the median filter in a subprocess,
     # since itk blocks the GIL.
-    output = await run_median_filter_process(img, radius)
+    output = await volview.run_in_process(do_median_filter, img, radius)
 
     blurred_id = state.image_id_map.get(base_image_id)
     images_store = get_current_client_store("images")
@@ -0,0 +1,24 @@
+import pytest
+
+
+class FakeClock:
+    """Stands in for the time module, with a clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    """Replaces the time module of the given modules with one FakeClock."""
+
+    def install(*modules):
+        clock = FakeClock()
+        for module in modules:
+            monkeypatch.setattr(module, "time", clock)
+        return clock
+
+    return install
@@ -0,0 +1,164 @@
+import asyncio
+import os
+
+import socketio
+from aiohttp import web
+from socketio import packet as sio_packet
+
+from volview_server.chunking import MIN_CHUNK_SIZE, ChunkingAsyncServer
+from volview_server.chunking.chunking_packet import ChunkedPacket
+
+CHUNK_SIZE = MIN_CHUNK_SIZE
+# seconds to wait for the server to catch up with the clients
+SETTLE_TIMEOUT = 5
+
+
+async def wait_until(predicate):
+    deadline = asyncio.get_running_loop().time() + SETTLE_TIMEOUT
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def start_server(server: ChunkingAsyncServer):
+    app = web.Application(client_max_size=server.eio.max_http_buffer_size)
+    server.attach(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "localhost", 0)
+    await site.start()
+    return runner, site._server.sockets[0].getsockname()[1]
+
+
+def chunked_event(event: str, data):
+    """Encodes a socket.io event as chunked engine.io messages."""
+    pkt = ChunkedPacket(sio_packet.EVENT, data=[event, data])
+    encoded = pkt.encode()
+    if not isinstance(encoded, list):
+        encoded = [encoded]
+    return [
+        chunk if isinstance(chunk, str) else bytes(chunk)
+        for msg in encoded
+        for chunk in ChunkedPacket.chunk_message(msg, CHUNK_SIZE)
+    ]
+
+
+def test_interleaved_uploads_are_reassembled_per_connection():
+    async def run():
+        server = ChunkingAsyncServer(chunk_size=CHUNK_SIZE)
+        received = {}
+
+        @server.on("upload")
+        async def upload(sid, data):
+            received[data["name"]] = data["payload"]
+
+        runner, port = await start_server(server)
+        uploads = {
+            "binary": os.urandom(10 * CHUNK_SIZE + 123),
+            "text": "x" * (6 * CHUNK_SIZE) + "end",
+            "dropped": os.urandom(12 * CHUNK_SIZE),
+        }
+        clients = {}
+        messages = {}
+        try:
+            for name, payload in uploads.items():
+                client = socketio.AsyncClient()
+                await client.connect(
+                    f"http://localhost:{port}", transports=["websocket"]
+                )
+                clients[name] = client
+                messages[name] = chunked_event(
+                    "upload", {"name": name, "payload": payload}
+                )
+                assert len(messages[name]) > 5
+
+            # sends the first half of every upload, a message from each
+            # client in turn
+            halves = {name: len(msgs) // 2 for name, msgs in messages.items()}
+            for i in range(max(halves.values())):
+                for name, msgs in messages.items():
+                    if i < halves[name]:
+                        await clients[name].eio.send(msgs[i])
+            sids = {name: client.eio.sid for name, client in clients.items()}
+            await wait_until(
+                lambda: all(sid in server._chunking_states for sid in sids.values())
+            )
+
+            await clients["dropped"].disconnect()
+            for name in ("binary", "text"):
+                for msg in messages[name][halves[name] :]:
+                    await clients[name].eio.send(msg)
+
+            await wait_until(lambda: len(received) == 2)
+            await wait_until(lambda: sids["dropped"] not in server._connections)
+        finally:
+            for client in clients.values():
+                await client.disconnect()
+            await runner.cleanup()
+
+        assert received["binary"] == uploads["binary"]
+        assert received["text"] == uploads["text"]
+        assert "dropped" not in received
+        # the disconnected upload's partial message is freed
+        assert sids["dropped"] not in server._chunking_states
+        assert server._chunking_states == {}
+
+    asyncio.run(run())
+
+
+def test_small_messages_are_not_chunked():
+    async def run():
+        server = ChunkingAsyncServer(chunk_size=CHUNK_SIZE)
+        received = asyncio.Queue()
+
+        @server.on("echo")
+        async def echo(sid, data):
+            received.put_nowait(data)
+
+        runner, port = await start_server(server)
+        client = socketio.AsyncClient()
+        try:
+            await client.connect(f"http://localhost:{port}", transports=["websocket"])
+            await client.emit("echo", {"value": 1})
+            assert await asyncio.wait_for(received.get(), SETTLE_TIMEOUT) == {
+                "value": 1
+            }
+        finally:
+            await client.disconnect()
+            await runner.cleanup()
+
+        assert server.transfer_stats.chunks_in == 0
+
+    asyncio.run(run())
+
+
+def test_oversized_chunked_messages_close_the_connection():
+    async def run():
+        server = ChunkingAsyncServer(
+            chunk_size=CHUNK_SIZE, max_message_size=4 * CHUNK_SIZE
+        )
+        runner, port = await start_server(server)
+        client = socketio.AsyncClient()
+        try:
+            await client.connect(f"http://localhost:{port}", transports=["websocket"])
+            sid = client.eio.sid
+            # claims far more chunks than max_message_size allows
+            await client.eio.send("C[1000000000]")
+            await client.eio.send(os.urandom(CHUNK_SIZE))
+            await wait_until(
+                lambda: sid in server._chunking_states
+                and server._chunking_states[sid].num_chunks == 1
+            )
+            assert len(server._chunking_states[sid].buffer) == 4 * CHUNK_SIZE
+
+            for _ in range(4):
+                await client.eio.send(os.urandom(CHUNK_SIZE))
+            await wait_until(lambda: sid not in server._connections)
+        finally:
+            await client.disconnect()
+            await runner.cleanup()
+
+        assert server._chunking_states == {}
+        assert server.transfer_stats.chunks_in == 5
+
+    asyncio.run(run())
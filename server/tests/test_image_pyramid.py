@@ -0,0 +1,158 @@
+import asyncio
+import gc
+
+import itk
+import numpy as np
+import pytest
+
+from volview_server.image_pyramid import (
+    PyramidCache,
+    build_pyramid,
+    halve_array,
+    pyramid_cache,
+)
+from volview_server.image_stream import get_image_pyramid, stream_image_pyramid
+from volview_server.session_store import MemorySessionStore
+from volview_server.transformers.exceptions import ConvertError
+
+
+def make_image(shape, dtype=np.float32):
+    pixels = np.random.default_rng(0).random(shape) * 100
+    image = itk.GetImageFromArray(pixels.astype(dtype))
+    image.SetSpacing([0.5, 1.5, 2.0][: len(shape)])
+    image.SetOrigin([3.0, -1.0, 7.0][: len(shape)])
+    return image
+
+
+@pytest.fixture(autouse=True)
+def empty_pyramid_cache():
+    pyramid_cache.clear()
+    yield
+    pyramid_cache.clear()
+
+
+def test_halving_averages_blocks():
+    array = np.arange(4 * 4 * 4, dtype=np.float32).reshape(4, 4, 4)
+    halved = halve_array(array)
+    assert halved.shape == (2, 2, 2)
+    assert halved[1, 0, 1] == array[2:4, 0:2, 2:4].mean()
+
+
+def test_halving_odd_axes_averages_the_edge_pixels():
+    array = np.arange(3 * 1 * 5, dtype=np.int16).reshape(3, 1, 5)
+    halved = halve_array(array)
+    assert halved.shape == (2, 1, 3)
+    assert halved.dtype == np.int16
+    assert halved[1, 0, 2] == array[2, 0, 4]
+    assert halved[0, 0, 2] == np.rint(array[0:2, 0, 4].mean())
+
+
+def test_levels_are_centered_on_the_blocks_they_average():
+    image = make_image((9, 13, 17))
+    direction = np.array([[0.0, -1.0, 0.0], [1.0, 0.0, 0.0], [0.0, 0.0, 1.0]])
+    image.SetDirection(itk.matrix_from_array(direction))
+
+    coarse, fine = build_pyramid(image, (4, 2))
+
+    for factor, level in ((4, coarse), (2, fine)):
+        expected_spacing = np.array(image.GetSpacing()) * factor
+        assert np.allclose(level.GetSpacing(), expected_spacing)
+        block = [
+            image.TransformIndexToPhysicalPoint([i, j, k])
+            for i in range(factor)
+            for j in range(factor)
+            for k in range(factor)
+        ]
+        center = level.TransformIndexToPhysicalPoint([0, 0, 0])
+        assert np.allclose(center, np.mean(block, axis=0))
+    assert list(coarse.GetLargestPossibleRegion().GetSize()) == [5, 4, 3]
+    assert list(fine.GetLargestPossibleRegion().GetSize()) == [9, 7, 5]
+
+
+def test_2d_images_have_pyramids():
+    image = make_image((10, 7))
+    (level,) = build_pyramid(image, (2,))
+    assert list(level.GetLargestPossibleRegion().GetSize()) == [4, 5]
+    assert np.array_equal(
+        itk.GetArrayViewFromImage(level),
+        halve_array(itk.GetArrayViewFromImage(image), spatial_dims=2),
+    )
+
+
+def test_4d_images_are_rejected():
+    with pytest.raises(ConvertError):
+        build_pyramid(itk.Image[itk.F, 4].New())
+
+
+def test_cached_pyramids_follow_their_images():
+    cache = PyramidCache()
+    image = make_image((8, 8, 8))
+    levels = build_pyramid(image, (2,))
+    cache.put(image, (2,), levels)
+
+    assert cache.get(image, (2,)) is levels
+    assert cache.get(image, (4, 2)) is None
+    image.Modified()
+    assert cache.get(image, (2,)) is None
+
+    cache.put(image, (2,), levels)
+    del image
+    gc.collect()
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_pyramids_are_evicted_over_budget():
+    images = [make_image((8, 8, 8)) for _ in range(3)]
+    pyramids = [build_pyramid(image, (2,)) for image in images]
+    level_nbytes = itk.GetArrayViewFromImage(pyramids[0][0]).nbytes
+    cache = PyramidCache(max_bytes=2 * level_nbytes)
+    for image, levels in zip(images, pyramids):
+        cache.put(image, (2,), levels)
+
+    assert cache.get(images[0], (2,)) is None
+    assert cache.get(images[2], (2,)) is pyramids[2]
+
+    cache.resize(level_nbytes)
+    assert len(cache) == 1
+
+
+def test_session_budgets_evict_pyramids_first():
+    image = make_image((32, 32, 32))
+    asyncio.run(get_image_pyramid(image))
+    store = MemorySessionStore(max_bytes=pyramid_cache.nbytes + 4096)
+
+    store.get_session("a", lambda: {"pixels": np.zeros(1024, dtype=np.uint8)})
+    assert len(pyramid_cache) == 1
+
+    store.get_session("b", lambda: {"pixels": np.zeros(4096, dtype=np.uint8)})
+    assert len(pyramid_cache) == 0
+    assert store.stats()["sessions"] == 2
+
+
+def test_streamed_pyramids_end_with_the_full_image():
+    image = make_image((6, 12, 10))
+    pixels = itk.GetArrayViewFromImage(image)
+
+    async def collect():
+        return [message async for message in stream_image_pyramid(image, 2048)]
+
+    messages = asyncio.run(collect())
+
+    assert messages[0]["type"] == "image"
+    assert messages[0]["image"]["extent"] == [0, 1, 0, 1, 0, 0]
+    assert [m["type"] for m in messages].count("levelReady") == 3
+    assert messages[-1]["type"] == "levelReady"
+
+    last_level = max(i for i, m in enumerate(messages) if m["type"] == "level")
+    assert messages[last_level]["image"]["extent"] == [0, 9, 0, 11, 0, 5]
+    received = np.zeros_like(pixels)
+    for message in messages[last_level + 1 : -1]:
+        x0, x1, y0, y1, z0, z1 = message["region"]["extent"]
+        values = np.frombuffer(message["region"]["scalars"]["values"], pixels.dtype)
+        received[z0 : z1 + 1, y0 : y1 + 1, x0 : x1 + 1] = values.reshape(
+            z1 - z0 + 1, y1 - y0 + 1, x1 - x0 + 1
+        )
+    assert np.array_equal(received, pixels)
+    # streaming the image again reuses its cached levels
+    assert len(pyramid_cache) == 1
@@ -0,0 +1,31 @@
+from volview_server.metrics import Counter, MetricsRegistry, merge_metrics
+
+
+def render_calls(count: int):
+    registry = MetricsRegistry()
+    calls = registry.add(Counter("calls_total", "Calls", ("endpoint",)))
+    calls.inc(("add",), count)
+    return registry.render()
+
+
+def test_merged_families_are_described_once():
+    merged = merge_metrics(
+        [render_calls(1), "", render_calls(2)], "worker"
+    ).splitlines()
+
+    assert merged == [
+        "# HELP calls_total Calls",
+        "# TYPE calls_total counter",
+        'calls_total{worker="0",endpoint="add"} 1.0',
+        'calls_total{worker="2",endpoint="add"} 2.0',
+    ]
+
+
+def test_families_missing_from_the_first_text_are_described():
+    merged = merge_metrics(["", render_calls(3)], "worker").splitlines()
+
+    assert merged == [
+        "# HELP calls_total Calls",
+        "# TYPE calls_total counter",
+        'calls_total{worker="1",endpoint="add"} 3.0',
+    ]
@@ -0,0 +1,59 @@
+import asyncio
+import gc
+import os
+
+import itk
+import numpy as np
+import pytest
+
+from volview_server.process_executor import ProcessExecutor
+
+SHM_DIR = "/dev/shm"
+
+
+def double(image):
+    doubled = itk.GetImageFromArray(itk.GetArrayViewFromImage(image) * 2)
+    doubled.CopyInformation(image)
+    return {"image": doubled, "label": "doubled"}
+
+
+def shared_memory_mappings():
+    with open("/proc/self/maps") as fp:
+        return sum("psm_" in line for line in fp)
+
+
+@pytest.fixture
+def executor():
+    executor = ProcessExecutor(num_processes=1)
+    yield executor
+    executor.shutdown()
+
+
+@pytest.mark.skipif(not os.path.isdir(SHM_DIR), reason="needs POSIX shared memory")
+def test_image_results_free_their_shared_memory_with_the_image(executor):
+    image = itk.GetImageFromArray(np.arange(4096, dtype=np.float32).reshape(16, 16, 16))
+    image.SetSpacing([0.5, 1.0, 2.0])
+    names = set(os.listdir(SHM_DIR))
+    mappings = shared_memory_mappings()
+
+    result = asyncio.run(executor.run(double, image))
+
+    doubled = result["image"]
+    assert result["label"] == "doubled"
+    assert list(doubled.GetSpacing()) == [0.5, 1.0, 2.0]
+    assert np.array_equal(
+        itk.GetArrayViewFromImage(doubled), itk.GetArrayViewFromImage(image) * 2
+    )
+    # the result is unlinked right away, but stays mapped while it is used
+    assert set(os.listdir(SHM_DIR)) == names
+    assert shared_memory_mappings() == mappings + 1
+
+    pixels = itk.GetArrayViewFromImage(doubled)
+    del result, doubled
+    gc.collect()
+    assert shared_memory_mappings() == mappings + 1
+    assert pixels[1, 0, 0] == 2 * 256
+
+    del pixels
+    gc.collect()
+    assert shared_memory_mappings() == mappings
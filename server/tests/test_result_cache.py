@@ -0,0 +1,132 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from volview_server import CachePolicy, VolViewApi
+from volview_server import result_cache
+from volview_server.result_cache import (
+    HASH_IN_THREAD_THRESHOLD,
+    MISSING,
+    ResultCache,
+    digest_args,
+)
+
+
+def digest(args):
+    return asyncio.run(digest_args(args))
+
+
+def test_digests_depend_on_content():
+    array = np.arange(12, dtype=np.int16).reshape(3, 4)
+    assert digest([array, {"a": 1, "b": 2}]) == digest([array.copy(), {"b": 2, "a": 1}])
+    assert digest([array]) != digest([array.astype(np.int32)])
+    assert digest([array]) != digest([array.reshape(4, 3)])
+    assert digest([[1, 2]]) != digest([(1, 2)])
+    assert digest(["1"]) != digest([1])
+
+
+def test_large_arrays_are_hashed_like_small_ones():
+    large = np.ones(HASH_IN_THREAD_THRESHOLD, dtype=np.uint16)
+    assert digest([large]) == digest([large.copy()])
+    large_changed = large.copy()
+    large_changed[-1] = 2
+    assert digest([large]) != digest([large_changed])
+
+
+def test_unhashable_arguments_raise_type_errors():
+    with pytest.raises(TypeError):
+        digest([object()])
+
+
+def test_least_recently_used_results_are_evicted():
+    cache = ResultCache(max_bytes=2500)
+    cache.put("a", np.zeros(1000, dtype=np.uint8))
+    cache.put("b", np.zeros(1000, dtype=np.uint8))
+    cache.get("a")
+    cache.put("c", np.zeros(1000, dtype=np.uint8))
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") is not MISSING
+    assert cache.get("c") is not MISSING
+    assert cache.nbytes <= cache.max_bytes
+
+
+def test_results_larger_than_the_budget_are_not_cached():
+    cache = ResultCache(max_bytes=100)
+    cache.put("a", np.zeros(1000, dtype=np.uint8))
+    assert len(cache) == 0
+    assert cache.nbytes == 0
+
+
+def test_results_expire_after_their_ttl(fake_clock):
+    clock = fake_clock(result_cache)
+    cache = ResultCache(ttl=10)
+    cache.put("a", 1)
+
+    clock.now += 9
+    assert cache.get("a") == 1
+    clock.now += 1
+    assert cache.get("a") is MISSING
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def make_api(policy):
+    api = VolViewApi()
+    calls = []
+
+    @api.expose(cache=policy)
+    async def add(a, b):
+        calls.append((a, b))
+        return {"sum": a + b}
+
+    @api.expose(cache=policy)
+    async def describe(obj):
+        calls.append(obj)
+        return repr(obj)
+
+    return api, calls
+
+
+def test_endpoint_results_are_cached_per_client():
+    async def run():
+        api, calls = make_api(True)
+        first = await api.invoke_rpc("add", 1, 2, client_id="a")
+        again = await api.invoke_rpc("add", 1, 2, client_id="a")
+        await api.invoke_rpc("add", 1, 3, client_id="a")
+        await api.invoke_rpc("add", 1, 2, client_id="b")
+
+        api.discard_cached_results("a")
+        await api.invoke_rpc("add", 1, 2, client_id="a")
+        await api.invoke_rpc("add", 1, 2, client_id="b")
+        return first, again, calls, api.cache_stats()["add"]
+
+    first, again, calls, stats = asyncio.run(run())
+    assert first == again == {"sum": 3}
+    assert calls == [(1, 2), (1, 3), (1, 2), (1, 2)]
+    assert stats["hits"] == 2
+    assert stats["entries"] == 2
+
+
+def test_global_results_are_shared_between_clients():
+    async def run():
+        api, calls = make_api(CachePolicy(scope="global"))
+        await api.invoke_rpc("add", 1, 2, client_id="a")
+        await api.invoke_rpc("add", 1, 2, client_id="b")
+        api.discard_cached_results("a")
+        await api.invoke_rpc("add", 1, 2, client_id="c")
+        return calls
+
+    assert asyncio.run(run()) == [(1, 2)]
+
+
+def test_calls_with_unhashable_arguments_are_not_cached():
+    async def run():
+        api, calls = make_api(True)
+        obj = object()
+        await api.invoke_rpc("describe", obj, client_id="a")
+        await api.invoke_rpc("describe", obj, client_id="a")
+        return calls
+
+    assert len(asyncio.run(run())) == 2
@@ -0,0 +1,54 @@
+import asyncio
+
+import socketio
+from aiohttp import web
+
+from volview_server import VolViewApi
+from volview_server.__main__ import create_app
+from volview_server.rpc_server import STREAM_WINDOW
+
+# seconds to wait for results that should arrive
+RESULT_TIMEOUT = 5
+# seconds to wait for results that should not arrive
+QUIET_PERIOD = 0.3
+
+
+def test_streams_without_a_window_are_flow_controlled():
+    volview = VolViewApi()
+
+    @volview.expose
+    async def count():
+        for i in range(2 * STREAM_WINDOW):
+            yield i
+
+    async def run():
+        app = await create_app(volview, metrics_path=None)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "localhost", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+
+        results = asyncio.Queue()
+        client = socketio.AsyncClient()
+        client.on("stream:result", results.put_nowait)
+        try:
+            await client.connect(
+                f"http://localhost:{port}?clientId=test", transports=["websocket"]
+            )
+            await client.emit("stream:call", {"rpcId": "1", "name": "count"})
+            for i in range(STREAM_WINDOW):
+                result = await asyncio.wait_for(results.get(), RESULT_TIMEOUT)
+                assert result["data"] == i
+            # out of credits
+            await asyncio.sleep(QUIET_PERIOD)
+            assert results.empty()
+
+            await client.emit("stream:credit", {"rpcId": "1", "credits": 1})
+            result = await asyncio.wait_for(results.get(), RESULT_TIMEOUT)
+            assert result["data"] == STREAM_WINDOW
+        finally:
+            await client.disconnect()
+            await runner.cleanup()
+
+    asyncio.run(run())
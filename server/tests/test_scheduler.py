@@ -0,0 +1,105 @@
+import asyncio
+
+from volview_server.scheduler import Priority, Scheduler
+
+
+async def run_call(scheduler, order, client_id, endpoint="call", **kwargs):
+    async with scheduler.slot(client_id, endpoint, **kwargs):
+        order.append(client_id)
+        await asyncio.sleep(0)
+
+
+async def hold_slot(scheduler, release: asyncio.Event):
+    async with scheduler.slot("holder", "hold"):
+        await release.wait()
+
+
+async def start(coros):
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    # lets every call reach its queue
+    await asyncio.sleep(0)
+    return tasks
+
+
+def test_clients_take_turns():
+    async def run():
+        scheduler = Scheduler(slots=1)
+        release = asyncio.Event()
+        order = []
+        holder = await start([hold_slot(scheduler, release)])
+        calls = await start(
+            [run_call(scheduler, order, "a") for _ in range(4)]
+            + [run_call(scheduler, order, "b") for _ in range(2)]
+        )
+        assert scheduler.stats()["queued_by_client"] == {"a": 4, "b": 2}
+
+        release.set()
+        await asyncio.gather(*holder, *calls)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(run())
+    # b does not wait behind all of a's calls
+    assert order == ["a", "b", "a", "b", "a", "a"]
+    assert stats["running"] == 0
+    assert stats["queued"] == 0
+
+
+def test_interactive_calls_run_before_batch_calls():
+    async def run():
+        scheduler = Scheduler(slots=1)
+        release = asyncio.Event()
+        order = []
+        holder = await start([hold_slot(scheduler, release)])
+        calls = await start(
+            [
+                run_call(scheduler, order, "batch", priority=Priority.BATCH),
+                run_call(scheduler, order, "interactive"),
+            ]
+        )
+        release.set()
+        await asyncio.gather(*holder, *calls)
+        return order
+
+    assert asyncio.run(run()) == ["interactive", "batch"]
+
+
+def test_max_concurrency_caps_running_calls():
+    async def run():
+        scheduler = Scheduler()
+        running = 0
+        peak = 0
+
+        async def call(client_id):
+            nonlocal running, peak
+            async with scheduler.slot(client_id, "capped", max_concurrency=2):
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(call(f"client{i % 3}") for i in range(9)))
+        return peak
+
+    assert asyncio.run(run()) == 2
+
+
+def test_cancelled_calls_leave_the_queue():
+    async def run():
+        scheduler = Scheduler(slots=1)
+        release = asyncio.Event()
+        order = []
+        holder = await start([hold_slot(scheduler, release)])
+        cancelled, kept = await start(
+            [run_call(scheduler, order, "a"), run_call(scheduler, order, "b")]
+        )
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        assert scheduler.stats()["queued_by_client"] == {"b": 1}
+
+        release.set()
+        await asyncio.gather(*holder, kept)
+        return order, scheduler.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == ["b"]
+    assert stats["running"] == 0
@@ -0,0 +1,114 @@
+import numpy as np
+import pytest
+
+from volview_server import session_store
+from volview_server.session_store import (
+    SESSION_MEASURE_INTERVAL,
+    EvictionReason,
+    MemorySessionStore,
+)
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def clock(fake_clock):
+    return fake_clock(session_store)
+
+
+def make_session(nbytes=MiB):
+    return {"pixels": np.zeros(nbytes, dtype=np.uint8)}
+
+
+def record_evictions(store):
+    evictions = []
+    store.add_eviction_hook(
+        lambda client_id, session, reason: evictions.append((client_id, reason))
+    )
+    return evictions
+
+
+def test_idle_sessions_expire(clock):
+    store = MemorySessionStore(ttl=10)
+    evictions = record_evictions(store)
+    store.get_session("a", dict)
+    store.get_session("b", dict)
+
+    clock.now += 6
+    store.get_session("b")
+    clock.now += 6
+    store.expire()
+
+    assert evictions == [("a", EvictionReason.EXPIRED)]
+    assert store.get_session("a") is None
+    assert store.get_session("b") == {}
+
+
+def test_least_recently_used_sessions_are_evicted_over_budget(clock):
+    store = MemorySessionStore(max_bytes=int(3.5 * MiB))
+    evictions = record_evictions(store)
+    for client_id in ("a", "b", "c"):
+        store.get_session(client_id, make_session)
+    store.get_session("a")
+
+    store.get_session("d", make_session)
+
+    assert evictions == [("b", EvictionReason.OVER_BUDGET)]
+    assert store.stats()["sessions"] == 3
+    assert store.stats()["nbytes"] <= store.max_bytes
+
+
+def test_the_session_in_use_is_never_evicted(clock):
+    store = MemorySessionStore(max_bytes=MiB // 2)
+    evictions = record_evictions(store)
+
+    session = store.get_session("a", make_session)
+
+    assert store.get_session("a") is session
+    assert evictions == []
+
+
+def test_sessions_changed_in_place_are_measured_again(clock):
+    store = MemorySessionStore(max_bytes=int(1.5 * MiB))
+    evictions = record_evictions(store)
+    store.get_session("a", dict)["pixels"] = np.zeros(MiB, dtype=np.uint8)
+    store.get_session("b", make_session)
+    # a was measured as it was created, and is not measured again so soon
+    assert evictions == []
+
+    clock.now += SESSION_MEASURE_INTERVAL
+    store.get_session("b")
+
+    assert evictions == [("a", EvictionReason.OVER_BUDGET)]
+
+
+def test_spilled_sessions_are_restored(clock, tmp_path):
+    store = MemorySessionStore(max_bytes=int(1.5 * MiB), spill_dir=str(tmp_path))
+    evictions = record_evictions(store)
+    store.get_session("a", make_session)["name"] = "a"
+    store.get_session("b", make_session)
+
+    assert evictions == [("a", EvictionReason.SPILLED)]
+    assert store.stats()["spilled_sessions"] == 1
+    (spilled_a,) = tmp_path.iterdir()
+
+    restored = store.get_session("a")
+
+    assert restored["name"] == "a"
+    assert restored["pixels"].nbytes == MiB
+    # b is spilled to make room for a, whose spill file is removed
+    assert evictions[1:] == [("b", EvictionReason.SPILLED)]
+    (spilled_b,) = tmp_path.iterdir()
+    assert spilled_b != spilled_a
+    assert store.stats()["spilled_sessions"] == 1
+
+
+def test_removed_sessions_are_evicted_once(clock):
+    store = MemorySessionStore()
+    evictions = record_evictions(store)
+    store.get_session("a", dict)
+
+    store.remove("a")
+    store.remove("a")
+
+    assert evictions == [("a", EvictionReason.REMOVED)]
@@ -0,0 +1,39 @@
+from dataclasses import dataclass
+
+from volview_server.transformers import TransformDispatcher, transformer
+
+
+@dataclass
+class Celsius:
+    degrees: float
+
+
+@dataclass
+class Kelvin:
+    degrees: float
+
+
+@transformer(Celsius)
+def to_kelvin(temperature: Celsius):
+    return Kelvin(temperature.degrees + 273.15)
+
+
+@transformer(Kelvin)
+def to_float(temperature: Kelvin):
+    return temperature.degrees
+
+
+def test_transformers_see_the_output_of_earlier_transformers():
+    dispatcher = TransformDispatcher()
+    transformers = [to_kelvin, to_float]
+
+    assert dispatcher.transform(Celsius(0), transformers) == 273.15
+    assert dispatcher.transform(
+        {"min": Celsius(-10), "max": [Kelvin(300), Celsius(10)]}, transformers
+    ) == {"min": 263.15, "max": [300, 283.15]}
+
+
+def test_earlier_transformers_do_not_see_later_outputs():
+    dispatcher = TransformDispatcher()
+
+    assert dispatcher.transform(Celsius(0), [to_float, to_kelvin]) == Kelvin(273.15)
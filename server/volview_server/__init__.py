@@ -1,8 +1,42 @@
 __version__ = "0.1.0"
 __author__ = "Kitware, Inc."
-__all__ = ["VolViewApi", "RpcRouter", "get_current_client_store", "get_current_session"]
+__all__ = [
+    "VolViewApi",
+    "RpcRouter",
+    "CachePolicy",
+    "get_current_client_store",
+    "gather_client_store",
+    "get_client_image",
+    "update_client_image_region",
+    "get_current_session",
+    "get_current_image_cache",
+    "on_session_evicted",
+    "SessionStore",
+    "MemorySessionStore",
+    "EvictionReason",
+    "stream_image",
+    "stream_image_pyramid",
+    "propagate_context_var",
+]
 
 from volview_server.volview_api import VolViewApi
 from volview_server.rpc_router import RpcRouter
-from volview_server.client_store import get_current_client_store
-from volview_server.session import get_current_session
+from volview_server.result_cache import CachePolicy
+from volview_server.client_store import (
+    get_current_client_store,
+    gather_client_store,
+    get_client_image,
+    update_client_image_region,
+)
+from volview_server.session import (
+    get_current_session,
+    get_current_image_cache,
+    on_session_evicted,
+)
+from volview_server.session_store import (
+    SessionStore,
+    MemorySessionStore,
+    EvictionReason,
+)
+from volview_server.image_stream import stream_image, stream_image_pyramid
+from volview_server.process_executor import propagate_context_var
@@ -2,14 +2,34 @@ import sys
 import re
 import os
 import argparse
+import functools
 import importlib
 import logging
+from typing import Optional
 
 from aiohttp import web
 
 from volview_server.volview_api import VolViewApi
-from volview_server.rpc_server import RpcServer
-from volview_server.chunking import CHUNK_SIZE
+from volview_server.rpc_server import (
+    DISCONNECT_GRACE_PERIOD,
+    STREAM_MAX_QUEUED_BYTES,
+    RpcServer,
+)
+from volview_server.chunking import (
+    CHUNK_SIZE,
+    MIN_CHUNK_SIZE,
+    MAX_CHUNK_SIZE,
+    MAX_MESSAGE_SIZE,
+)
+from volview_server.image_cache import IMAGE_CACHE_SIZE
+from volview_server.image_pyramid import PYRAMID_CACHE_SIZE
+from volview_server.metrics import METRICS_PATH, make_aiohttp_handler
+from volview_server.session_store import MemorySessionStore
+from volview_server.workers import run_workers
+from volview_server.transformers.compression import (
+    COMPRESSION_THRESHOLD,
+    available_codecs,
+)
 
 
 def parse_args():
@@ -23,10 +43,114 @@ def parse_args():
     parser.add_argument(
         "--verbose", default=False, action="store_true", help="Enable verbose logging."
     )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=CHUNK_SIZE,
+        help="Default message chunk size in bytes",
+    )
+    parser.add_argument(
+        "--min-chunk-size",
+        type=int,
+        default=MIN_CHUNK_SIZE,
+        help="Smallest chunk size a client can negotiate",
+    )
+    parser.add_argument(
+        "--max-chunk-size",
+        type=int,
+        default=MAX_CHUNK_SIZE,
+        help="Largest chunk size a client can negotiate",
+    )
+    parser.add_argument(
+        "--max-message-size",
+        type=int,
+        default=MAX_MESSAGE_SIZE,
+        help="Largest chunked message in bytes a client can send",
+    )
+    parser.add_argument(
+        "--adaptive-chunking",
+        default=False,
+        action="store_true",
+        help="Adjust chunk sizes from measured upload throughput.",
+    )
+    parser.add_argument(
+        "--compression",
+        default=None,
+        help="Comma-separated codecs for image payloads, in order of preference, "
+        f"or 'none'. Available: {','.join(available_codecs())}",
+    )
+    parser.add_argument(
+        "--compression-threshold",
+        type=int,
+        default=COMPRESSION_THRESHOLD,
+        help="Smallest image array in bytes to compress",
+    )
+    parser.add_argument(
+        "--image-cache-size",
+        type=int,
+        default=IMAGE_CACHE_SIZE,
+        help="Byte budget of each client's image cache",
+    )
+    parser.add_argument(
+        "--pyramid-cache-size",
+        type=int,
+        default=PYRAMID_CACHE_SIZE,
+        help="Byte budget of the image pyramids cached by each server process",
+    )
+    parser.add_argument(
+        "--session-ttl",
+        type=float,
+        default=None,
+        help="Seconds before an idle client's session is evicted",
+    )
+    parser.add_argument(
+        "--session-max-bytes",
+        type=int,
+        default=None,
+        help="Byte budget of all sessions and image caches",
+    )
+    parser.add_argument(
+        "--session-spill-dir",
+        default=None,
+        help="Directory to spill sessions to once over the byte budget",
+    )
+    parser.add_argument(
+        "--stream-max-queued-bytes",
+        type=int,
+        default=STREAM_MAX_QUEUED_BYTES,
+        help="Bytes of stream results to send ahead of a client",
+    )
+    parser.add_argument(
+        "--disconnect-grace-period",
+        type=float,
+        default=DISCONNECT_GRACE_PERIOD,
+        help="Seconds a disconnected client has to reconnect before its calls "
+        "are cancelled and its session is discarded",
+    )
+    parser.add_argument(
+        "--metrics-path",
+        default=METRICS_PATH,
+        help="Path that serves Prometheus metrics, or 'none'",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of server processes. Clients are routed to a process by "
+        "client ID.",
+    )
     parser.add_argument("api_script", help="Python file that exposes ServerApi")
     return parser.parse_args()
 
 
+def parse_codecs(codecs: Optional[str]):
+    if codecs is None:
+        return None
+    if codecs == "none":
+        return []
+    return codecs.split(",")
+
+
 def import_api_script(api_script_file: str):
     api_script_file = os.path.abspath(api_script_file)
     import_target = os.path.basename(api_script_file)
@@ -44,30 +168,51 @@ def import_api_script(api_script_file: str):
     return instance
 
 
+async def create_app(
+    api: VolViewApi, *, metrics_path: Optional[str] = METRICS_PATH, **kwargs
+):
+    rpc_server = RpcServer(api, async_mode="aiohttp", **kwargs)
+
+    async def stop(app):
+        await rpc_server.teardown()
+
+    app = web.Application(client_max_size=rpc_server.sio.eio.max_http_buffer_size)
+    rpc_server.sio.attach(app)
+    if metrics_path:
+        app.router.add_get(metrics_path, make_aiohttp_handler(rpc_server.metrics))
+    rpc_server.setup()
+    app.on_shutdown.append(stop)
+    return app
+
+
 def run_server(
     api: VolViewApi,
     *,
     host: str,
     port: int,
     debug: bool = False,
+    metrics_path: Optional[str] = METRICS_PATH,
+    workers: int = 1,
     **kwargs,
 ):
-    rpc_server = RpcServer(api, async_mode="aiohttp", **kwargs)
-
     if debug:
         logging.basicConfig(level=logging.DEBUG)
 
-    async def stop(app):
-        await rpc_server.teardown()
-
-    async def start():
-        app = web.Application(client_max_size=CHUNK_SIZE)
-        rpc_server.sio.attach(app)
-        rpc_server.setup()
-        app.on_shutdown.append(stop)
-        return app
-
-    web.run_app(start(), host=host, port=port)
+    if workers > 1:
+        app_factory = functools.partial(
+            create_app, api, metrics_path=metrics_path, **kwargs
+        )
+        run_workers(
+            app_factory,
+            workers=workers,
+            host=host,
+            port=port,
+            metrics_path=metrics_path,
+        )
+    else:
+        web.run_app(
+            create_app(api, metrics_path=metrics_path, **kwargs), host=host, port=port
+        )
 
 
 def main(args):
@@ -81,12 +226,31 @@ def main(args):
         host=args.host,
         port=args.port,
         debug=args.verbose,
+        metrics_path=None if args.metrics_path == "none" else args.metrics_path,
+        workers=args.workers,
         # socketio.AsyncServer kwargs
         async_handlers=True,
         cors_allowed_origins="*",
         logger=args.verbose,
         engineio_logger=args.verbose,
-        max_http_buffer_size=CHUNK_SIZE,
+        # ChunkingAsyncServer kwargs
+        chunk_size=args.chunk_size,
+        min_chunk_size=args.min_chunk_size,
+        max_chunk_size=args.max_chunk_size,
+        max_message_size=args.max_message_size,
+        adaptive_chunking=args.adaptive_chunking,
+        # RpcServer kwargs
+        compression_codecs=parse_codecs(args.compression),
+        compression_threshold=args.compression_threshold,
+        pyramid_cache_size=args.pyramid_cache_size,
+        session_store=MemorySessionStore(
+            ttl=args.session_ttl,
+            max_bytes=args.session_max_bytes,
+            image_cache_size=args.image_cache_size,
+            spill_dir=args.session_spill_dir,
+        ),
+        stream_max_queued_bytes=args.stream_max_queued_bytes,
+        disconnect_grace_period=args.disconnect_grace_period,
     )
 
 
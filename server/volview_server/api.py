@@ -1,13 +1,27 @@
-import asyncio
 import inspect
-from typing import Any, List, Callable, Union
-from contextvars import copy_context
+from typing import Any, Dict, List, Callable, Optional, Union
 from concurrent.futures import ThreadPoolExecutor
 
-from volview_server.rpc_router import RpcRouter, ExposeType
+from volview_server.invokers import (
+    AsyncRpcInvoker,
+    EndpointInvoker,
+    ProcessRpcInvoker,
+    RpcInvoker,
+    StreamInvoker,
+    ThreadRpcInvoker,
+)
+from volview_server.metrics import StageTimer
+from volview_server.process_executor import ProcessExecutor
+from volview_server.result_cache import CachePolicy, CacheScope
+from volview_server.rpc_router import (
+    RpcRouter,
+    EndpointInfo,
+    ExposeType,
+    ExecutorType,
+)
+from volview_server.scheduler import Priority, Scheduler
 from volview_server.transformers import (
-    pipe,
-    transform_object,
+    TransformDispatcher,
     default_serializers,
     default_deserializers,
     Transformer,
@@ -25,17 +39,98 @@ class RpcApi:
         num_threads: int = DEFAULT_NUM_THREADS,
         serializers: List[Transformer] = default_serializers,
         deserializers: List[Transformer] = default_deserializers,
+        num_processes: Optional[int] = None,
+        process_initializer: Optional[Callable[[], Any]] = None,
     ):
-        self.serializers = serializers or []
-        self.deserializers = deserializers or []
-        self._default_router = RpcRouter()
-        self._routers = [self._default_router]
+        """
+        Keyword Arguments:
+            - num_threads: size of the thread pool for non-async endpoints.
+            - num_processes: size of the process pool for endpoints exposed
+              with executor="process". Defaults to the number of CPUs.
+            - process_initializer: called in each worker process as it
+              starts, such as to load the ITK filters that endpoints use.
+        """
+        # copied, so that appending to them leaves the defaults untouched
+        self.serializers = list(serializers or [])
+        self.deserializers = list(deserializers or [])
+        self._serializer_dispatch = TransformDispatcher()
+        self._deserializer_dispatch = TransformDispatcher()
         self._thread_pool = ThreadPoolExecutor(num_threads)
+        self._process_executor = ProcessExecutor(num_processes, process_initializer)
+        # calls are queued here rather than in the pools, so that they can be
+        # scheduled fairly. Async endpoints and streams are only limited by
+        # their endpoints' max_concurrency.
+        self._schedulers = {
+            ExecutorType.THREAD: Scheduler(num_threads),
+            ExecutorType.PROCESS: Scheduler(self._process_executor.num_processes),
+            None: Scheduler(),
+        }
+        self._routers: List[RpcRouter] = []
+        # endpoint name -> invoker, for the endpoints of all routers
+        self._invokers: Dict[str, EndpointInvoker] = {}
+        self._default_router = RpcRouter()
+        self.add_router(self._default_router)
 
     def add_router(self, router: RpcRouter):
+        """Adds the endpoints of a router, including ones added to it later.
+
+        If routers have endpoints of the same name, the endpoint of the
+        router that was added first is used. The default router of expose()
+        is always first.
+        """
         self._routers.append(router)
+        router.add_listener(self._index_endpoint)
+        for name in router.endpoints:
+            self._index_endpoint(name)
 
-    def expose(self, name_or_func: Union[str, Callable], transform_args=True):
+    def _index_endpoint(self, name: str):
+        for router in self._routers:
+            if name in router.endpoints:
+                fn, info = router.endpoints[name]
+                invoker = self._invokers.get(name)
+                # an endpoint that is already indexed keeps its invoker, and
+                # with it its cached results
+                if invoker is None or invoker.info is not info:
+                    self._invokers[name] = self._create_invoker(fn, info)
+                return
+
+    def _create_invoker(self, fn: Callable, info: EndpointInfo) -> EndpointInvoker:
+        transforms = {"deserialize": None, "serialize": None}
+        if info.transform_args:
+            transforms = {
+                "deserialize": self.deserialize_object,
+                "serialize": self.serialize_object,
+            }
+
+        if info.type == ExposeType.STREAM:
+            return StreamInvoker(fn, info, self._schedulers[None], **transforms)
+        if inspect.iscoroutinefunction(fn):
+            return AsyncRpcInvoker(fn, info, self._schedulers[None], **transforms)
+        if info.executor == ExecutorType.PROCESS:
+            return ProcessRpcInvoker(
+                fn,
+                info,
+                self._schedulers[ExecutorType.PROCESS],
+                process_executor=self._process_executor,
+                **transforms,
+            )
+        return ThreadRpcInvoker(
+            fn,
+            info,
+            self._schedulers[ExecutorType.THREAD],
+            thread_pool=self._thread_pool,
+            **transforms,
+        )
+
+    def expose(
+        self,
+        name_or_func: Union[str, Callable, None] = None,
+        transform_args=True,
+        executor: Union[str, ExecutorType] = ExecutorType.THREAD,
+        priority: Union[str, Priority] = Priority.INTERACTIVE,
+        max_concurrency: Optional[int] = None,
+        cache: Union[bool, CachePolicy, None] = None,
+    ):
         """Decorator that exposes a function as an RPC endpoint.
 
         See RpcRouter.add_endpoint() for more info.
@@ -51,22 +146,55 @@ class RpcApi:
         def internal_name():
             ...
 
+        CPU-bound functions can run in a pool of worker processes:
+
+        @volview.expose(executor="process")
+        def my_filter(image):
+            ...
+
+        Results of pure functions can be memoized by their arguments:
+
+        @volview.expose(cache=CachePolicy(ttl=600, scope="global"))
+        def my_filter(image):
+            ...
+
         Keyword arguments:
             - transform_args(=true): transform input arguments and output
               results. Disable this if you do not want transform overhead
               or you want to explicitly transform your inputs and outputs.
+            - executor(="thread"): "thread" or "process".
+            - priority(="interactive"): "interactive" or "batch".
+            - max_concurrency: the most calls of this endpoint that may run
+              at once.
+            - cache: True or a CachePolicy, to memoize results.
+
+        See RpcRouter.add_endpoint() for details on these options.
         """
         if callable(name_or_func):
             fn = name_or_func
             name = fn.__name__
-            self._default_router.add_endpoint(name, fn, transform_args=transform_args)
+            self._default_router.add_endpoint(
+                name,
+                fn,
+                transform_args=transform_args,
+                executor=executor,
+                priority=priority,
+                max_concurrency=max_concurrency,
+                cache=cache,
+            )
             return fn
-        elif type(name_or_func) is str:
+        elif name_or_func is None or type(name_or_func) is str:
             name = name_or_func
 
             def add_endpoint(fn):
                 self._default_router.add_endpoint(
-                    name, fn, transform_args=transform_args
+                    name or fn.__name__,
+                    fn,
+                    transform_args=transform_args,
+                    executor=executor,
+                    priority=priority,
+                    max_concurrency=max_concurrency,
+                    cache=cache,
                 )
                 return fn
 
@@ -74,13 +202,77 @@ class RpcApi:
         else:
             raise TypeError("not given a name or function")
 
-    def _find_endpoint(self, rpc_name: str):
-        for router in self._routers:
-            if rpc_name in router.endpoints:
-                return router.endpoints[rpc_name]
-        raise KeyError(f"Cannot find RPC endpoint {rpc_name}")
+    def has_process_endpoints(self):
+        return any(
+            isinstance(invoker, ProcessRpcInvoker)
+            for invoker in self._invokers.values()
+        )
+
+    def start_process_pool(self):
+        """Starts the worker processes ahead of the first call."""
+        self._process_executor.start()
+
+    def shutdown_process_pool(self):
+        self._process_executor.shutdown()
+
+    async def run_in_process(self, fn: Callable, *args):
+        """Runs a function in the process pool and returns its result.
+
+        ITK images in the arguments and result are passed through shared
+        memory. See expose() for running endpoints in the process pool.
+        """
+        return await self._process_executor.run(fn, *args)
 
-    async def invoke_rpc(self, rpc_name: str, *args, asyncio_loop=None, context=None):
+    def scheduler_stats(self):
+        """Gets the queue depths and wait times of endpoint calls.
+
+        Stats are given for calls run in the thread pool ("thread"), in the
+        process pool ("process"), and for async endpoints and streams
+        ("async"). See Scheduler.stats().
+        """
+        return {
+            (executor.value if executor else "async"): scheduler.stats()
+            for executor, scheduler in self._schedulers.items()
+        }
+
+    def cache_stats(self):
+        """Gets the hits, misses and size of each cached endpoint's results.
+
+        See ResultCache.stats().
+        """
+        return {
+            name: invoker.cache.stats()
+            for name, invoker in self._invokers.items()
+            if invoker.cache is not None
+        }
+
+    def discard_cached_results(self, client_id: str):
+        """Discards the cached results of a client.
+
+        Results cached with the "global" scope are kept.
+        """
+        for invoker in self._invokers.values():
+            if (
+                invoker.cache is not None
+                and invoker.info.cache.scope == CacheScope.CLIENT
+            ):
+                invoker.cache.discard_client(client_id)
+
+    def _find_invoker(self, rpc_name: str) -> EndpointInvoker:
+        try:
+            return self._invokers[rpc_name]
+        except KeyError:
+            raise KeyError(f"Cannot find RPC endpoint {rpc_name}") from None
+
+    async def invoke_rpc(
+        self,
+        rpc_name: str,
+        *args,
+        asyncio_loop=None,
+        context=None,
+        client_id: str = "",
+        timer: Optional[StageTimer] = None,
+    ):
         """Invokes an RPC endpoint.
 
         If the endpoint is a non-async function, then it is run in an asyncio
@@ -89,47 +281,41 @@ class RpcApi:
         If no asyncio_loop is given, the default running loop is used.
 
         If no context is given, the current context is copied.
-        """
-        fn, info = self._find_endpoint(rpc_name)
 
-        if info.type != ExposeType.RPC:
-            raise TypeError(f"Cannot invoke a non-RPC endpoint")
+        The call is queued with the calls of other clients, identified by
+        client_id, until the endpoint's executor has room to run it.
 
-        if info.transform_args:
-            args = [self.serialize_object(obj) for obj in args]
-
-        if inspect.iscoroutinefunction(fn):
-            result = await fn(*args)
-        else:
-            loop = asyncio_loop or asyncio.get_running_loop()
-            ctx = context or copy_context()
-            result = await loop.run_in_executor(self._thread_pool, ctx.run, fn, *args)
-
-        if info.transform_args:
-            result = self.serialize_object(result)
-
-        return result
+        If a timer is given, the deserialize, queue, execute and serialize
+        stages of the call are timed with it.
+        """
+        invoker = self._find_invoker(rpc_name)
+        if not isinstance(invoker, RpcInvoker):
+            raise TypeError(f"Cannot invoke a non-RPC endpoint")
+        return await invoker.invoke(
+            args, client_id, timer or StageTimer(), asyncio_loop, context
+        )
 
-    async def invoke_stream(self, stream_name: str, *args):
+    async def invoke_stream(
+        self,
+        stream_name: str,
+        *args,
+        client_id: str = "",
+        timer: Optional[StageTimer] = None,
+    ):
         """Invokes a stream endpoint.
 
-        This is an async generator that produces result data.
+        This is an async generator that produces result data. A slot is held
+        for the lifetime of the stream. See invoke_rpc(). The execute stage
+        of each result is the time the endpoint took to produce it.
         """
-        fn, info = self._find_endpoint(stream_name)
-
-        if info.type != ExposeType.STREAM:
+        invoker = self._find_invoker(stream_name)
+        if not isinstance(invoker, StreamInvoker):
             raise TypeError(f"Cannot stream from a non-stream endpoint")
-
-        if info.transform_args:
-            args = [self.serialize_object(obj) for obj in args]
-
-        async for data in fn(*args):
-            if info.transform_args:
-                data = self.deserialize_object(data)
+        async for data in invoker.invoke(args, client_id, timer or StageTimer()):
             yield data
 
     def serialize_object(self, obj: Any):
-        return transform_object(obj, lambda o: pipe(o, *self.serializers))
+        return self._serializer_dispatch.transform(obj, self.serializers)
 
     def deserialize_object(self, obj: Any):
-        return transform_object(obj, lambda o: pipe(o, *self.deserializers))
+        return self._deserializer_dispatch.transform(obj, self.deserializers)
@@ -1,4 +1,15 @@
-__all__ = ["CHUNK_SIZE", "ChunkingAsyncServer"]
+__all__ = [
+    "CHUNK_SIZE",
+    "MIN_CHUNK_SIZE",
+    "MAX_CHUNK_SIZE",
+    "MAX_MESSAGE_SIZE",
+    "ChunkingAsyncServer",
+]
 
-from .chunking_packet import CHUNK_SIZE
+from .chunking_packet import (
+    CHUNK_SIZE,
+    MIN_CHUNK_SIZE,
+    MAX_CHUNK_SIZE,
+    MAX_MESSAGE_SIZE,
+)
 from .chunking_server import ChunkingAsyncServer
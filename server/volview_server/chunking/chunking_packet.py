@@ -1,12 +1,25 @@
+import base64
 import json
 from typing import List, Union
 
+import numpy as np
+from engineio import packet as eio_packet
 from socketio.packet import Packet
 
 CHUNK_SIZE = 1 * 1024 * 1024
+MIN_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+# largest chunked message a server will reassemble
+MAX_MESSAGE_SIZE = 2 * 1024 * 1024 * 1024
 CHUNKED_PACKET_TYPE = "C"
 
-EncodedMessage = Union[str, bytes]
+EncodedMessage = Union[str, bytes, memoryview]
+
+
+def message_size(msg: EncodedMessage) -> int:
+    if isinstance(msg, memoryview):
+        return msg.nbytes
+    return len(msg)
 
 
 class ChunkedPacket(Packet):
@@ -35,40 +48,86 @@ class ChunkedPacket(Packet):
     us how many messages should be concatenated together to re-form the ith
     message.
 
-    Chunking works on both string and binary messages.
-    """
-
-    def encode(self):
-        encoded_packet = super().encode()
-        msgs = encoded_packet if type(encoded_packet) is list else [encoded_packet]
+    Binary attachments may be bytes, bytearrays, memoryviews or numpy arrays,
+    so serialized images can reference their pixel buffers without copying
+    them.
 
-        # skip chunking info if all messages are smaller than chunk size.
-        if all(len(msg) <= CHUNK_SIZE for msg in msgs):
-            return msgs
+    Chunking works on both string and binary messages. Binary messages are
+    chunked into memoryviews over the original buffer, so no copy is made
+    until the transport writes each chunk. See ChunkViewPacket.
 
-        output: List[EncodedMessage] = []
-        chunked_sizes: List[int] = []
-
-        for msg in msgs:
-            chunks = self._chunk_message(msg)
-            chunked_sizes.append(len(chunks))
-            output.extend(chunks)
-
-        return [
-            f"{CHUNKED_PACKET_TYPE}{json.dumps(chunked_sizes, separators=(',', ':'))}",
-            *output,
-        ]
+    The chunk size is negotiated per connection, so packets are encoded as
+    plain socket.io messages and each message is chunked as it is sent to a
+    connection (see chunk_message). A message that is larger than the chunk
+    size is sent as `C[N]` followed by its N chunks.
+    """
 
-    def _chunk_message(self, msg: EncodedMessage) -> List[Union[str, bytes]]:
+    @classmethod
+    def _deconstruct_binary_internal(cls, data, attachments):
+        # numpy arrays and memoryviews are sent as views of their buffers
+        if isinstance(data, np.ndarray):
+            data = memoryview(np.ascontiguousarray(data)).cast("B")
+        if isinstance(data, memoryview):
+            attachments.append(data)
+            return {"_placeholder": True, "num": len(attachments) - 1}
+        return super()._deconstruct_binary_internal(data, attachments)
+
+    @classmethod
+    def data_is_binary(cls, data):
+        if isinstance(data, (memoryview, np.ndarray)):
+            return True
+        return super().data_is_binary(data)
+
+    @classmethod
+    def chunk_message(
+        cls, msg: EncodedMessage, chunk_size: int = CHUNK_SIZE
+    ) -> List[EncodedMessage]:
+        """Chunks a message, prefixed with its chunking message.
+
+        Returns the message as-is if it fits within the chunk size.
+        """
+        if message_size(msg) <= chunk_size:
+            return [msg]
         if type(msg) is str:
-            return self._chunk_str(msg)
-        if type(msg) is bytes:
-            return self._chunk_bytes(msg)
+            chunks = cls._chunk_str(msg, chunk_size)
+        else:
+            chunks = cls._chunk_bytes(msg, chunk_size)
+        return [cls.make_chunking_message([len(chunks)]), *chunks]
+
+    @staticmethod
+    def make_chunking_message(chunked_sizes: List[int]) -> str:
+        return (
+            f"{CHUNKED_PACKET_TYPE}{json.dumps(chunked_sizes, separators=(',', ':'))}"
+        )
+
+    @staticmethod
+    def _chunk_str(string: str, chunk_size: int) -> List[str]:
+        return [string[o : o + chunk_size] for o in range(0, len(string), chunk_size)]
+
+    @staticmethod
+    def _chunk_bytes(
+        binary: Union[bytes, memoryview], chunk_size: int
+    ) -> List[memoryview]:
+        view = memoryview(binary).cast("B")
+        return [view[o : o + chunk_size] for o in range(0, len(view), chunk_size)]
+
+
+class ChunkViewPacket(eio_packet.Packet):
+    """An engine.io binary message that wraps a memoryview.
+
+    engine.io only recognizes bytes and bytearray as binary data, and the
+    websocket drivers only send bytes. This packet keeps the view until the
+    transport encodes it, so only the chunk currently being written is ever
+    copied out of the original buffer.
+    """
 
-    def _chunk_str(self, string: str) -> List[str]:
-        return [string[o : o + CHUNK_SIZE] for o in range(0, len(string), CHUNK_SIZE)]
+    def __init__(self, view: memoryview):
+        super().__init__(eio_packet.MESSAGE)
+        self.data = view
+        self.binary = True
 
-    def _chunk_bytes(self, binary: bytes) -> List[bytes]:
-        # TODO can we get memoryview working here?
-        # at the moment, memoryview doesn't serialize properly.
-        return [binary[o : o + CHUNK_SIZE] for o in range(0, len(binary), CHUNK_SIZE)]
+    def encode(self, b64=False):
+        # no encode cache: cached chunk copies would add up to the full payload
+        if b64:
+            return "b" + base64.b64encode(self.data).decode("utf-8")
+        return self.data.tobytes()
@@ -1,62 +1,340 @@
 import json
-from typing import List
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
 
+from engineio import packet as eio_packet
 from socketio import AsyncServer
+from socketio import packet as sio_packet
 
-from .chunking_packet import ChunkedPacket, CHUNKED_PACKET_TYPE
+from .chunking_packet import (
+    ChunkedPacket,
+    ChunkViewPacket,
+    CHUNK_SIZE,
+    CHUNKED_PACKET_TYPE,
+    MAX_CHUNK_SIZE,
+    MAX_MESSAGE_SIZE,
+    MIN_CHUNK_SIZE,
+    message_size,
+)
+
+CHUNK_SIZE_QS = "chunkSize"
+CHUNKING_CONFIG_EVENT = "chunking:config"
+# adaptive chunking aims for chunks that take this long to transfer
+ADAPTIVE_CHUNK_TIME = 0.1  # seconds
+# weight of the newest throughput sample
+ADAPTIVE_SMOOTHING = 0.3
+
+
+@dataclass
+class ChunkingState:
+    """Reassembly state for one engine.io connection."""
+
+    # number of chunks that make up each remaining message
+    chunking_info: List[int]
+    # chunks and bytes received so far for the current message
+    num_chunks: int = 0
+    message_bytes: int = 0
+    # string chunks of the current message
+    chunks: List[str] = field(default_factory=list)
+    # preallocated destination of the current binary message
+    buffer: Optional[bytearray] = None
+    offset: int = 0
+    # for throughput measurements
+    start_time: float = field(default_factory=time.monotonic)
+    num_bytes: int = 0
+
+
+@dataclass
+class TransferStats:
+    """Totals of the engine.io messages sent and received by a server."""
+
+    bytes_in: int = 0
+    bytes_out: int = 0
+    messages_in: int = 0
+    messages_out: int = 0
+    # messages that are chunks of a larger message
+    chunks_in: int = 0
+    chunks_out: int = 0
+
+
+@dataclass
+class ConnectionChunking:
+    """Negotiated chunking parameters for one engine.io connection."""
+
+    chunk_size: int
+    # namespace that receives chunking config updates
+    namespace: Optional[str] = None
+    # smoothed upload throughput, in bytes per second
+    throughput: Optional[float] = None
 
 
 class ChunkingAsyncServer(AsyncServer):
     """A socket.io server that handles chunked messages.
 
+    Chunk reassembly state is tracked per engine.io session, so chunked
+    messages from concurrent clients never mix. Chunked binary messages are
+    written into a single preallocated bytearray as their chunks arrive, and
+    that bytearray is handed to socket.io as the binary attachment.
+
+    The chunk size is negotiated per connection. A client may request one
+    with the `chunkSize` query parameter, which the server clamps to its
+    limits. Once connected, the client receives the accepted chunk size in a
+    `chunking:config` event. With adaptive chunking, the chunk size is
+    re-derived from the measured throughput of chunked uploads and the client
+    is sent the new value.
+
+    A chunked message larger than max_message_size is never reassembled:
+    the connection that sends it is closed. The chunking message only claims
+    a number of chunks, so the buffer preallocated for a binary message is
+    capped at max_message_size as well.
+
+    Totals of the messages and chunks sent and received are kept in
+    transfer_stats.
+
     See ChunkedPacket for more info.
     """
 
-    def __init__(self, *args, **kwargs):
+    chunk_size: int
+    min_chunk_size: int
+    max_chunk_size: int
+    max_message_size: int
+    adaptive_chunking: bool
+    transfer_stats: TransferStats
+
+    # eio sid -> chunk reassembly state
+    _chunking_states: Dict[str, ChunkingState]
+    # eio sid -> negotiated chunking
+    _connections: Dict[str, ConnectionChunking]
+
+    def __init__(
+        self,
+        *args,
+        chunk_size: int = CHUNK_SIZE,
+        min_chunk_size: int = MIN_CHUNK_SIZE,
+        max_chunk_size: int = MAX_CHUNK_SIZE,
+        max_message_size: int = MAX_MESSAGE_SIZE,
+        adaptive_chunking: bool = False,
+        **kwargs,
+    ):
+        """
+        Keyword Arguments:
+            - chunk_size: chunk size for clients that do not request one.
+            - min_chunk_size: smallest chunk size a connection can use.
+            - max_chunk_size: largest chunk size a connection can use.
+            - max_message_size: largest chunked message a connection can send.
+            - adaptive_chunking: adjust chunk sizes from measured throughput.
+
+        All other arguments are passed to socketio.AsyncServer. The
+        max_http_buffer_size option defaults to max_chunk_size.
+        """
+        if not 0 < min_chunk_size <= max_chunk_size:
+            raise ValueError("Invalid chunk size limits")
+
+        kwargs.setdefault("max_http_buffer_size", max_chunk_size)
         super().__init__(*args, serializer=ChunkedPacket, **kwargs)
-        self._chunks = None
-        self._chunking_info = None
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+        self.max_message_size = max_message_size
+        self.chunk_size = self._clamp_chunk_size(chunk_size)
+        self.adaptive_chunking = adaptive_chunking
+        self.transfer_stats = TransferStats()
+        self._chunking_states = {}
+        self._connections = {}
+
+    def get_chunk_size(self, eio_sid: str) -> int:
+        """Gets the chunk size used for a given engine.io session."""
+        connection = self._connections.get(eio_sid)
+        return connection.chunk_size if connection else self.chunk_size
+
+    def _clamp_chunk_size(self, chunk_size: int) -> int:
+        return max(self.min_chunk_size, min(chunk_size, self.max_chunk_size))
+
+    async def _send_packet(self, eio_sid, pkt):
+        encoded_packet = pkt.encode()
+        if not isinstance(encoded_packet, list):
+            encoded_packet = [encoded_packet]
+        for ep in encoded_packet:
+            await self._send_eio_packet(
+                eio_sid, eio_packet.Packet(eio_packet.MESSAGE, ep)
+            )
+
+    async def _send_eio_packet(self, eio_sid, eio_pkt):
+        if eio_pkt.packet_type != eio_packet.MESSAGE or not isinstance(
+            eio_pkt.data, (str, bytes, bytearray, memoryview)
+        ):
+            await super()._send_eio_packet(eio_sid, eio_pkt)
+            return
+
+        messages = ChunkedPacket.chunk_message(
+            eio_pkt.data, self.get_chunk_size(eio_sid)
+        )
+        stats = self.transfer_stats
+        stats.bytes_out += sum(message_size(msg) for msg in messages)
+        stats.messages_out += len(messages)
+        if len(messages) > 1:
+            # excludes the chunking message
+            stats.chunks_out += len(messages) - 1
+
+        if len(messages) == 1 and not isinstance(eio_pkt.data, memoryview):
+            await super()._send_eio_packet(eio_sid, eio_pkt)
+            return
+
+        for msg in messages:
+            if isinstance(msg, memoryview):
+                msg_pkt = ChunkViewPacket(msg)
+            else:
+                msg_pkt = eio_packet.Packet(eio_packet.MESSAGE, msg)
+            await super()._send_eio_packet(eio_sid, msg_pkt)
+
+    async def _handle_eio_connect(self, eio_sid, environ):
+        qs = parse_qs(environ.get("QUERY_STRING", ""))
+        try:
+            (requested,) = qs.get(CHUNK_SIZE_QS, [self.chunk_size])
+            chunk_size = self._clamp_chunk_size(int(requested))
+        except ValueError:
+            chunk_size = self.chunk_size
+
+        self._connections[eio_sid] = ConnectionChunking(chunk_size)
+        return await super()._handle_eio_connect(eio_sid, environ)
+
+    async def _handle_connect(self, eio_sid, namespace, data):
+        await super()._handle_connect(eio_sid, namespace, data)
+
+        namespace = namespace or "/"
+        sid = self.manager.sid_from_eio_sid(eio_sid, namespace)
+        connection = self._connections.get(eio_sid)
+        if connection and sid and self.manager.is_connected(sid, namespace):
+            connection.namespace = namespace
+            await self._send_chunking_config(eio_sid, connection)
+
+    async def _send_chunking_config(self, eio_sid, connection: ConnectionChunking):
+        await self._send_packet(
+            eio_sid,
+            self.packet_class(
+                sio_packet.EVENT,
+                namespace=connection.namespace,
+                data=[CHUNKING_CONFIG_EVENT, {"chunkSize": connection.chunk_size}],
+            ),
+        )
 
     async def _handle_eio_message(self, eio_sid, data):
-        if self._chunking_info is not None and len(self._chunking_info):
-            self._chunks.append(data)
+        stats = self.transfer_stats
+        stats.bytes_in += len(data)
+        stats.messages_in += 1
 
-            if len(self._chunks) == self._chunking_info[0]:
-                await super()._handle_eio_message(
-                    eio_sid, self._reconstruct_chunks(self._chunks)
+        state = self._chunking_states.get(eio_sid)
+        if state is not None:
+            stats.chunks_in += 1
+            if state.message_bytes + len(data) > self.max_message_size:
+                self.logger.warning(
+                    "Closing %s: chunked message exceeds %d bytes",
+                    eio_sid,
+                    self.max_message_size,
                 )
-                self._chunks = []
-                self._chunking_info.pop(0)
+                # the remaining chunks would be taken for regular messages
+                del self._chunking_states[eio_sid]
+                await self.eio.disconnect(eio_sid)
+                return
+
+            self._add_chunk(state, data)
+
+            if state.num_chunks == state.chunking_info[0]:
+                message = self._reconstruct_chunks(state)
+                # update the state before handing off the message, since
+                # the next chunks may arrive while the message is handled.
+                state.chunking_info.pop(0)
+                if len(state.chunking_info) == 0:
+                    del self._chunking_states[eio_sid]
+                    if self.adaptive_chunking:
+                        await self._adapt_chunk_size(eio_sid, state)
 
-            if len(self._chunking_info) == 0:
-                # reset chunking state
-                self._chunks = None
-                self._chunking_info = None
+                await super()._handle_eio_message(eio_sid, message)
         elif type(data) is str and data[0] == CHUNKED_PACKET_TYPE:
-            self._chunks = []
-            self._chunking_info = self._try_parse_chunking_info(data[1:])
+            chunking_info = self._try_parse_chunking_info(data[1:])
+            if len(chunking_info):
+                self._chunking_states[eio_sid] = ChunkingState(chunking_info)
         else:
             await super()._handle_eio_message(eio_sid, data)
 
+    async def _handle_eio_disconnect(self, eio_sid, reason):
+        self._chunking_states.pop(eio_sid, None)
+        self._connections.pop(eio_sid, None)
+        await super()._handle_eio_disconnect(eio_sid, reason)
+
+    async def _adapt_chunk_size(self, eio_sid: str, state: ChunkingState):
+        connection = self._connections.get(eio_sid)
+        elapsed = time.monotonic() - state.start_time
+        if not connection or elapsed <= 0:
+            return
+
+        throughput = state.num_bytes / elapsed
+        if connection.throughput is None:
+            connection.throughput = throughput
+        else:
+            connection.throughput += ADAPTIVE_SMOOTHING * (
+                throughput - connection.throughput
+            )
+
+        # round down to a power of two so small fluctuations don't cause
+        # a config update on every upload.
+        target = max(1, int(connection.throughput * ADAPTIVE_CHUNK_TIME))
+        chunk_size = self._clamp_chunk_size(1 << (target.bit_length() - 1))
+        if chunk_size != connection.chunk_size:
+            connection.chunk_size = chunk_size
+            if connection.namespace is not None:
+                await self._send_chunking_config(eio_sid, connection)
+
     def _try_parse_chunking_info(self, data: str):
         info = json.loads(data)
         if type(info) is not list:
             raise TypeError("chunking info is not a list")
 
-        if not all(type(v) is int for v in info):
-            raise TypeError("chunking info is not comprised of integers")
+        if not all(type(v) is int and v > 0 for v in info):
+            raise TypeError("chunking info is not comprised of positive integers")
 
         return info
 
-    def _reconstruct_chunks(self, chunks):
-        if all(type(c) is str for c in chunks):
-            return self._reconstruct_string(chunks)
-        if all(type(c) is bytes for c in chunks):
-            return self._reconstruct_binary(chunks)
-        raise TypeError("Received a set of unknown chunks")
+    def _add_chunk(self, state: ChunkingState, chunk):
+        if type(chunk) is str and state.buffer is None:
+            state.chunks.append(chunk)
+        elif isinstance(chunk, (bytes, bytearray)) and not state.chunks:
+            if state.buffer is None:
+                # Every chunk but the last one is a full chunk, so the first
+                # chunk bounds the size of the whole message. The chunk count
+                # comes from the client, so the bound is capped. The buffer
+                # still grows if later chunks are larger than the first.
+                state.buffer = bytearray(
+                    min(len(chunk) * state.chunking_info[0], self.max_message_size)
+                )
+            end = state.offset + len(chunk)
+            state.buffer[state.offset : end] = chunk
+            state.offset = end
+        else:
+            raise TypeError("Received a set of unknown chunks")
+        state.num_chunks += 1
+        state.message_bytes += len(chunk)
+        state.num_bytes += len(chunk)
+
+    def _reconstruct_chunks(self, state: ChunkingState):
+        if state.buffer is not None:
+            message = self._reconstruct_binary(state.buffer, state.offset)
+        else:
+            message = self._reconstruct_string(state.chunks)
+
+        state.num_chunks = 0
+        state.message_bytes = 0
+        state.chunks = []
+        state.buffer = None
+        state.offset = 0
+        return message
 
     def _reconstruct_string(self, chunks: List[str]):
         return "".join(chunks)
 
-    def _reconstruct_binary(self, chunks: List[bytes]):
-        return b"".join(chunks)
+    def _reconstruct_binary(self, buffer: bytearray, size: int):
+        # Trims the unused tail of the last chunk. This shrinks the
+        # bytearray in place, so the message is never copied.
+        del buffer[size:]
+        return buffer
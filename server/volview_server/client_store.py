@@ -1,12 +1,15 @@
 from dataclasses import dataclass
-from typing import List, Union, Any
+from typing import List, Union, Any, Optional, Sequence
 
 from volview_server.rpc_server import current_server
+from volview_server.session import get_current_image_cache
+from volview_server.transformers.image_data import itk_region_to_vtk
 
 PropKey = Union[int, str]
 
 RPC_GET_VALUE = "getStoreProperty"
 RPC_CALL_METHOD = "callStoreMethod"
+RPC_BATCH_CALLS = "batchStoreCalls"
 
 
 def get_current_server():
@@ -19,6 +22,8 @@ def get_current_server():
 @dataclass
 class StoreOptions:
     transform_args: bool = True
+    # seconds to wait for the client, or None for the server default
+    timeout: Optional[float] = None
 
 
 class PropertyDescriptor:
@@ -50,6 +55,7 @@ class ClientStoreMethodCallDescriptor(PropertyDescriptor):
                 RPC_CALL_METHOD,
                 [self.store_id, self.prop_chain, self.args],
                 transform_args=self.options.transform_args,
+                timeout=self.options.timeout,
             )
             .__await__()
         )
@@ -79,6 +85,7 @@ class ClientStorePropertyDescriptor(PropertyDescriptor):
                 RPC_GET_VALUE,
                 [self.store_id, self.prop_chain],
                 transform_args=self.options.transform_args,
+                timeout=self.options.timeout,
             )
             .__await__()
         )
@@ -102,6 +109,120 @@ def get_current_client_store(store_name: str, **kwargs):
     This should only be called from inside an RPC endpoint.
 
     The methods and properties accessed through this client store proxy are not bound to a client until awaited.
+
+    Keyword arguments:
+        - transform_args(=true): transform the call arguments and results.
+        - timeout: seconds to wait for each store access before raising an
+          RpcTimeoutError. Defaults to the server's future_timeout.
     """
     options = StoreOptions(**kwargs)
     return ClientStore(store_name, options)
+
+
+async def gather_client_store(
+    *descriptors: PropertyDescriptor, return_exceptions: bool = False
+):
+    """Awaits several client store properties and method calls at once.
+
+    This should only be called from inside an RPC endpoint.
+
+    All of the accesses are sent to the client in one RPC, so they take a
+    single round trip. The client runs them in the given order, and the
+    results are returned in the same order.
+
+        store = get_current_client_store('images')
+        id_list, metadata = await gather_client_store(
+            store.idList, store.metadata
+        )
+
+    If return_exceptions is false, the first failed access raises its
+    exception. Otherwise, exceptions are returned in place of results.
+    Each access is transformed according to the options of its store, and the
+    longest timeout of the stores applies to the whole batch.
+    """
+    if not descriptors:
+        return []
+
+    server = get_current_server()
+    calls = []
+    for descriptor in descriptors:
+        call = [descriptor.store_id, descriptor.prop_chain]
+        if isinstance(descriptor, ClientStoreMethodCallDescriptor):
+            args = list(descriptor.args)
+            if descriptor.options.transform_args:
+                args = [server.api.serialize_object(arg) for arg in args]
+            call.append(args)
+        elif not isinstance(descriptor, ClientStorePropertyDescriptor):
+            raise TypeError(f"{descriptor!r} is not a client store access")
+        calls.append(call)
+
+    timeouts = [descriptor.options.timeout for descriptor in descriptors]
+    # the server default applies if any store did not set a timeout
+    timeout = None if None in timeouts else max(timeouts)
+
+    batch_results = await server.call_client(
+        RPC_BATCH_CALLS, [calls], transform_args=False, timeout=timeout
+    )
+
+    results = []
+    for descriptor, (ok, data) in zip(descriptors, batch_results):
+        if not ok:
+            exc = Exception(data)
+            if not return_exceptions:
+                raise exc
+            results.append(exc)
+        elif descriptor.options.transform_args:
+            results.append(server.api.deserialize_object(data))
+        else:
+            results.append(data)
+    return results
+
+
+async def get_client_image(image_id: str, **kwargs):
+    """Gets an image from the client, reusing it if it is already cached.
+
+    This should only be called from inside an RPC endpoint.
+
+    The client is asked for a digest of the image contents first, and the
+    image is only fetched if the current client's image cache has no image
+    with that ID and digest. Fetched images are added to the image cache.
+    Images are not cached if the client cannot compute a digest.
+
+    Returns None if the client has no such image.
+
+    Keyword arguments are the same as get_current_client_store().
+    """
+    image_cache = get_current_image_cache()
+    store = get_current_client_store("image-cache", **kwargs)
+
+    digest = await store.getImageDigest(image_id)
+    if digest:
+        image = image_cache.get(image_id, digest)
+        if image is not None:
+            return image
+
+    image = await store.getVtkImageData(image_id)
+    if image is not None and digest:
+        image_cache.put(image_id, digest, image)
+    return image
+
+
+async def update_client_image_region(
+    image_id: str, image, index: Sequence[int], size: Sequence[int], **kwargs
+):
+    """Sends a changed region of an image to the client.
+
+    This should only be called from inside an RPC endpoint.
+
+    Only the pixels inside the region are sent, and the client writes them
+    into its existing image with the given ID. The region is given by its
+    index and size in ITK (x, y, z) order. The image must have the same
+    geometry as the client's image.
+
+    Keyword arguments are the same as get_current_client_store().
+    """
+    region = itk_region_to_vtk(image, index, size)
+    # the client's image changes, so any cached copy is stale
+    get_current_image_cache().invalidate(image_id)
+    store = get_current_client_store("image-cache", **kwargs)
+    await store.updateVTKImageDataRegion(image_id, region)
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+import pickle
+import struct
+from abc import ABC, abstractmethod
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Set
+
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+# seconds between attempts to reach the hub
+HUB_RETRY_INTERVAL = 1.0
+
+# message length prefix of the hub protocol
+_FRAME_HEADER = struct.Struct("!Q")
+
+logger = logging.getLogger("volview_server.cluster")
+
+# message -> None
+MessageHandler = Callable[[Dict[str, Any]], None]
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    (size,) = _FRAME_HEADER.unpack(await reader.readexactly(_FRAME_HEADER.size))
+    return await reader.readexactly(size)
+
+
+def _write_frame(writer: asyncio.StreamWriter, frame: bytes):
+    writer.write(_FRAME_HEADER.pack(len(frame)))
+    writer.write(frame)
+
+
+class ClusterManager(AsyncPubSubManager, ABC):
+    """Shares rooms and client RPCs between the processes of a server.
+
+    Pass an instance to RpcServer with the client_manager option. Emits to a
+    room reach the room's clients in every process, and call_client() reaches
+    clients that are connected to another process.
+
+    Subclasses implement _publish(message) and _receive() for a message
+    broker. Messages are dicts that may hold numpy arrays.
+    """
+
+    name = "volview"
+
+    def __init__(self, channel: str = "volview", **kwargs):
+        super().__init__(channel=channel, **kwargs)
+        # method -> handler
+        self._handlers: Dict[str, MessageHandler] = {}
+
+    def on_message(self, method: str, handler: MessageHandler):
+        """Calls handler(message) for messages of a method from other processes.
+
+        Handlers run on the listening task, so they should not block.
+        """
+        self._handlers[method] = handler
+
+    async def publish(self, method: str, **data):
+        """Sends a message to the other processes."""
+        await self._publish({**data, "method": method, "host_id": self.host_id})
+
+    @abstractmethod
+    async def _publish(self, data: Dict[str, Any]):
+        """Sends a message to every process, including this one."""
+
+    @abstractmethod
+    def _receive(self) -> AsyncIterator[Dict[str, Any]]:
+        """Iterates over the messages published on the channel."""
+
+    async def _listen(self):
+        async for message in self._receive():
+            handler = self._handlers.get(message.get("method"))
+            if handler is None:
+                # a socket.io message
+                yield message
+            elif message.get("host_id") != self.host_id:
+                try:
+                    handler(message)
+                except Exception:
+                    logger.exception(f"Handler of {message['method']} failed")
+
+
+class LocalClusterManager(ClusterManager):
+    """Shares messages between the processes on a host through a ClusterHub."""
+
+    def __init__(self, hub_path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.hub_path = hub_path
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _connect(self):
+        async with self._connect_lock:
+            attempts = 0
+            while self._writer is None:
+                try:
+                    self._reader, self._writer = await asyncio.open_unix_connection(
+                        self.hub_path
+                    )
+                except OSError:
+                    # the hub may still be starting
+                    if attempts:
+                        logger.warning(f"Could not reach the hub at {self.hub_path}")
+                    attempts += 1
+                    await asyncio.sleep(HUB_RETRY_INTERVAL)
+
+    def _disconnect(self):
+        if self._writer:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def _publish(self, data):
+        await self._connect()
+        _write_frame(self._writer, pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+        await self._writer.drain()
+
+    async def _receive(self):
+        while True:
+            await self._connect()
+            try:
+                frame = await _read_frame(self._reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("Lost the connection to the hub")
+                self._disconnect()
+                continue
+            yield pickle.loads(frame)
+
+
+class ClusterHub:
+    """Relays the messages of LocalClusterManagers over a Unix socket.
+
+    Every message is sent to all other connected managers.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._handlers: Set[asyncio.Task] = set()
+
+    async def start(self):
+        self._server = await asyncio.start_unix_server(self._on_connection, self.path)
+
+    async def close(self):
+        if self._server:
+            self._server.close()
+            self._server = None
+        for writer in list(self._writers):
+            writer.close()
+        # the handlers see the connections end
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def _on_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        self._writers.add(writer)
+        self._handlers.add(asyncio.current_task())
+        try:
+            while True:
+                frame = await _read_frame(reader)
+                peers = [peer for peer in self._writers if peer is not writer]
+                for peer in peers:
+                    _write_frame(peer, frame)
+                await asyncio.gather(
+                    *(peer.drain() for peer in peers), return_exceptions=True
+                )
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # the loop is shutting down, such as after a Ctrl-C that reached
+            # every process. Ending quietly keeps asyncio from logging it.
+            pass
+        finally:
+            self._writers.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
@@ -2,3 +2,9 @@ class KeyExistsError(Exception):
     """A given key already exists."""
 
     ...
+
+
+class RpcTimeoutError(TimeoutError):
+    """An RPC did not complete in time."""
+
+    ...
@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import itk
+import numpy as np
+
+from volview_server.transformers.image_data import is_itk_image_type
+
+IMAGE_CACHE_SIZE = 1024 * 1024 * 1024  # bytes
+
+
+def image_nbytes(image: Any) -> int:
+    """Gets the number of bytes held by an image's pixel buffer."""
+    if is_itk_image_type(type(image)) or type(image).__name__.startswith(
+        "itkVectorImage"
+    ):
+        return itk.GetArrayViewFromImage(image).nbytes
+    if isinstance(image, np.ndarray):
+        return image.nbytes
+    raise TypeError(f"Cannot determine the size of {type(image).__name__}")
+
+
+class ImageCache:
+    """A least-recently-used cache of deserialized client images.
+
+    Images are keyed by client image ID and a digest of the image contents,
+    so a cached image is only reused while the client's image is unchanged.
+    Only the latest contents of each image ID are kept.
+
+    Images are evicted, least recently used first, once the total size of the
+    cached pixel buffers exceeds max_bytes. An image that is larger than
+    max_bytes is not cached.
+    """
+
+    max_bytes: int
+    nbytes: int
+
+    def __init__(self, max_bytes: int = IMAGE_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        # image ID -> (digest, image, nbytes)
+        self._entries: OrderedDict[str, Tuple[str, Any, int]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, image_id: str):
+        return image_id in self._entries
+
+    def get(self, image_id: str, digest: str) -> Optional[Any]:
+        """Gets a cached image, or None if it is missing or stale."""
+        entry = self._entries.get(image_id)
+        if entry is None or entry[0] != digest:
+            return None
+        self._entries.move_to_end(image_id)
+        return entry[1]
+
+    def put(self, image_id: str, digest: str, image: Any, nbytes: int = None):
+        """Caches an image, replacing any previous contents of the image ID."""
+        if nbytes is None:
+            nbytes = image_nbytes(image)
+
+        self.invalidate(image_id)
+        if nbytes > self.max_bytes:
+            return
+
+        self._entries[image_id] = (digest, image, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, _, evicted_nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+
+    def invalidate(self, image_id: str):
+        """Removes an image from the cache."""
+        entry = self._entries.pop(image_id, None)
+        if entry is not None:
+            self.nbytes -= entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
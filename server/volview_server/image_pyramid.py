@@ -0,0 +1,217 @@
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence, Tuple
+
+import itk
+import numpy as np
+
+from volview_server.image_cache import image_nbytes
+from volview_server.transformers.exceptions import ConvertError
+from volview_server.transformers.image_data import is_itk_image_type
+
+# downsampling factors of the preview levels, coarsest first
+PYRAMID_FACTORS = (8, 4, 2)
+# holds the levels of a 2048x2048x1024 int16 image, which take up 1.14 GiB
+PYRAMID_CACHE_SIZE = 2 * 1024 * 1024 * 1024  # bytes
+# input bytes averaged at once, which bounds the memory used while downsampling
+DOWNSAMPLE_SLAB_SIZE = 64 * 1024 * 1024  # bytes
+
+
+def _halve_slab(slab: np.ndarray, spatial_dims: int, dtype) -> np.ndarray:
+    """Averages 2x2x2 blocks of a slab of slices.
+
+    Pairs of planes are summed along each axis in turn. The last plane of an
+    odd axis has no pair, so it is doubled, which averages the blocks at odd
+    edges over the pixels they hold.
+    """
+    accumulator = np.result_type(slab.dtype, np.float32)
+    for axis in range(spatial_dims):
+        length = slab.shape[axis]
+        pairs = length // 2
+
+        def planes(start, stop=None, step=None):
+            return (slice(None),) * axis + (slice(start, stop, step),)
+
+        shape = list(slab.shape)
+        shape[axis] = (length + 1) // 2
+        summed = np.empty(shape, dtype=accumulator)
+        np.add(
+            slab[planes(0, 2 * pairs, 2)],
+            slab[planes(1, 2 * pairs, 2)],
+            out=summed[planes(0, pairs)],
+            dtype=accumulator,
+        )
+        if length % 2:
+            np.multiply(
+                slab[planes(-1, None)],
+                2,
+                out=summed[planes(pairs, None)],
+                dtype=accumulator,
+            )
+        slab = summed
+
+    slab /= 2**spatial_dims
+    if np.issubdtype(dtype, np.integer):
+        np.rint(slab, out=slab)
+    return slab.astype(dtype, copy=False)
+
+
+def halve_array(array: np.ndarray, spatial_dims: int = 3) -> np.ndarray:
+    """Downsamples a ZYX(C) pixel array by 2 along its spatial axes.
+
+    Each output pixel is the average of a 2x2x2 block of input pixels, and
+    integer pixels are rounded to the nearest integer. Spatial axes of size
+    one are kept as is. The array is averaged in slabs of slices, so that
+    only one slab at a time is held at a wider pixel type.
+    """
+    shape = list(array.shape)
+    for axis in range(spatial_dims):
+        shape[axis] = (shape[axis] + 1) // 2
+    halved = np.empty(shape, dtype=array.dtype)
+
+    slice_nbytes = max(1, array[:1].nbytes)
+    slab_depth = max(2, DOWNSAMPLE_SLAB_SIZE // slice_nbytes // 2 * 2)
+    for start in range(0, array.shape[0], slab_depth):
+        slab = array[start : start + slab_depth]
+        halved[start // 2 : (start + len(slab) + 1) // 2] = _halve_slab(
+            slab, spatial_dims, array.dtype
+        )
+    return halved
+
+
+def _level_image(itk_image, pixels: np.ndarray, factor: int):
+    """Wraps pixels downsampled by factor in an image of the same type and space."""
+    level = itk.GetImageViewFromArray(pixels, ttype=type(itk_image))
+    spacing = np.array(itk_image.GetSpacing(), dtype=float)
+    direction = itk.array_from_matrix(itk_image.GetDirection())
+
+    # Level pixels are centered on the blocks they average. Blocks at odd
+    # edges hold fewer pixels, but keep the same nominal center.
+    level_spacing = spacing * factor
+    origin = np.array(itk_image.GetOrigin(), dtype=float)
+    origin += direction @ ((factor - 1) / 2 * spacing)
+
+    level.SetSpacing(level_spacing.tolist())
+    level.SetOrigin(origin.tolist())
+    level.SetDirection(itk_image.GetDirection())
+    return level
+
+
+def build_pyramid(itk_image, factors: Sequence[int] = PYRAMID_FACTORS) -> List[Any]:
+    """Builds downsampled copies of a 2D or 3D image, coarsest first.
+
+    Factors must be powers of two. Each level is built by averaging blocks of
+    the next finer level, so the image is read only once. Levels that would
+    be no smaller than the next finer level are left out.
+    """
+    if not is_itk_image_type(type(itk_image)):
+        raise ConvertError("Provided data is not an ITK image")
+    if itk_image.GetImageDimension() not in (2, 3):
+        raise ConvertError("Only 2D and 3D images can be downsampled")
+    if any(f < 2 or f & (f - 1) for f in factors):
+        raise ValueError("Pyramid factors must be powers of two")
+
+    is_vector = itk_image.GetNumberOfComponentsPerPixel() > 1
+    pixels = itk.GetArrayViewFromImage(itk_image)
+    spatial_dims = pixels.ndim - 1 if is_vector else pixels.ndim
+
+    levels = []
+    factor = 1
+    while factor < max(factors, default=1):
+        halved = halve_array(pixels, spatial_dims)
+        factor *= 2
+        if halved.shape == pixels.shape:
+            break
+        if factor in factors:
+            levels.append(_level_image(itk_image, halved, factor))
+        pixels = halved
+    return levels[::-1]
+
+
+class PyramidCache:
+    """A least-recently-used cache of image pyramids.
+
+    Pyramids are held for as long as their images are alive, and are rebuilt
+    once an image is modified, as tracked by its MTime. Pixels that are
+    changed through a NumPy view do not update the MTime, so call Modified()
+    on the image after changing them.
+
+    Pyramids are evicted, least recently used first, once their levels take
+    up more than max_bytes. Each server process has its own cache, which a
+    MemorySessionStore also counts against its byte budget.
+    """
+
+    max_bytes: int
+    nbytes: int
+
+    def __init__(self, max_bytes: int = PYRAMID_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        # id(image) -> (weak ref to image, (MTime, factors), levels, nbytes)
+        self._entries: OrderedDict[int, Tuple[Any, Tuple, List[Any], int]] = (
+            OrderedDict()
+        )
+        # images are collected, and their entries dropped, on any thread and
+        # possibly while the lock is held
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, itk_image, factors: Sequence[int]) -> Optional[List[Any]]:
+        """Gets the cached levels of an image, or None if missing or stale."""
+        key = id(itk_image)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0]() is not itk_image:
+                return None
+            if entry[1] != (itk_image.GetMTime(), tuple(factors)):
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def put(self, itk_image, factors: Sequence[int], levels: List[Any]):
+        key = id(itk_image)
+        nbytes = sum(image_nbytes(level) for level in levels)
+        ref = weakref.ref(itk_image, lambda _: self._discard(key, ref))
+        with self._lock:
+            self._discard_locked(key)
+            if nbytes > self.max_bytes:
+                return
+            version = (itk_image.GetMTime(), tuple(factors))
+            self._entries[key] = (ref, version, levels, nbytes)
+            self.nbytes += nbytes
+            self.evict(self.max_bytes)
+
+    def evict(self, max_bytes: int):
+        """Evicts the least recently used pyramids until they fit max_bytes."""
+        with self._lock:
+            while self.nbytes > max_bytes:
+                _, (_, _, _, evicted_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+
+    def resize(self, max_bytes: int):
+        with self._lock:
+            self.max_bytes = max_bytes
+            self.evict(max_bytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def _discard(self, key: int, ref):
+        with self._lock:
+            entry = self._entries.get(key)
+            # the ID may have been reused by a newer image
+            if entry is not None and entry[0] is ref:
+                self._discard_locked(key)
+
+    def _discard_locked(self, key: int):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[3]
+
+
+pyramid_cache = PyramidCache()
@@ -0,0 +1,134 @@
+import asyncio
+from typing import Iterator, Sequence, Tuple
+
+import itk
+
+from volview_server.image_pyramid import PYRAMID_FACTORS, build_pyramid, pyramid_cache
+from volview_server.transformers.image_data import (
+    is_itk_image_type,
+    itk_image_header,
+    itk_region_to_vtk,
+)
+from volview_server.transformers.exceptions import ConvertError
+
+SLAB_SIZE = 4 * 1024 * 1024  # bytes
+
+
+def iter_slabs(depth: int, slab_depth: int) -> Iterator[Tuple[int, int]]:
+    """Yields (start, depth) slabs of slices, from the center slice outwards.
+
+    The center slice is yielded on its own so it arrives as soon as possible.
+    The remaining slices are yielded in slabs of up to slab_depth slices,
+    alternating above and below the center.
+    """
+    if depth < 1:
+        return
+
+    center = depth // 2
+    yield center, 1
+
+    above = center + 1
+    below = center
+    while above < depth or below > 0:
+        if above < depth:
+            n = min(slab_depth, depth - above)
+            yield above, n
+            above += n
+        if below > 0:
+            n = min(slab_depth, below)
+            below -= n
+            yield below, n
+
+
+async def stream_image(itk_image, slab_size: int = SLAB_SIZE):
+    """Streams an ITK image to the client, slice by slice.
+
+    The first message holds the image's geometry and pixel type, so the
+    client can display the image right away. Each following message holds a
+    slab of slices of at most slab_size bytes, starting from the center slice.
+    2D images are streamed in slabs of rows.
+    Use this from a stream endpoint:
+
+        @volview.expose
+        async def stream_volume(image_id):
+            image = await get_client_image(image_id)
+            async for message in stream_image(image):
+                yield message
+
+    The client receives the messages with RemoteStreamedImage.
+    """
+    if not is_itk_image_type(type(itk_image)):
+        raise ConvertError("Provided data is not an ITK image")
+
+    yield {"type": "image", "image": itk_image_header(itk_image)}
+    async for message in _stream_regions(itk_image, slab_size):
+        yield message
+
+
+async def _stream_regions(itk_image, slab_size: int):
+    region = itk_image.GetLargestPossibleRegion()
+    index = list(region.GetIndex())
+    size = list(region.GetSize())
+    # Slabs along the last axis, z or y for 2D images, are contiguous in the
+    # pixel buffer, so they are not copied.
+    slice_nbytes = itk.GetArrayViewFromImage(itk_image)[0].nbytes
+    slab_depth = max(1, slab_size // max(1, slice_nbytes))
+
+    for start, depth in iter_slabs(size[-1], slab_depth):
+        slab_index = [*index[:-1], index[-1] + start]
+        slab = itk_region_to_vtk(itk_image, slab_index, [*size[:-1], depth])
+        yield {"type": "region", "region": slab}
+        # let other RPCs run between slabs
+        await asyncio.sleep(0)
+
+
+async def get_image_pyramid(itk_image, factors: Sequence[int] = PYRAMID_FACTORS):
+    """Gets the downsampled levels of an image, coarsest first.
+
+    Levels are built in a worker thread, and cached for as long as the image
+    is alive and unmodified. See build_pyramid().
+    """
+    levels = pyramid_cache.get(itk_image, factors)
+    if levels is None:
+        loop = asyncio.get_running_loop()
+        levels = await loop.run_in_executor(None, build_pyramid, itk_image, factors)
+        pyramid_cache.put(itk_image, factors, levels)
+    return levels
+
+
+async def stream_image_pyramid(
+    itk_image,
+    slab_size: int = SLAB_SIZE,
+    factors: Sequence[int] = PYRAMID_FACTORS,
+):
+    """Streams an ITK image to the client, coarse levels first.
+
+    The image is downsampled by block averaging, by each of factors. The
+    coarsest level is streamed like stream_image(), so the client shows it
+    right away. Each finer level, and finally the image itself, follows with
+    a "level" header and its slabs. The client loads each level in the
+    background, and swaps it in on the level's "levelReady" message.
+
+        @volview.expose
+        async def stream_volume(image_id):
+            image = await get_client_image(image_id)
+            async for message in stream_image_pyramid(image):
+                yield message
+
+    Levels are cached per image, so streaming the same image again starts
+    without downsampling it. The client receives the messages with
+    RemoteStreamedImage.
+    """
+    if not is_itk_image_type(type(itk_image)):
+        raise ConvertError("Provided data is not an ITK image")
+
+    levels = [*await get_image_pyramid(itk_image, factors), itk_image]
+    yield {"type": "image", "image": itk_image_header(levels[0])}
+    async for message in _stream_regions(levels[0], slab_size):
+        yield message
+
+    for level in levels[1:]:
+        yield {"type": "level", "image": itk_image_header(level)}
+        async for message in _stream_regions(level, slab_size):
+            yield message
+        yield {"type": "levelReady"}
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor
+from contextvars import copy_context
+from typing import Any, Callable, List, Optional
+
+from volview_server.metrics import StageTimer
+from volview_server.process_executor import ProcessExecutor
+from volview_server.result_cache import MISSING, CacheScope, ResultCache, digest_args
+from volview_server.rpc_router import EndpointInfo
+from volview_server.scheduler import Scheduler
+
+# obj -> transformed obj
+TransformFn = Callable[[Any], Any]
+
+logger = logging.getLogger("volview_server.invokers")
+
+
+class EndpointInvoker:
+    """Calls an endpoint.
+
+    An invoker is created as an endpoint is registered, so that the kind of
+    endpoint, its transforms and its scheduler are not worked out per call.
+    """
+
+    def __init__(
+        self,
+        fn: Callable,
+        info: EndpointInfo,
+        scheduler: Scheduler,
+        deserialize: Optional[TransformFn],
+        serialize: Optional[TransformFn],
+    ):
+        """
+        deserialize and serialize transform the arguments and results. They
+        are None for endpoints that do not transform their arguments.
+        """
+        self.fn = fn
+        self.info = info
+        self.scheduler = scheduler
+        self.deserialize = deserialize
+        self.serialize = serialize
+        self.cache: Optional[ResultCache] = None
+        if info.cache is not None:
+            self.cache = ResultCache(info.cache.max_bytes, info.cache.ttl)
+
+    def _deserialize_args(self, args: List[Any]):
+        if self.deserialize is None:
+            return args
+        return [self.deserialize(obj) for obj in args]
+
+    def _slot(self, client_id: str):
+        info = self.info
+        return self.scheduler.slot(
+            client_id, info.name, info.priority, info.max_concurrency
+        )
+
+
+class RpcInvoker(EndpointInvoker, ABC):
+    async def invoke(
+        self,
+        args: List[Any],
+        client_id: str,
+        timer: StageTimer,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        context=None,
+    ):
+        args = self._deserialize_args(args)
+        timer.lap("deserialize")
+
+        cache_key = None
+        if self.cache is not None:
+            cache_key = await self._cache_key(args, client_id)
+            result = MISSING if cache_key is None else self.cache.get(cache_key)
+            timer.lap("cache")
+            # cached results are already serialized
+            if result is not MISSING:
+                return result
+
+        async with self._slot(client_id):
+            timer.lap("queue")
+            result = await self.execute(args, loop, context)
+            timer.lap("execute")
+
+        if self.serialize is not None:
+            result = self.serialize(result)
+        timer.lap("serialize")
+
+        if cache_key is not None:
+            self.cache.put(cache_key, result)
+        return result
+
+    async def _cache_key(self, args: List[Any], client_id: str):
+        """Gets the cache key of a call, or None if its arguments cannot be hashed."""
+        try:
+            digest = await digest_args(args)
+        except TypeError as exc:
+            logger.debug(f"Not caching a call of {self.info.name}: {exc}")
+            return None
+        if self.info.cache.scope == CacheScope.GLOBAL:
+            return digest
+        return (client_id, digest)
+
+    @abstractmethod
+    async def execute(self, args: List[Any], loop, context):
+        """Runs the endpoint with deserialized arguments."""
+
+
+class AsyncRpcInvoker(RpcInvoker):
+    """Awaits an async endpoint on the event loop."""
+
+    async def execute(self, args, loop, context):
+        return await self.fn(*args)
+
+
+class ThreadRpcInvoker(RpcInvoker):
+    """Runs a non-async endpoint in a thread pool, in a copy of the context."""
+
+    def __init__(self, *args, thread_pool: Executor, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.thread_pool = thread_pool
+
+    async def execute(self, args, loop, context):
+        loop = loop or asyncio.get_running_loop()
+        ctx = context or copy_context()
+        return await loop.run_in_executor(self.thread_pool, ctx.run, self.fn, *args)
+
+
+class ProcessRpcInvoker(RpcInvoker):
+    """Runs a non-async endpoint in a pool of worker processes."""
+
+    def __init__(self, *args, process_executor: ProcessExecutor, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.process_executor = process_executor
+
+    async def execute(self, args, loop, context):
+        return await self.process_executor.run(self.fn, *args)
+
+
+class StreamInvoker(EndpointInvoker):
+    """Iterates over an async generator endpoint.
+
+    A slot is held for the lifetime of the stream. The execute stage of each
+    result is the time the endpoint took to produce it.
+    """
+
+    async def invoke(self, args: List[Any], client_id: str, timer: StageTimer):
+        args = self._deserialize_args(args)
+        timer.lap("deserialize")
+
+        async with self._slot(client_id):
+            timer.lap("queue")
+            async for data in self.fn(*args):
+                timer.lap("execute")
+                if self.serialize is not None:
+                    data = self.serialize(data)
+                timer.lap("serialize")
+                yield data
+                # the consumer's time is not the endpoint's
+                timer.skip()
@@ -0,0 +1,273 @@
+import bisect
+import math
+import re
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from aiohttp import web
+
+METRICS_PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+# metric name, and the brace that opens the labels of a sample
+_SAMPLE_NAME = re.compile(r"([a-zA-Z_:][a-zA-Z0-9_:]*)(\{)?")
+
+LabelValues = Tuple[str, ...]
+# (name suffix, label values, extra labels, value)
+Sample = Tuple[str, LabelValues, Dict[str, str], float]
+
+
+def _escape_label_value(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float):
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric(ABC):
+    """A metric family in the Prometheus text format."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterable[Sample]:
+        """Yields the samples of the metric family."""
+
+    def render(self, lines: List[str]):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.type}")
+        for suffix, label_values, extra_labels, value in self.samples():
+            labels = [
+                f'{name}="{_escape_label_value(str(value))}"'
+                for name, value in zip(self.labelnames, label_values)
+            ]
+            labels.extend(
+                f'{name}="{_escape_label_value(value)}"'
+                for name, value in extra_labels.items()
+            )
+            label_str = "{" + ",".join(labels) + "}" if labels else ""
+            lines.append(f"{self.name}{suffix}{label_str} {_format_value(value)}")
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, label_values: LabelValues = (), amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        for label_values, value in self._values.items():
+            yield "", label_values, {}, value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, label_values: LabelValues = ()):
+        counts = self._values.get(label_values)
+        if counts is None:
+            counts = self._values[label_values] = [0] * (len(self.buckets) + 2)
+        # counts are per bucket, and made cumulative when rendered
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        for label_values, counts in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), counts):
+                cumulative += count
+                yield "_bucket", label_values, {"le": _format_value(bound)}, cumulative
+            yield "_sum", label_values, {}, counts[-1]
+            yield "_count", label_values, {}, cumulative
+
+
+class CallbackMetric(Metric):
+    """A metric whose values are collected from live state when rendered.
+
+    collect() returns (label values, value) pairs.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        type: str,
+        labelnames: Sequence[str],
+        collect: Callable[[], Iterable[Tuple[LabelValues, float]]],
+    ):
+        super().__init__(name, help, labelnames)
+        self.type = type
+        self.collect = collect
+
+    def samples(self):
+        for label_values, value in self.collect():
+            yield "", label_values, {}, value
+
+
+class MetricsRegistry:
+    """A set of metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def add(self, metric: Metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+def merge_metrics(texts: Sequence[str], label_name: str) -> str:
+    """Merges the rendered metrics of several registries of the same metrics.
+
+    Each sample is labeled with the index of its registry.
+    """
+    # metric name -> index of the first registry that has it, comment lines,
+    # sample lines
+    families: Dict[str, Tuple[int, List[str], List[str]]] = {}
+    for index, text in enumerate(texts):
+        label = f'{label_name}="{index}"'
+        family = None
+        for line in text.splitlines():
+            if line.startswith("#"):
+                _, _, name, _ = line.split(" ", 3)
+                family = families.setdefault(name, (index, [], []))
+                # not every text has every family, such as the empty text of
+                # a restarting worker
+                if family[0] == index:
+                    family[1].append(line)
+            elif line and family is not None:
+                match = _SAMPLE_NAME.match(line)
+                if match.group(2):
+                    line = f"{match.group(0)}{label},{line[match.end():]}"
+                else:
+                    line = f"{match.group(1)}{{{label}}}{line[match.end():]}"
+                family[2].append(line)
+
+    lines: List[str] = []
+    for _, comments, samples in families.values():
+        lines.extend(comments)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """Splits the duration of a call into stages.
+
+    Each lap() attributes the time since the previous lap to a stage, so the
+    stages of a call can be timed across functions without nesting.
+    """
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        now = time.perf_counter()
+        self.durations[stage] = self.durations.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def skip(self):
+        """Leaves the time since the previous lap out of every stage."""
+        self._last = time.perf_counter()
+
+    def observe(self, histogram: Histogram, label_values: LabelValues = ()):
+        """Observes the stage durations, labeled by stage, and starts over."""
+        for stage, duration in self.durations.items():
+            histogram.observe(duration, (*label_values, stage))
+        self.durations.clear()
+
+
+class MetricsMiddleware:
+    """ASGI middleware that serves a metrics registry at a given path."""
+
+    def __init__(self, registry: MetricsRegistry, other_app=None, path=METRICS_PATH):
+        self.registry = registry
+        self.other_app = other_app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == self.path:
+            body = self.registry.render().encode("utf-8")
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", CONTENT_TYPE.encode("utf-8")),
+                        (b"content-length", str(len(body)).encode("utf-8")),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+        elif self.other_app is not None:
+            await self.other_app(scope, receive, send)
+        elif scope["type"] == "http":
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 404,
+                    "headers": [(b"content-type", b"text/plain")],
+                }
+            )
+            await send({"type": "http.response.body", "body": b"Not Found"})
+
+
+def make_aiohttp_handler(registry: MetricsRegistry):
+    """Creates an aiohttp request handler that serves a metrics registry."""
+
+    async def handle_metrics(request):
+        return web.Response(
+            body=registry.render().encode("utf-8"),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+    return handle_metrics
@@ -0,0 +1,335 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextvars import ContextVar
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import itk
+import numpy as np
+
+from volview_server.transformers.image_data import _keep_buffer_alive
+
+SHARED_IMAGE_TYPE_PREFIXES = ("itkImage", "itkVectorImage")
+
+logger = logging.getLogger("volview_server.process_executor")
+
+# context variable name -> context variable
+_context_vars: Dict[str, ContextVar] = {}
+# shared memory that could not be closed, because its buffer is still in use.
+# Closing it is retried as more shared memory is closed.
+_pinned_shared_memory: List[SharedMemory] = []
+# images can be freed, and close their shared memory, in any thread
+_pinned_lock = threading.Lock()
+
+
+def propagate_context_var(var: ContextVar):
+    """Propagates a context variable to endpoints run in worker processes.
+
+    The variable's value is pickled, so it must be picklable. Returns the
+    variable, so this can wrap its definition.
+    """
+    _context_vars[var.name] = var
+    return var
+
+
+@dataclass
+class SharedImage:
+    """An ITK image with its pixels in shared memory."""
+
+    shm_name: str
+    shape: Sequence[int]
+    dtype: str
+    is_vector: bool
+    spacing: Sequence[float]
+    origin: Sequence[float]
+    direction: Sequence[Sequence[float]]
+
+
+def _shared_array(shm: SharedMemory, shape: Sequence[int], dtype) -> np.ndarray:
+    # frombuffer holds an export of the buffer, so that closing the shared
+    # memory fails while the array is alive rather than unmapping its pixels
+    count = int(np.prod(shape))
+    return np.frombuffer(shm.buf, dtype=dtype, count=count).reshape(shape)
+
+
+def _share_image(itk_image, shared: List[SharedMemory]) -> SharedImage:
+    pixels = itk.GetArrayViewFromImage(itk_image)
+    # SharedMemory cannot be empty
+    shm = SharedMemory(create=True, size=max(1, pixels.nbytes))
+    shared.append(shm)
+    _shared_array(shm, pixels.shape, pixels.dtype)[...] = pixels
+    return SharedImage(
+        shm_name=shm.name,
+        shape=pixels.shape,
+        dtype=pixels.dtype.str,
+        is_vector=itk_image.GetNumberOfComponentsPerPixel() > 1,
+        spacing=list(itk_image.GetSpacing()),
+        origin=list(itk_image.GetOrigin()),
+        direction=itk.array_from_matrix(itk_image.GetDirection()).tolist(),
+    )
+
+
+def _close_when_freed(pixels: np.ndarray, shm: SharedMemory):
+    """Closes shared memory once no array uses its buffer anymore.
+
+    A frombuffer array keeps a memoryview of the buffer as its base. The
+    memoryview is freed with the last array over it, and it releases the
+    buffer before calling back its weak references.
+    """
+    base = pixels
+    while isinstance(base, np.ndarray):
+        base = base.base
+    weakref.finalize(base, _close_or_pin, shm)
+
+
+def _shared_image_view(
+    shared_image: SharedImage, shared: List[SharedMemory], owned: bool
+):
+    shm = SharedMemory(name=shared_image.shm_name)
+    if owned:
+        # the pixels stay mapped until they are freed, without a name to leak
+        shm.unlink()
+    else:
+        shared.append(shm)
+    pixels = _shared_array(shm, shared_image.shape, shared_image.dtype)
+    if owned:
+        _close_when_freed(pixels, shm)
+    itk_image = itk.GetImageViewFromArray(pixels, is_vector=shared_image.is_vector)
+    _keep_buffer_alive(itk_image, pixels)
+    itk_image.SetSpacing(shared_image.spacing)
+    itk_image.SetOrigin(shared_image.origin)
+    itk_image.SetDirection(itk.matrix_from_array(np.array(shared_image.direction)))
+    return itk_image
+
+
+def _is_shareable_image(obj: Any):
+    return isinstance(obj, SharedImage) or type(obj).__name__.startswith(
+        SHARED_IMAGE_TYPE_PREFIXES
+    )
+
+
+def _map_images(obj: Any, fn: Callable[[Any], Any]):
+    if _is_shareable_image(obj):
+        return fn(obj)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_map_images(item, fn) for item in obj)
+    if isinstance(obj, dict):
+        return {key: _map_images(value, fn) for key, value in obj.items()}
+    return obj
+
+
+def to_shared(obj: Any, shared: List[SharedMemory]):
+    """Moves the pixels of the ITK images in an object into shared memory.
+
+    The created shared memory is appended to shared.
+    """
+
+    def share(image):
+        if isinstance(image, SharedImage):
+            return image
+        return _share_image(image, shared)
+
+    return _map_images(obj, share)
+
+
+def from_shared(obj: Any, shared: List[SharedMemory], owned: bool):
+    """Restores the ITK images in an object from shared memory.
+
+    The images are views of the shared memory. With owned=False, the
+    attached shared memory is appended to shared, and must stay open for as
+    long as the images are used. With owned=True, the shared memory is
+    unlinked right away, and closed once the image and any views of its
+    pixels are freed.
+    """
+
+    def restore(image):
+        if not isinstance(image, SharedImage):
+            return image
+        return _shared_image_view(image, shared, owned)
+
+    return _map_images(obj, restore)
+
+
+def _close_pinned_shared_memory():
+    """Closes the pinned shared memory whose buffers are no longer in use."""
+    with _pinned_lock:
+        still_pinned = []
+        for shm in _pinned_shared_memory:
+            try:
+                shm.close()
+            except BufferError:
+                still_pinned.append(shm)
+        _pinned_shared_memory[:] = still_pinned
+
+
+def _close_or_pin(shm: SharedMemory):
+    try:
+        shm.close()
+    except BufferError:
+        # an image still uses the buffer, such as one kept by an endpoint
+        with _pinned_lock:
+            _pinned_shared_memory.append(shm)
+
+
+def close_shared(shared: List[SharedMemory], unlink: bool):
+    if _pinned_shared_memory:
+        _close_pinned_shared_memory()
+    for shm in shared:
+        if unlink:
+            shm.unlink()
+        _close_or_pin(shm)
+    shared.clear()
+
+
+def _init_worker(initializer: Optional[Callable[[], Any]]):
+    # loads ITK's core modules ahead of the first call
+    itk.Image
+    if initializer is not None:
+        initializer()
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _set_context_values(context_values: Dict[str, Any]):
+    for name, value in context_values.items():
+        var = _context_vars.get(name)
+        if var is not None:
+            var.set(value)
+
+
+def _run_in_worker(fn: Callable, args: List[Any], context_values: Dict[str, Any]):
+    shared: List[SharedMemory] = []
+    try:
+        # a fresh context, so that no values leak between calls
+        context = contextvars.Context()
+        context.run(_set_context_values, context_values)
+        args = from_shared(args, shared, owned=False)
+        result = context.run(fn, *args)
+        del args
+
+        result_shared: List[SharedMemory] = []
+        result = to_shared(result, result_shared)
+        # the server process unlinks the result's shared memory
+        close_shared(result_shared, unlink=False)
+        return result
+    finally:
+        close_shared(shared, unlink=False)
+
+
+def _discard_result(future):
+    if future.cancelled() or future.exception() is not None:
+        return
+    shared: List[SharedMemory] = []
+    from_shared(future.result(), shared, owned=False)
+    close_shared(shared, unlink=True)
+
+
+class ProcessExecutor:
+    """Runs functions in a pool of worker processes.
+
+    The pool is started ahead of the first call, and its workers load ITK as
+    they start. ITK images in the arguments and results are passed through
+    shared memory rather than pickled. Functions see their image arguments
+    as views of the shared memory, valid for the duration of the call. Image
+    results are views of shared memory as well, which is freed along with
+    the images. Values of context variables registered with
+    propagate_context_var() are set in the worker for the duration of the
+    call.
+
+    The initializer is called in each worker as it starts, such as to load
+    the ITK filters that the functions use. If a worker dies, the calls that
+    were running fail with a BrokenProcessPool error, and the pool is
+    replaced for later calls.
+    """
+
+    def __init__(
+        self,
+        num_processes: Optional[int] = None,
+        initializer: Optional[Callable[[], Any]] = None,
+    ):
+        self.num_processes = num_processes or os.cpu_count() or 1
+        self.initializer = initializer
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def start(self):
+        """Starts and warms up the worker processes."""
+        if self._pool is not None:
+            return
+        # shared memory is tracked by the server's resource tracker, which the
+        # workers inherit. Otherwise, each worker's own tracker would unlink
+        # the shared memory it had seen once the worker exits.
+        resource_tracker.ensure_running()
+        self._pool = ProcessPoolExecutor(
+            self.num_processes, initializer=_init_worker, initargs=(self.initializer,)
+        )
+        for _ in range(self.num_processes):
+            self._pool.submit(_warm_up)
+
+    def _replace_broken_pool(self, pool: ProcessPoolExecutor):
+        # calls that fail together replace the pool once
+        if self._pool is not pool:
+            return
+        logger.warning("A worker process died. Restarting the process pool.")
+        pool.shutdown(wait=False, cancel_futures=True)
+        self._pool = None
+        self.start()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def run(self, fn: Callable, *args):
+        """Runs fn(*args) in a worker process."""
+        self.start()
+
+        context = contextvars.copy_context()
+        context_values = {
+            name: context[var] for name, var in _context_vars.items() if var in context
+        }
+
+        loop = asyncio.get_running_loop()
+        shared: List[SharedMemory] = []
+        # copying large images into shared memory would stall the event loop
+        sharing = loop.run_in_executor(None, to_shared, list(args), shared)
+        try:
+            shared_args = await asyncio.shield(sharing)
+        except BaseException:
+            # the copy cannot be interrupted, so its shared memory is freed
+            # once the copy is done
+            sharing.add_done_callback(lambda _: close_shared(shared, unlink=True))
+            raise
+
+        try:
+            pool = self._pool
+            call = (_run_in_worker, fn, shared_args, context_values)
+            try:
+                future = pool.submit(*call)
+            except BrokenProcessPool:
+                # a worker died since the last call
+                self._replace_broken_pool(pool)
+                pool = self._pool
+                future = pool.submit(*call)
+            try:
+                result = await asyncio.wrap_future(future)
+            except BrokenProcessPool:
+                self._replace_broken_pool(pool)
+                raise
+            except asyncio.CancelledError:
+                # nobody receives the result, so free its shared memory
+                future.add_done_callback(_discard_result)
+                raise
+        finally:
+            close_shared(shared, unlink=True)
+
+        return from_shared(result, [], owned=True)
@@ -0,0 +1,207 @@
+import asyncio
+import enum
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from volview_server.session_store import session_nbytes
+from volview_server.transformers.image_data import is_itk_image_type
+
+RESULT_CACHE_SIZE = 256 * 1024 * 1024  # bytes
+# arguments holding more array bytes than this are hashed in a worker thread
+HASH_IN_THREAD_THRESHOLD = 1024 * 1024  # bytes
+
+# returned by ResultCache.get() on a miss, as None is a valid result
+MISSING = object()
+
+
+class CacheScope(enum.Enum):
+    # each client has its own results
+    CLIENT = "client"
+    # results are shared by all clients
+    GLOBAL = "global"
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    """How an endpoint's results are memoized.
+
+    - max_bytes: byte budget of the endpoint's results. The least recently
+      used results are evicted once they take up more.
+    - ttl: seconds a result stays valid. Results never expire by default.
+    - scope: "client" keeps the results of each client apart, and discards
+      them with the client's state. "global" shares results between clients.
+    """
+
+    max_bytes: int = RESULT_CACHE_SIZE
+    ttl: Optional[float] = None
+    scope: Union[str, CacheScope] = CacheScope.CLIENT
+
+    def __post_init__(self):
+        # frozen, so the scope is normalized through object.__setattr__
+        object.__setattr__(self, "scope", CacheScope(self.scope))
+        if self.max_bytes < 0:
+            raise ValueError("max_bytes cannot be negative")
+        if self.ttl is not None and self.ttl <= 0:
+            raise ValueError("ttl must be positive")
+
+
+def _is_image(obj: Any):
+    return is_itk_image_type(type(obj)) or type(obj).__name__.startswith(
+        "itkVectorImage"
+    )
+
+
+def _append_array(parts: List[Any], array: np.ndarray):
+    if array.dtype.hasobject:
+        raise TypeError("Cannot hash arrays of objects")
+    array = np.ascontiguousarray(array)
+    parts.append(f"ndarray:{array.dtype.str}:{array.shape};".encode())
+    parts.append(array.reshape(-1).view(np.uint8))
+
+
+def _collect_parts(obj: Any, parts: List[Any]):
+    """Appends the bytes that identify an argument to parts.
+
+    Array contents are appended as uint8 arrays rather than copied.
+    """
+    if obj is None or isinstance(obj, (bool, int, float, complex, np.generic)):
+        parts.append(f"{type(obj).__name__}:{obj!r};".encode())
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        parts.append(f"str:{len(data)};".encode())
+        parts.append(data)
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        _append_array(parts, np.frombuffer(obj, dtype=np.uint8))
+    elif isinstance(obj, np.ndarray):
+        _append_array(parts, obj)
+    elif _is_image(obj):
+        geometry = (
+            tuple(obj.GetSpacing()),
+            tuple(obj.GetOrigin()),
+            np.asarray(obj.GetDirection()).tolist(),
+        )
+        parts.append(f"{type(obj).__name__}:{geometry};".encode())
+        _append_array(parts, np.asarray(obj))
+    elif isinstance(obj, (list, tuple)):
+        parts.append(f"{type(obj).__name__}:{len(obj)};".encode())
+        for item in obj:
+            _collect_parts(item, parts)
+    elif isinstance(obj, dict):
+        parts.append(f"dict:{len(obj)};".encode())
+        for key, value in sorted(obj.items(), key=lambda item: repr(item[0])):
+            _collect_parts(key, parts)
+            _collect_parts(value, parts)
+    else:
+        raise TypeError(f"Cannot hash arguments of type {type(obj).__name__}")
+
+
+def _hash_parts(parts: List[Any]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+async def digest_args(args: List[Any]) -> str:
+    """Computes a stable digest of deserialized endpoint arguments.
+
+    Images and arrays are hashed by content and geometry. Large arrays are
+    hashed in the default executor, off the event loop. Raises a TypeError
+    for arguments that cannot be hashed.
+    """
+    parts: List[Any] = []
+    _collect_parts(args, parts)
+    array_bytes = sum(part.nbytes for part in parts if isinstance(part, np.ndarray))
+    if array_bytes > HASH_IN_THREAD_THRESHOLD:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, _hash_parts, parts)
+    return _hash_parts(parts)
+
+
+class ResultCache:
+    """A least-recently-used cache of endpoint results, bounded in bytes.
+
+    Results are evicted once they take up more than max_bytes, and are
+    stale ttl seconds after they are cached. A result that is larger than
+    max_bytes is not cached.
+    """
+
+    max_bytes: int
+    ttl: Optional[float]
+    nbytes: int
+    hits: int
+    misses: int
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_SIZE, ttl: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (result, nbytes, expiry time)
+        self._entries: OrderedDict[Hashable, Tuple[Any, int, float]] = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """Gets a cached result, or MISSING."""
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] <= time.monotonic():
+            self._discard(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, result: Any):
+        self._discard(key)
+        nbytes = session_nbytes(result)
+        if nbytes > self.max_bytes:
+            return
+
+        now = time.monotonic()
+        self._expire(now)
+        expiry = now + self.ttl if self.ttl is not None else float("inf")
+        self._entries[key] = (result, nbytes, expiry)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted_nbytes, _) = self._entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+
+    def discard_client(self, client_id: str):
+        """Discards the results of a client, for caches keyed by client."""
+        for key in [key for key in self._entries if key[0] == client_id]:
+            self._discard(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _expire(self, now: float):
+        if self.ttl is None:
+            return
+        for key in [key for key, entry in self._entries.items() if entry[2] <= now]:
+            self._discard(key)
+
+    def _discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
@@ -1,9 +1,11 @@
 from dataclasses import dataclass
 import inspect
 import enum
-from typing import Callable, Tuple, Dict
+from typing import Callable, Tuple, Dict, List, Optional, Union
 
 from volview_server.exceptions import KeyExistsError
+from volview_server.result_cache import CachePolicy
+from volview_server.scheduler import Priority
 
 
 class ExposeType(enum.Enum):
@@ -11,11 +13,20 @@ class ExposeType(enum.Enum):
     STREAM = "stream"
 
 
+class ExecutorType(enum.Enum):
+    THREAD = "thread"
+    PROCESS = "process"
+
+
 @dataclass
 class EndpointInfo:
     name: str
     type: ExposeType
     transform_args: bool = True
+    executor: ExecutorType = ExecutorType.THREAD
+    priority: Priority = Priority.INTERACTIVE
+    max_concurrency: Optional[int] = None
+    cache: Optional[CachePolicy] = None
 
 
 Endpoint = Tuple[Callable, EndpointInfo]
@@ -26,8 +37,23 @@ class RpcRouter:
 
     def __init__(self):
         self.endpoints = {}
-
-    def add_endpoint(self, public_name: str, fn: Callable, transform_args=True):
+        # called with the name of each endpoint as it is added
+        self._listeners: List[Callable[[str], None]] = []
+
+    def add_listener(self, listener: Callable[[str], None]):
+        """Calls listener(public_name) for endpoints added from now on."""
+        self._listeners.append(listener)
+
+    def add_endpoint(
+        self,
+        public_name: str,
+        fn: Callable,
+        transform_args=True,
+        executor: Union[str, ExecutorType] = ExecutorType.THREAD,
+        priority: Union[str, Priority] = Priority.INTERACTIVE,
+        max_concurrency: Optional[int] = None,
+        cache: Union[bool, CachePolicy, None] = None,
+    ):
         """Adds a public endpoint.
 
         Arguments:
@@ -38,6 +64,21 @@ class RpcRouter:
             - transform_args(=true): transform input arguments and output
               results. Disable this if you do not want transform overhead
               or you want to explicitly transform your inputs and outputs.
+            - executor(="thread"): where non-async functions run. "thread"
+              runs them in a thread pool, and "process" runs them in a pool
+              of worker processes, for CPU-bound work that holds the GIL.
+              Functions run in a process must be defined at the top level of
+              a module and take and return picklable values or ITK images.
+            - priority(="interactive"): "interactive" or "batch". Queued
+              interactive calls run before queued batch calls.
+            - max_concurrency: the most calls of this endpoint that may run
+              at once, across all clients. Further calls are queued.
+            - cache: memoize results by the content of the arguments. Pass
+              True for the defaults, or a CachePolicy to set the byte budget,
+              the time-to-live and whether results are shared by clients.
+              Repeated calls return the cached result without running fn.
+              Only cache functions whose result depends on their arguments
+              alone.
         """
 
         if public_name in self.endpoints:
@@ -47,5 +88,33 @@ class RpcRouter:
         if inspect.isasyncgenfunction(fn) or inspect.isgeneratorfunction(fn):
             expose_type = ExposeType.STREAM
 
-        info = EndpointInfo(public_name, expose_type, transform_args)
+        executor = ExecutorType(executor)
+        if executor == ExecutorType.PROCESS and (
+            expose_type != ExposeType.RPC or inspect.iscoroutinefunction(fn)
+        ):
+            raise TypeError(
+                f"{public_name} cannot run in a process, as it is not a plain function"
+            )
+
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        if cache is True:
+            cache = CachePolicy()
+        elif cache is False:
+            cache = None
+        if cache is not None and expose_type != ExposeType.RPC:
+            raise TypeError(f"{public_name} cannot be cached, as it is a stream")
+
+        info = EndpointInfo(
+            public_name,
+            expose_type,
+            transform_args,
+            executor,
+            Priority(priority),
+            max_concurrency,
+            cache,
+        )
         self.endpoints[public_name] = (fn, info)
+        for listener in self._listeners:
+            listener(public_name)
@@ -1,39 +1,86 @@
 from __future__ import annotations
 
-import time
 import asyncio
 import uuid
 import logging
-from typing import Any, Union, List, Generator, Dict, Tuple, Optional
+from collections import deque
+from typing import Any, Union, List, Generator, Dict, Tuple, Optional, Set
 from contextvars import ContextVar
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field
 from urllib.parse import parse_qs
 
+import numpy as np
 from socketio.exceptions import ConnectionRefusedError
 
 from volview_server.api import RpcApi
 from volview_server.chunking import ChunkingAsyncServer
+from volview_server.cluster import ClusterManager
+from volview_server.exceptions import RpcTimeoutError
+from volview_server.image_cache import IMAGE_CACHE_SIZE
+from volview_server.image_pyramid import PYRAMID_CACHE_SIZE, pyramid_cache
+from volview_server.metrics import (
+    CallbackMetric,
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    StageTimer,
+)
+from volview_server.process_executor import propagate_context_var
+from volview_server.session_store import (
+    SESSION_SWEEP_INTERVAL,
+    MemorySessionStore,
+    SessionStore,
+)
+from volview_server.transformers.compression import (
+    COMPRESSION_THRESHOLD,
+    compress_payload,
+    decompress_payload,
+    has_compressed_arrays,
+    has_compressible_arrays,
+    negotiate_codec,
+)
 
 RPC_CALL_EVENT = "rpc:call"
 RPC_RESULT_EVENT = "rpc:result"
 STREAM_CALL_EVENT = "stream:call"
 STREAM_RESULT_EVENT = "stream:result"
+STREAM_CREDIT_EVENT = "stream:credit"
+
+# messages between the processes of a cluster
+CLUSTER_CALL_METHOD = "volview:call_client"
+CLUSTER_RESULT_METHOD = "volview:call_client_result"
+CLUSTER_ACK_METHOD = "volview:call_client_ack"
 
 CLIENT_ID_QS = "clientId"
+CODECS_QS = "codecs"
 FUTURE_TIMEOUT = 5 * 60  # seconds
+# stream results sent ahead of a client that does not set a window
+STREAM_WINDOW = 8
+STREAM_MAX_QUEUED_BYTES = 64 * 1024 * 1024
+DISCONNECT_GRACE_PERIOD = 30  # seconds
+# shortest wait for a server process to take a client call, which covers the
+# round trip between processes when there is no disconnect grace period
+CLUSTER_ACK_TIMEOUT = 5  # seconds
 
 current_server: ContextVar[RpcServer] = ContextVar("server")
-current_client_id: ContextVar[str] = ContextVar("client_id")
+current_client_id: ContextVar[str] = propagate_context_var(ContextVar("client_id"))
 
 logger = logging.getLogger("volview_server.rpc_server")
 
 
-@dataclass
+# Envelopes are turned into messages by hand rather than with asdict(), which
+# would walk and deep-copy the payloads they carry.
+
+
+@dataclass(slots=True)
 class RpcCall:
     rpcId: str
     name: str
     args: List[Any]
 
+    def to_message(self):
+        return {"rpcId": self.rpcId, "name": self.name, "args": self.args}
+
 
 def validate_rpc_call(data: Any):
     if type(data) is not dict:
@@ -54,19 +101,122 @@ def validate_rpc_call(data: Any):
     return rpc_id, name, args
 
 
-@dataclass
+def validate_stream_window(data: Any):
+    """Gets the number of results a client accepts before granting credits.
+
+    Defaults to STREAM_WINDOW if the client does not set one.
+    """
+    window = data.get("window", STREAM_WINDOW)
+    if type(window) is not int or window < 1:
+        raise TypeError("stream window is not a positive int")
+    return window
+
+
+def validate_stream_credit(data: Any):
+    if type(data) is not dict:
+        raise TypeError("data is not a dict")
+
+    rpc_id = data["rpcId"]
+    if type(rpc_id) is not str:
+        raise TypeError("rpc ID is not a str")
+
+    credits = data["credits"]
+    if type(credits) is not int or credits < 1:
+        raise TypeError("stream credits is not a positive int")
+
+    return rpc_id, credits
+
+
+def payload_nbytes(obj: Any) -> int:
+    """Estimates the number of bytes a payload takes up when sent."""
+    if isinstance(obj, (str, bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, (memoryview, np.ndarray)):
+        return obj.nbytes
+    if isinstance(obj, dict):
+        return sum(payload_nbytes(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(payload_nbytes(item) for item in obj)
+    return 8
+
+
+class StreamFlow:
+    """Credit-based flow control of a stream's results.
+
+    The client grants a credit for each result it can accept, and returns
+    credits once it has handled results. The stream is suspended while it is
+    out of credits, or while the results that the client has not yet handled
+    add up to max_queued_bytes or more.
+    """
+
+    def __init__(self, credits: int, max_queued_bytes: int):
+        self.credits = credits
+        self.max_queued_bytes = max_queued_bytes
+        self.queued_bytes = 0
+        self.closed = False
+        # sizes of the results that the client has not yet handled
+        self._queued = deque()
+        self._changed = asyncio.Event()
+
+    @property
+    def ready(self):
+        return self.credits > 0 and self.queued_bytes < self.max_queued_bytes
+
+    def consume(self, nbytes: int):
+        """Accounts for a result that is about to be sent."""
+        self.credits -= 1
+        self.queued_bytes += nbytes
+        self._queued.append(nbytes)
+
+    def grant(self, credits: int):
+        """Adds credits returned by the client for handled results."""
+        for _ in range(min(credits, len(self._queued))):
+            self.queued_bytes -= self._queued.popleft()
+        self.credits += credits
+        self._changed.set()
+
+    def close(self):
+        """Stops the stream, such as when the client disconnects."""
+        self.closed = True
+        self._changed.set()
+
+    async def wait(self, timeout: float):
+        """Waits until the stream may send its next result.
+
+        Raises a RpcTimeoutError if the client grants no credits in time, and
+        a ConnectionError if the stream is closed.
+        """
+        while not self.ready and not self.closed:
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise RpcTimeoutError(
+                    f"Client granted no stream credits for {timeout}s"
+                ) from None
+        if self.closed:
+            raise ConnectionError("Stream was closed")
+
+
+@dataclass(slots=True)
 class RpcOkResult:
     rpcId: str = field(default="", init=False)
     ok: bool = field(default=True, init=False)
     data: Any = field(default=None)
 
+    def to_message(self):
+        return {"rpcId": self.rpcId, "ok": self.ok, "data": self.data}
 
-@dataclass
+
+@dataclass(slots=True)
 class RpcErrorResult:
     rpcId: str = field(default="", init=False)
     ok: bool = field(default=False, init=False)
     error: str
 
+    def to_message(self):
+        return {"rpcId": self.rpcId, "ok": self.ok, "error": self.error}
+
 
 def validate_rpc_result(result: Any):
     if type(result) is not dict:
@@ -79,18 +229,45 @@ def validate_rpc_result(result: Any):
     )
 
 
-@dataclass
+@dataclass(slots=True)
 class StreamDataResult(RpcOkResult):
     done: bool = field(default=False)
 
+    def to_message(self):
+        return {
+            "rpcId": self.rpcId,
+            "ok": self.ok,
+            "data": self.data,
+            "done": self.done,
+        }
+
 
 RpcResult = Union[RpcOkResult, RpcErrorResult]
 
 
 @dataclass
 class FutureMetadata:
-    transform_args: bool = True
-    creation_time: int = field(default_factory=lambda: int(time.time()))
+    rpc_name: str
+    client_id: str
+    # fails the future once the call times out
+    timeout_handle: Optional[asyncio.TimerHandle] = None
+    # fails a call through the cluster that no process has taken
+    ack_handle: Optional[asyncio.TimerHandle] = None
+
+
+@dataclass(eq=False)
+class ClientState:
+    """Connection state of a client, which outlives its socket.io sessions."""
+
+    # socket.io session IDs of the client's connections
+    sids: Set[str] = field(default_factory=set)
+    # set while the client has a connection
+    connected: asyncio.Event = field(default_factory=asyncio.Event)
+    # tasks running the client's RPC calls and streams
+    tasks: Set[asyncio.Task] = field(default_factory=set)
+    # reclaims the client's state once the disconnect grace period is over
+    reclaim_handle: Optional[asyncio.TimerHandle] = None
+    reclaimed: bool = False
 
 
 class RpcServer:
@@ -103,28 +280,95 @@ class RpcServer:
     api: RpcApi
     # sid -> client ID
     clients: Dict[str, str]
-    # client ID -> session object
-    sessions: Dict[str, Any]
+    # sessions and image caches of the clients
+    sessions: SessionStore
+    # client ID -> negotiated compression codec
+    codecs: Dict[str, Optional[str]]
     future_timeout: int
+    compression_codecs: Optional[List[str]]
+    compression_threshold: int
+    image_cache_size: int
+    pyramid_cache_size: int
+    stream_max_queued_bytes: int
+    disconnect_grace_period: float
+    # server metrics, in the Prometheus text format
+    metrics: MetricsRegistry
+    # shares rooms and client RPCs with other server processes
+    cluster: Optional[ClusterManager]
 
     def __init__(
         self,
         api: RpcApi,
         future_timeout: int = FUTURE_TIMEOUT,
+        compression_codecs: Optional[List[str]] = None,
+        compression_threshold: int = COMPRESSION_THRESHOLD,
+        image_cache_size: int = IMAGE_CACHE_SIZE,
+        pyramid_cache_size: int = PYRAMID_CACHE_SIZE,
+        stream_max_queued_bytes: int = STREAM_MAX_QUEUED_BYTES,
+        disconnect_grace_period: float = DISCONNECT_GRACE_PERIOD,
+        session_store: Optional[SessionStore] = None,
         **kwargs,
     ):
         """
         Keyword Arguments:
-            - future_timeout: number of seconds before an inflight RPC is ignored.
+            - future_timeout: default number of seconds before an inflight
+              client RPC fails with an RpcTimeoutError.
+            - compression_codecs: codecs the server may use to compress image
+              payloads, in order of preference. Defaults to every available
+              codec. An empty list disables compression.
+            - compression_threshold: smallest array, in bytes, to compress.
+            - image_cache_size: byte budget of each client's image cache, if
+              no session_store is provided.
+            - pyramid_cache_size: byte budget of the image pyramids that
+              stream_image_pyramid() caches in this process.
+            - stream_max_queued_bytes: bytes of stream results that may be
+              sent ahead of a client.
+            - disconnect_grace_period: seconds to keep a disconnected client's
+              calls, streams and session, so that a client reconnecting with
+              the same client ID can resume. Afterwards, the client's calls
+              and streams are cancelled and its state is discarded.
+            - session_store: holds the clients' sessions and image caches.
+              Defaults to a MemorySessionStore that never evicts sessions.
+
+        With a ClusterManager as the socket.io client_manager, call_client()
+        also reaches clients that are connected to other server processes.
         """
         self.sio = ChunkingAsyncServer(**kwargs)
         self.api = api
         self.clients = {}
-        self.sessions = {}
+        self.sessions = session_store or MemorySessionStore(
+            image_cache_size=image_cache_size
+        )
+        self.codecs = {}
         self.future_timeout = future_timeout
+        self.compression_codecs = compression_codecs
+        self.compression_threshold = compression_threshold
+        self.image_cache_size = image_cache_size
+        self.pyramid_cache_size = pyramid_cache_size
+        pyramid_cache.resize(pyramid_cache_size)
+        self.stream_max_queued_bytes = stream_max_queued_bytes
+        self.disconnect_grace_period = disconnect_grace_period
 
         self._inflight_rpcs: Dict[str, Tuple[asyncio.Future, FutureMetadata]] = {}
-        self._cleanup_task = None
+        # (client ID, rpc ID) -> flow control of an active stream
+        self._stream_flows: Dict[Tuple[str, str], StreamFlow] = {}
+        # client ID -> connection state
+        self._client_states: Dict[str, ClientState] = {}
+        self._session_sweeper: Optional[asyncio.Task] = None
+        self._active_streams = 0
+        # client RPCs made on behalf of other server processes
+        self._cluster_tasks: Set[asyncio.Task] = set()
+
+        self.cluster = self.sio.manager
+        if not isinstance(self.cluster, ClusterManager):
+            self.cluster = None
+        else:
+            self.cluster.on_message(CLUSTER_CALL_METHOD, self._on_cluster_call)
+            self.cluster.on_message(CLUSTER_RESULT_METHOD, self._on_cluster_result)
+            self.cluster.on_message(CLUSTER_ACK_METHOD, self._on_cluster_ack)
+
+        self.metrics = MetricsRegistry()
+        self._add_metrics()
 
         @self.sio.event
         async def connect(sid: str, environ: dict):
@@ -136,42 +380,174 @@ class RpcServer:
 
         @self.sio.on(RPC_CALL_EVENT)
         async def on_rpc_call(sid: str, data: Any):
-            await self._on_rpc_call(self.clients[sid], data)
+            client_id = self.clients[sid]
+            await self._run_client_task(client_id, self._on_rpc_call(client_id, data))
 
         @self.sio.on(STREAM_CALL_EVENT)
         async def on_stream_call(sid: str, data: Any):
-            await self._on_stream_call(self.clients[sid], data)
+            client_id = self.clients[sid]
+            await self._run_client_task(
+                client_id, self._on_stream_call(client_id, data)
+            )
 
         @self.sio.on(RPC_RESULT_EVENT)
         async def on_rpc_result(sid: str, data: Any):
             await self._on_rpc_result(self.clients[sid], data)
 
+        @self.sio.on(STREAM_CREDIT_EVENT)
+        async def on_stream_credit(sid: str, data: Any):
+            self._on_stream_credit(self.clients[sid], data)
+
+    def _add_metrics(self):
+        self._stage_seconds = self.metrics.add(
+            Histogram(
+                "volview_rpc_stage_seconds",
+                "Time spent in each stage of an endpoint call or stream result",
+                ("endpoint", "stage"),
+            )
+        )
+        self._calls = self.metrics.add(
+            Counter(
+                "volview_rpc_calls_total",
+                "Endpoint calls and streams that finished",
+                ("endpoint", "type", "outcome"),
+            )
+        )
+
+        transfer = self.sio.transfer_stats
+        for unit in ("bytes", "messages", "chunks"):
+            self.metrics.add(
+                CallbackMetric(
+                    f"volview_transfer_{unit}_total",
+                    f"engine.io {unit} sent and received",
+                    "counter",
+                    ("direction",),
+                    lambda unit=unit: [
+                        (("in",), getattr(transfer, f"{unit}_in")),
+                        (("out",), getattr(transfer, f"{unit}_out")),
+                    ],
+                )
+            )
+
+        def gauge(name: str, help: str, collect, labelnames=()):
+            self.metrics.add(CallbackMetric(name, help, "gauge", labelnames, collect))
+
+        gauge(
+            "volview_connected_clients",
+            "Clients with a connection",
+            lambda: [((), sum(bool(s.sids) for s in self._client_states.values()))],
+        )
+        gauge(
+            "volview_inflight_client_rpcs",
+            "Client RPCs waiting for a result",
+            lambda: [((), len(self._inflight_rpcs))],
+        )
+        gauge(
+            "volview_active_streams",
+            "Streams sending results",
+            lambda: [((), self._active_streams)],
+        )
+        gauge(
+            "volview_scheduler_running",
+            "Endpoint calls running, per executor",
+            lambda: [
+                ((executor,), stats["running"])
+                for executor, stats in self.api.scheduler_stats().items()
+            ],
+            ("executor",),
+        )
+        gauge(
+            "volview_scheduler_queued",
+            "Endpoint calls waiting for a slot, per executor",
+            lambda: [
+                ((executor, priority), queued)
+                for executor, stats in self.api.scheduler_stats().items()
+                for priority, queued in stats["queued_by_priority"].items()
+            ],
+            ("executor", "priority"),
+        )
+        gauge(
+            "volview_scheduler_wait_seconds",
+            "Recent times that endpoint calls waited for a slot",
+            lambda: [
+                ((executor, quantile), stats[key])
+                for executor, stats in self.api.scheduler_stats().items()
+                for quantile, key in (
+                    ("0.5", "wait_time_p50"),
+                    ("0.99", "wait_time_p99"),
+                    ("1", "wait_time_max"),
+                )
+            ],
+            ("executor", "quantile"),
+        )
+        gauge(
+            "volview_sessions",
+            "Client sessions held by the session store",
+            lambda: [
+                (("memory",), self.sessions.stats().get("sessions", 0)),
+                (("spilled",), self.sessions.stats().get("spilled_sessions", 0)),
+            ],
+            ("tier",),
+        )
+        gauge(
+            "volview_session_bytes",
+            "Estimated bytes held by client sessions and image caches",
+            lambda: [((), self.sessions.stats().get("nbytes", 0))],
+        )
+
+        for key, name, help, type in (
+            ("hits", "hits_total", "Calls answered with a cached result", "counter"),
+            ("misses", "misses_total", "Calls of cached endpoints that ran", "counter"),
+            ("nbytes", "bytes", "Estimated bytes held by cached results", "gauge"),
+        ):
+            self.metrics.add(
+                CallbackMetric(
+                    f"volview_result_cache_{name}",
+                    help,
+                    type,
+                    ("endpoint",),
+                    lambda key=key: [
+                        ((endpoint,), stats[key])
+                        for endpoint, stats in self.api.cache_stats().items()
+                    ],
+                )
+            )
+
     def setup(self):
         """Runs setup and starts background tasks.
 
         Needs to be run from inside an async context.
         """
-        self._cleanup_task = asyncio.create_task(self.cleanup())
+        if self.api.has_process_endpoints():
+            self.api.start_process_pool()
+        self._session_sweeper = asyncio.ensure_future(self._sweep_sessions())
+        if self.cluster and not self.sio.manager_initialized:
+            # listens for other processes before any client connects
+            self.sio.manager_initialized = True
+            self.cluster.initialize()
 
     async def teardown(self):
         """Clean up, including stopping background tasks."""
-        if self._cleanup_task:
-            self._cleanup_task.cancel()
-        self._inflight_rpcs.clear()
-        for sid in self.clients.keys():
+        for client_id in list(self._client_states):
+            self._reclaim_client(client_id)
+        for future, _ in list(self._inflight_rpcs.values()):
+            future.cancel()
+        for task in list(self._cluster_tasks):
+            task.cancel()
+        for sid in list(self.clients):
             await self.sio.disconnect(sid)
-
-    async def cleanup(self):
+        if self._session_sweeper:
+            self._session_sweeper.cancel()
+            self._session_sweeper = None
+        self.sessions.clear()
+        if self.cluster and getattr(self.cluster, "thread", None):
+            self.cluster.thread.cancel()
+        self.api.shutdown_process_pool()
+
+    async def _sweep_sessions(self):
         while True:
-            await asyncio.sleep(self.future_timeout)
-
-            now = int(time.time())
-            for rpc_id, (future, metadata) in self._inflight_rpcs.items():
-                if (
-                    not future.done()
-                    and now - metadata.creation_time >= self.future_timeout
-                ):
-                    del self._inflight_rpcs[rpc_id]
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+            self.sessions.expire()
 
     async def call_client(
         self,
@@ -179,45 +555,228 @@ class RpcServer:
         args: List[Any] = None,
         client_id: Optional[str] = None,
         transform_args: bool = True,
+        timeout: Optional[float] = None,
     ):
         """Calls an RPC method on a given client or current client.
 
         Does not support invoking client generators.
 
+        If the client is disconnected, the call is sent once it reconnects.
+        Raises a ConnectionError if the client does not reconnect within the
+        disconnect grace period.
+
+        With a ClusterManager, clients that are connected to another server
+        process are called through that process.
+
         args: supplies a list of arguments to be sent to the client.
         client_id: targets a specific client.
-        transform_args: whether to apply transforms to the request args and response result.
+        transform_args: whether to apply transforms to the request args and
+            response result.
+        timeout: seconds to wait for the result before raising an
+            RpcTimeoutError. Defaults to the server's future_timeout.
         """
-        rpc_id = uuid.uuid4().hex
         client_id = client_id or current_client_id.get()
-
-        future: asyncio.Future = asyncio.Future()
+        args = args or []
+        timeout = self.future_timeout if timeout is None else timeout
 
         if transform_args:
             args = [self.api.serialize_object(obj) for obj in args]
+        if self.cluster is None or client_id in self._client_states:
+            result = await self._call_local_client(rpc_name, args, client_id, timeout)
+        else:
+            result = await self._call_remote_client(rpc_name, args, client_id, timeout)
+        if transform_args:
+            result = self.api.deserialize_object(result)
+        return result
 
-        info = FutureMetadata(transform_args=transform_args)
-        self._inflight_rpcs[rpc_id] = (future, info)
+    async def _call_local_client(
+        self, rpc_name: str, args: List[Any], client_id: str, timeout: float
+    ):
+        await self._wait_connected(client_id)
+        args = await self._compress(client_id, args)
+        rpc_id = uuid.uuid4().hex
+        future = self._track_rpc(rpc_id, rpc_name, client_id, timeout)
 
         await self.sio.emit(
             RPC_CALL_EVENT,
-            asdict(RpcCall(rpc_id, rpc_name, args)),
+            RpcCall(rpc_id, rpc_name, args).to_message(),
             room=client_id,
+            ignore_queue=True,
         )
         return await future
 
+    async def _call_remote_client(
+        self, rpc_name: str, args: List[Any], client_id: str, timeout: float
+    ):
+        """Calls a client through the server process that it is connected to.
+
+        The process that holds the client's state acknowledges the call. Like
+        a call to a local client, raises a ConnectionError if no process does
+        so within the disconnect grace period.
+        """
+        rpc_id = uuid.uuid4().hex
+        future = self._track_rpc(rpc_id, rpc_name, client_id, timeout)
+        _, info = self._inflight_rpcs[rpc_id]
+        info.ack_handle = asyncio.get_running_loop().call_later(
+            max(self.disconnect_grace_period, CLUSTER_ACK_TIMEOUT),
+            self._fail_unacknowledged_rpc,
+            rpc_id,
+        )
+        await self.cluster.publish(
+            CLUSTER_CALL_METHOD,
+            rpc_id=rpc_id,
+            rpc_name=rpc_name,
+            args=args,
+            client_id=client_id,
+            timeout=timeout,
+        )
+        return await future
+
+    def _track_rpc(self, rpc_id: str, rpc_name: str, client_id: str, timeout: float):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        # Expiry is scheduled on the event loop's timer heap, so each call
+        # costs O(log n) and nothing scans the inflight RPCs.
+        info = FutureMetadata(rpc_name, client_id)
+        info.timeout_handle = loop.call_later(
+            timeout, self._expire_rpc, rpc_id, timeout
+        )
+        self._inflight_rpcs[rpc_id] = (future, info)
+        future.add_done_callback(lambda _: self._discard_rpc(rpc_id))
+        return future
+
+    def _on_cluster_call(self, message: Dict[str, Any]):
+        if message["client_id"] not in self._client_states:
+            return
+        task = asyncio.ensure_future(self._answer_cluster_call(message))
+        self._cluster_tasks.add(task)
+        task.add_done_callback(self._cluster_tasks.discard)
+
+    async def _answer_cluster_call(self, message: Dict[str, Any]):
+        # tells the caller that this process holds the client
+        await self.cluster.publish(
+            CLUSTER_ACK_METHOD,
+            rpc_id=message["rpc_id"],
+            caller_host_id=message["host_id"],
+        )
+        try:
+            result = await self._call_local_client(
+                message["rpc_name"],
+                message["args"],
+                message["client_id"],
+                message["timeout"],
+            )
+        except Exception as exc:
+            reply = {"ok": False, "error": exc}
+        else:
+            reply = {"ok": True, "data": result}
+        await self.cluster.publish(
+            CLUSTER_RESULT_METHOD,
+            rpc_id=message["rpc_id"],
+            caller_host_id=message["host_id"],
+            **reply,
+        )
+
+    def _on_cluster_ack(self, message: Dict[str, Any]):
+        if message["caller_host_id"] != self.cluster.host_id:
+            return
+        _, info = self._inflight_rpcs.get(message["rpc_id"], (None, None))
+        if info is not None and info.ack_handle:
+            info.ack_handle.cancel()
+
+    def _fail_unacknowledged_rpc(self, rpc_id: str):
+        future, info = self._inflight_rpcs.pop(rpc_id, (None, None))
+        if future is None:
+            return
+        info.timeout_handle.cancel()
+        if not future.done():
+            future.set_exception(
+                ConnectionError(f"Client {info.client_id} is not connected")
+            )
+
+    def _on_cluster_result(self, message: Dict[str, Any]):
+        if message["caller_host_id"] != self.cluster.host_id:
+            return
+        future, info = self._inflight_rpcs.pop(message["rpc_id"], (None, None))
+        if future is None:
+            return
+        info.timeout_handle.cancel()
+        if info.ack_handle:
+            info.ack_handle.cancel()
+        if future.done():
+            return
+        if message["ok"]:
+            future.set_result(message["data"])
+        else:
+            future.set_exception(message["error"])
+
+    async def _compress(self, client_id: str, data: Any):
+        """Compresses large image arrays with the client's negotiated codec.
+
+        Compression runs in the default executor, off the event loop.
+        """
+        codec = self.codecs.get(client_id)
+        if codec is None or not has_compressible_arrays(
+            data, self.compression_threshold
+        ):
+            return data
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, compress_payload, data, codec, self.compression_threshold
+        )
+
+    async def _decompress(self, data: Any):
+        """Decompresses image arrays that the client compressed."""
+        if not has_compressed_arrays(data):
+            return data
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, decompress_payload, data)
+
+    def _expire_rpc(self, rpc_id: str, timeout: float):
+        future, info = self._inflight_rpcs.pop(rpc_id, (None, None))
+        if future is None:
+            # the RPC finished just before its timer fired
+            return
+        if info.ack_handle:
+            info.ack_handle.cancel()
+        if not future.done():
+            future.set_exception(
+                RpcTimeoutError(
+                    f"Client RPC {info.rpc_name} timed out after {timeout}s"
+                )
+            )
+
+    def _discard_rpc(self, rpc_id: str):
+        # the future is done, via a result, an error, a timeout or a cancel
+        _, info = self._inflight_rpcs.pop(rpc_id, (None, None))
+        if info:
+            info.timeout_handle.cancel()
+            if info.ack_handle:
+                info.ack_handle.cancel()
+
     async def _on_rpc_result(self, client_id: str, result: Any):
         try:
             rpc_id, ok, data, error = validate_rpc_result(result)
-            future, info = self._inflight_rpcs[rpc_id]
+            future, info = self._inflight_rpcs.pop(rpc_id)
         except (TypeError, KeyError):
             # ignore invalid RPC result
             logger.error("Received invalid RPC result")
         else:
-            del self._inflight_rpcs[rpc_id]
+            info.timeout_handle.cancel()
+            if future.done():
+                # the caller stopped waiting
+                return
             if ok:
-                if info.transform_args:
-                    data = self.api.deserialize_object(data)
+                try:
+                    data = await self._decompress(data)
+                except Exception as exc:
+                    if not future.done():
+                        future.set_exception(exc)
+                    return
+                if future.done():
+                    return
                 future.set_result(data)
             else:
                 future.set_exception(Exception(error))
@@ -228,14 +787,99 @@ class RpcServer:
         if not client_id:
             raise ConnectionRefusedError("No clientId provided")
 
+        state = self._client_states.get(client_id)
+        if state is None:
+            state = self._client_states[client_id] = ClientState()
+        elif state.reclaim_handle:
+            # reconnected within the grace period
+            state.reclaim_handle.cancel()
+            state.reclaim_handle = None
+        state.sids.add(sid)
         self.clients[sid] = client_id
 
+        (client_codecs,) = qs.get(CODECS_QS, [""])
+        self.codecs[client_id] = negotiate_codec(
+            client_codecs.split(","), self.compression_codecs
+        )
+
         await self.sio.enter_room(sid, client_id)
+        state.connected.set()
 
     async def _on_disconnect(self, sid: str):
-        client_id = self.clients[sid]
+        client_id = self.clients.pop(sid, None)
+        if client_id is None:
+            return
         await self.sio.leave_room(sid, client_id)
-        await self.sio.close_room(client_id)
+
+        state = self._client_states.get(client_id)
+        if state is None:
+            return
+        state.sids.discard(sid)
+        if state.sids:
+            # a reconnect can arrive before the old connection is dropped
+            return
+
+        # results wait for the client to reconnect
+        state.connected.clear()
+        if self.disconnect_grace_period > 0:
+            state.reclaim_handle = asyncio.get_running_loop().call_later(
+                self.disconnect_grace_period, self._reclaim_client, client_id
+            )
+        else:
+            self._reclaim_client(client_id)
+
+    def _reclaim_client(self, client_id: str):
+        """Cancels a client's calls and streams, and discards its state."""
+        state = self._client_states.pop(client_id, None)
+        if state is None:
+            return
+        if state.reclaim_handle:
+            state.reclaim_handle.cancel()
+        logger.info(f"Reclaiming state of client {client_id}")
+
+        # wakes anything waiting for the client to reconnect
+        state.reclaimed = True
+        state.connected.set()
+        for task in state.tasks:
+            task.cancel()
+        for (flow_client_id, _), flow in list(self._stream_flows.items()):
+            if flow_client_id == client_id:
+                flow.close()
+        for future, info in list(self._inflight_rpcs.values()):
+            if info.client_id == client_id and not future.done():
+                future.set_exception(
+                    ConnectionError(f"Client {client_id} disconnected")
+                )
+
+        self.sessions.remove(client_id)
+        self.codecs.pop(client_id, None)
+        self.api.discard_cached_results(client_id)
+
+    async def _wait_connected(self, client_id: str):
+        """Waits for a client to have a connection.
+
+        Raises a ConnectionError if the client's state was reclaimed.
+        """
+        state = self._client_states.get(client_id)
+        if state is not None:
+            await state.connected.wait()
+        if state is None or state.reclaimed:
+            raise ConnectionError(f"Client {client_id} is not connected")
+
+    async def _run_client_task(self, client_id: str, coro):
+        """Runs a client's call as a task that is cancelled with the client."""
+        state = self._client_states.get(client_id)
+        if state is None:
+            coro.close()
+            return
+        task = asyncio.ensure_future(coro)
+        state.tasks.add(task)
+        task.add_done_callback(state.tasks.discard)
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not state.reclaimed:
+                raise
 
     async def _on_rpc_call(self, client_id: str, data: Any):
         try:
@@ -243,18 +887,34 @@ class RpcServer:
         except TypeError:
             logger.error("Received invalid RPC call")
         else:
-            result = await self._try_rpc_call(client_id, name, args)
+            timer = StageTimer()
+            result = await self._try_rpc_call(client_id, name, args, timer)
             result.rpcId = rpc_id
-            await self.sio.emit(RPC_RESULT_EVENT, asdict(result), room=client_id)
+            await self._wait_connected(client_id)
+            # calls of unknown endpoints are not timed
+            timed = bool(timer.durations)
+            timer.skip()
+            await self.sio.emit(
+                RPC_RESULT_EVENT, result.to_message(), room=client_id, ignore_queue=True
+            )
+            timer.lap("emit")
+            if timed:
+                timer.observe(self._stage_seconds, (name,))
+                self._calls.inc((name, "rpc", "ok" if result.ok else "error"))
 
     async def _try_rpc_call(
-        self, client_id: str, name: str, args: List[Any]
+        self, client_id: str, name: str, args: List[Any], timer: StageTimer
     ) -> RpcResult:
         current_server.set(self)
         current_client_id.set(client_id)
 
         try:
-            result = await self.api.invoke_rpc(name, *args)
+            args = await self._decompress(args)
+            result = await self.api.invoke_rpc(
+                name, *args, client_id=client_id, timer=timer
+            )
+            result = await self._compress(client_id, result)
+            timer.lap("serialize")
             return RpcOkResult(result)
         except Exception as exc:
             logger.exception(f"RPC {name} raised an exception", stack_info=True)
@@ -263,23 +923,78 @@ class RpcServer:
     async def _on_stream_call(self, client_id: str, data: Any):
         try:
             rpc_id, name, args = validate_rpc_call(data)
+            window = validate_stream_window(data)
         except TypeError:
             logger.error("Received invalid RPC call")
             return
 
-        async for result in self._try_generate_stream(client_id, name, args):
-            result.rpcId = rpc_id
-            await self.sio.emit(STREAM_RESULT_EVENT, asdict(result), room=client_id)
+        flow_key = (client_id, rpc_id)
+        flow = StreamFlow(window, self.stream_max_queued_bytes)
+        self._stream_flows[flow_key] = flow
+
+        timer = StageTimer()
+        result = None
+        # streams of unknown endpoints are not timed
+        timed = False
+        self._active_streams += 1
+        try:
+            async for result in self._try_generate_stream(
+                client_id, name, args, flow, timer
+            ):
+                result.rpcId = rpc_id
+                await self._wait_connected(client_id)
+                timer.skip()
+                await self.sio.emit(
+                    STREAM_RESULT_EVENT,
+                    result.to_message(),
+                    room=client_id,
+                    ignore_queue=True,
+                )
+                timer.lap("emit")
+                timed = timed or "deserialize" in timer.durations
+                if timed:
+                    timer.observe(self._stage_seconds, (name,))
+        finally:
+            self._active_streams -= 1
+            self._stream_flows.pop(flow_key, None)
+        if timed and result is not None:
+            self._calls.inc((name, "stream", "ok" if result.ok else "error"))
+
+    def _on_stream_credit(self, client_id: str, data: Any):
+        try:
+            rpc_id, credits = validate_stream_credit(data)
+        except (TypeError, KeyError):
+            logger.error("Received invalid stream credit")
+            return
+
+        flow = self._stream_flows.get((client_id, rpc_id))
+        # credits may arrive after the stream is done
+        if flow:
+            flow.grant(credits)
 
     async def _try_generate_stream(
-        self, client_id: str, name: str, args: List[Any]
+        self,
+        client_id: str,
+        name: str,
+        args: List[Any],
+        flow: StreamFlow,
+        timer: Optional[StageTimer] = None,
     ) -> Generator[RpcResult, None, None]:
         current_server.set(self)
         current_client_id.set(client_id)
+        timer = timer or StageTimer()
 
         try:
-            async for data in self.api.invoke_stream(name, *args):
+            args = await self._decompress(args)
+            async for data in self.api.invoke_stream(
+                name, *args, client_id=client_id, timer=timer
+            ):
+                data = await self._compress(client_id, data)
+                timer.lap("serialize")
+                flow.consume(payload_nbytes(data))
                 yield StreamDataResult(done=False, data=data)
+                # the endpoint is suspended until the client catches up
+                await flow.wait(self.future_timeout)
             yield StreamDataResult(done=True)
         except Exception as exc:
             yield RpcErrorResult(str(exc))
@@ -0,0 +1,165 @@
+import asyncio
+import enum
+import time
+from collections import Counter, OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+# number of recent wait times kept for percentiles
+WAIT_TIME_SAMPLES = 1000
+
+
+class Priority(enum.Enum):
+    INTERACTIVE = "interactive"
+    BATCH = "batch"
+
+
+# queued calls of a higher priority always run first
+PRIORITY_ORDER = (Priority.INTERACTIVE, Priority.BATCH)
+
+
+@dataclass(eq=False)
+class _Waiter:
+    endpoint: str
+    max_concurrency: Optional[int]
+    future: asyncio.Future
+    enqueued_at: float
+
+
+def _percentile(sorted_values, fraction: float):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+class Scheduler:
+    """Schedules endpoint calls fairly onto a limited number of slots.
+
+    Calls queue up per priority class and per client. Queued interactive
+    calls run before queued batch calls, and within a priority class the
+    clients take turns, so a client that queues many slow calls does not hold
+    up the calls of other clients. A call also waits while its endpoint is
+    running max_concurrency calls.
+
+    With slots=None, the number of concurrent calls is only limited by the
+    endpoints' max_concurrency.
+    """
+
+    def __init__(self, slots: Optional[int] = None):
+        self.slots = slots
+        self.running = 0
+        self._running_by_endpoint: Counter = Counter()
+        # priority -> client ID -> queued calls, in the order clients take turns
+        self._queues: Dict[Priority, OrderedDict[str, Deque[_Waiter]]] = {
+            priority: OrderedDict() for priority in PRIORITY_ORDER
+        }
+        self._wait_times: Deque[float] = deque(maxlen=WAIT_TIME_SAMPLES)
+        self._max_wait_time = 0.0
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        client_id: str,
+        endpoint: str,
+        priority: Priority = Priority.INTERACTIVE,
+        max_concurrency: Optional[int] = None,
+    ):
+        """Waits for a turn to run a call, and holds a slot while it runs."""
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(
+            endpoint, max_concurrency, loop.create_future(), time.monotonic()
+        )
+        queue = self._queues[priority].setdefault(client_id, deque())
+        queue.append(waiter)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # the slot was granted as the call was cancelled
+                self._release(endpoint)
+            else:
+                self._remove(priority, client_id, waiter)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(endpoint)
+
+    def stats(self):
+        """Gets the current queue depths and the recent wait times in seconds."""
+        queued_by_priority = {}
+        queued_by_endpoint: Counter = Counter()
+        queued_by_client: Counter = Counter()
+        for priority, clients in self._queues.items():
+            queued_by_priority[priority.value] = sum(map(len, clients.values()))
+            for client_id, queue in clients.items():
+                queued_by_client[client_id] += len(queue)
+                queued_by_endpoint.update(waiter.endpoint for waiter in queue)
+
+        wait_times = sorted(self._wait_times)
+        return {
+            "running": self.running,
+            "running_by_endpoint": dict(+self._running_by_endpoint),
+            "queued": sum(queued_by_priority.values()),
+            "queued_by_priority": queued_by_priority,
+            "queued_by_endpoint": dict(queued_by_endpoint),
+            "queued_by_client": dict(queued_by_client),
+            "wait_time_p50": _percentile(wait_times, 0.5),
+            "wait_time_p99": _percentile(wait_times, 0.99),
+            "wait_time_max": self._max_wait_time,
+        }
+
+    def _can_run(self, waiter: _Waiter):
+        limit = waiter.max_concurrency
+        return limit is None or self._running_by_endpoint[waiter.endpoint] < limit
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        for priority in PRIORITY_ORDER:
+            clients = self._queues[priority]
+            for client_id, queue in clients.items():
+                for waiter in queue:
+                    if self._can_run(waiter):
+                        queue.remove(waiter)
+                        # the client takes its next turn after all others
+                        clients.move_to_end(client_id)
+                        if not queue:
+                            del clients[client_id]
+                        return waiter
+        return None
+
+    def _dispatch(self):
+        while self.slots is None or self.running < self.slots:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            if waiter.future.done():
+                # cancelled while queued
+                continue
+            self.running += 1
+            self._running_by_endpoint[waiter.endpoint] += 1
+            wait_time = time.monotonic() - waiter.enqueued_at
+            self._wait_times.append(wait_time)
+            self._max_wait_time = max(self._max_wait_time, wait_time)
+            waiter.future.set_result(None)
+
+    def _release(self, endpoint: str):
+        self.running -= 1
+        self._running_by_endpoint[endpoint] -= 1
+        self._dispatch()
+
+    def _remove(self, priority: Priority, client_id: str, waiter: _Waiter):
+        clients = self._queues[priority]
+        queue = clients.get(client_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del clients[client_id]
@@ -1,6 +1,8 @@
 from typing import Callable, Any, TypeVar
 
+from volview_server.image_cache import ImageCache
 from volview_server.rpc_server import current_server, current_client_id
+from volview_server.session_store import EvictionHook
 
 T = TypeVar("T")
 
@@ -26,6 +28,48 @@ def get_current_session(default_factory: Callable[[], T] = None) -> T:
     if not client_id:
         raise RuntimeError("No no current client")
 
-    if client_id not in server.sessions and default_factory:
-        server.sessions[client_id] = default_factory()
-    return server.sessions.get(client_id, None)
+    return server.sessions.get_session(client_id, default_factory)
+
+
+def get_current_image_cache() -> ImageCache:
+    """Retrieves the image cache for the current client.
+
+    This should only be called from inside an RPC endpoint.
+
+    The image cache lives as long as the client's session, and counts towards
+    the session store's byte budget. Its own byte budget is set by the server's
+    image_cache_size option.
+
+    If there is no current client, then this will raise a RuntimeError.
+    """
+    server = current_server.get()
+    if not server:
+        raise RuntimeError("No current server")
+
+    client_id = current_client_id.get()
+    if not client_id:
+        raise RuntimeError("No no current client")
+
+    return server.sessions.get_image_cache(client_id)
+
+
+def on_session_evicted(hook: EvictionHook):
+    """Calls hook(client_id, session, reason) once the current session is evicted.
+
+    This should only be called from inside an RPC endpoint.
+
+    Sessions are evicted once they expire, to fit the session store's byte
+    budget, or once their client is gone. The hook can free the resources
+    that the session holds. See EvictionReason.
+
+    If there is no current client, then this will raise a RuntimeError.
+    """
+    server = current_server.get()
+    if not server:
+        raise RuntimeError("No current server")
+
+    client_id = current_client_id.get()
+    if not client_id:
+        raise RuntimeError("No no current client")
+
+    server.sessions.add_eviction_hook(hook, client_id)
@@ -0,0 +1,376 @@
+import enum
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+import types
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional, Set
+
+import numpy as np
+
+from volview_server.image_cache import IMAGE_CACHE_SIZE, ImageCache, image_nbytes
+from volview_server.image_pyramid import pyramid_cache
+
+SESSION_SWEEP_INTERVAL = 60  # seconds
+# sessions in use are measured at most this often, while they fit the budget
+SESSION_MEASURE_INTERVAL = 1  # seconds
+
+logger = logging.getLogger("volview_server.session_store")
+
+
+class EvictionReason(enum.Enum):
+    # idle for longer than the store's TTL
+    EXPIRED = "expired"
+    # evicted to stay within the store's byte budget
+    OVER_BUDGET = "over_budget"
+    # moved to disk to stay within the byte budget. Restored on next access.
+    SPILLED = "spilled"
+    # the client's state was reclaimed, or the server shut down
+    REMOVED = "removed"
+
+
+# (client ID, session, reason) -> None
+EvictionHook = Callable[[str, Any, EvictionReason], None]
+
+
+def session_nbytes(obj: Any) -> int:
+    """Estimates the memory held by a session object.
+
+    Walks containers and object attributes, counting the pixel buffers of ITK
+    images and numpy arrays in full.
+    """
+    seen = set()
+    stack = [obj]
+    nbytes = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+
+        if isinstance(obj, (type, types.ModuleType, types.FunctionType)):
+            # shared by the whole server
+            continue
+        if isinstance(obj, np.ndarray) or type(obj).__name__.startswith(
+            ("itkImage", "itkVectorImage")
+        ):
+            nbytes += image_nbytes(obj)
+        elif isinstance(obj, ImageCache):
+            nbytes += obj.nbytes
+        elif isinstance(obj, dict):
+            nbytes += sys.getsizeof(obj)
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            nbytes += sys.getsizeof(obj)
+            stack.extend(obj)
+        else:
+            nbytes += sys.getsizeof(obj)
+            if hasattr(obj, "__dict__"):
+                stack.append(vars(obj))
+    return nbytes
+
+
+class SessionStore(ABC):
+    """Holds the session object and image cache of each client.
+
+    Subclass this to keep sessions elsewhere, and pass it to RpcServer with
+    the session_store option. Methods may be called from worker threads.
+    """
+
+    @abstractmethod
+    def get_session(
+        self, client_id: str, default_factory: Optional[Callable[[], Any]] = None
+    ) -> Any:
+        """Gets a client's session object.
+
+        If the client has no session and default_factory is provided, then
+        a new session is created with it. Otherwise, returns None.
+        """
+
+    @abstractmethod
+    def get_image_cache(self, client_id: str) -> ImageCache:
+        """Gets a client's image cache, creating it if necessary."""
+
+    @abstractmethod
+    def add_eviction_hook(self, hook: EvictionHook, client_id: Optional[str] = None):
+        """Calls hook(client_id, session, reason) as sessions are evicted.
+
+        With a client_id, the hook is only called for that client's session.
+        """
+
+    @abstractmethod
+    def remove(self, client_id: str):
+        """Discards a client's session and image cache."""
+
+    def expire(self):
+        """Evicts the sessions that have been idle for too long.
+
+        The server calls this periodically, so it is also a place to do other
+        periodic upkeep.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """Discards all sessions."""
+
+    def stats(self):
+        """Gets the number of sessions and the bytes they hold."""
+        return {}
+
+
+@dataclass(eq=False)
+class _SessionEntry:
+    last_access: float
+    session: Any = None
+    image_cache: Optional[ImageCache] = None
+    hooks: List[EvictionHook] = field(default_factory=list)
+    # estimated size of the session object, excluding the image cache
+    session_nbytes: int = 0
+    # when session_nbytes was estimated
+    measured_at: float = float("-inf")
+    # file holding the pickled session, while the session is spilled to disk
+    spill_path: Optional[str] = None
+
+    @property
+    def nbytes(self):
+        cache_nbytes = self.image_cache.nbytes if self.image_cache else 0
+        return self.session_nbytes + cache_nbytes
+
+
+class MemorySessionStore(SessionStore):
+    """Keeps sessions in memory, with optional expiry and a byte budget.
+
+    Sessions that are not accessed for ttl seconds are evicted. Once the
+    sessions and image caches of all clients take up more than max_bytes,
+    the least recently used clients are evicted until they fit. The session
+    that is being accessed is never evicted. The process's image pyramids
+    count against max_bytes too, but as they can be rebuilt, they are
+    evicted before any session is.
+
+    The size of a session is estimated with session_nbytes(), which walks
+    the session. Sessions that were accessed are measured again at most every
+    SESSION_MEASURE_INTERVAL seconds, and before sessions are evicted to fit
+    the budget. Without a budget, sessions are only measured as the server
+    sweeps them periodically, for stats().
+
+    With a spill_dir, sessions evicted to fit the byte budget are pickled to
+    that directory and restored as the client accesses its session again.
+    Their image caches are discarded. Sessions that cannot be pickled are
+    evicted instead.
+
+    Eviction hooks are called with the evicted session, so that they can free
+    the resources it holds. Hooks are called once a session is spilled, but
+    not when a spilled session expires or is removed.
+    """
+
+    ttl: Optional[float]
+    max_bytes: Optional[int]
+    image_cache_size: int
+    spill_dir: Optional[str]
+
+    def __init__(
+        self,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        image_cache_size: int = IMAGE_CACHE_SIZE,
+        spill_dir: Optional[str] = None,
+    ):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.image_cache_size = image_cache_size
+        self.spill_dir = spill_dir
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok=True)
+
+        # client ID -> entry, least recently used first
+        self._entries: OrderedDict[str, _SessionEntry] = OrderedDict()
+        self._hooks: List[EvictionHook] = []
+        # IDs of the clients whose sessions were accessed since they were
+        # measured, so may have changed
+        self._changed: Set[str] = set()
+        self._lock = threading.RLock()
+
+    def get_session(
+        self, client_id: str, default_factory: Optional[Callable[[], Any]] = None
+    ) -> Any:
+        with self._lock:
+            entry = self._access(client_id, create=default_factory is not None)
+            if entry is None:
+                return None
+            if entry.session is None and default_factory:
+                entry.session = default_factory()
+            self._enforce_budget(client_id)
+            return entry.session
+
+    def get_image_cache(self, client_id: str) -> ImageCache:
+        with self._lock:
+            entry = self._access(client_id, create=True)
+            if entry.image_cache is None:
+                entry.image_cache = ImageCache(self.image_cache_size)
+            self._enforce_budget(client_id)
+            return entry.image_cache
+
+    def add_eviction_hook(self, hook: EvictionHook, client_id: Optional[str] = None):
+        with self._lock:
+            if client_id is None:
+                self._hooks.append(hook)
+            else:
+                self._access(client_id, create=True).hooks.append(hook)
+
+    def remove(self, client_id: str):
+        with self._lock:
+            self._evict(client_id, EvictionReason.REMOVED)
+
+    def expire(self):
+        """Evicts idle sessions, and measures the sessions that changed.
+
+        Sessions are evicted if they no longer fit the byte budget.
+        """
+        with self._lock:
+            self._expire_idle()
+            self._measure(force=True)
+            self._enforce_budget(None)
+
+    def _expire_idle(self):
+        if self.ttl is None:
+            return
+        deadline = time.monotonic() - self.ttl
+        # entries are ordered by last access
+        while self._entries:
+            client_id, entry = next(iter(self._entries.items()))
+            if entry.last_access > deadline:
+                break
+            self._evict(client_id, EvictionReason.EXPIRED)
+
+    def clear(self):
+        with self._lock:
+            for client_id in list(self._entries):
+                self._evict(client_id, EvictionReason.REMOVED)
+
+    def stats(self):
+        with self._lock:
+            spilled = sum(1 for entry in self._entries.values() if entry.spill_path)
+            return {
+                "sessions": len(self._entries) - spilled,
+                "spilled_sessions": spilled,
+                "nbytes": sum(entry.nbytes for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+    def _access(self, client_id: str, create: bool) -> Optional[_SessionEntry]:
+        self._expire_idle()
+        now = time.monotonic()
+        entry = self._entries.get(client_id)
+        if entry is None:
+            if not create:
+                return None
+            entry = self._entries[client_id] = _SessionEntry(now)
+        self._entries.move_to_end(client_id)
+        entry.last_access = now
+        # the caller may change the session
+        self._changed.add(client_id)
+        if entry.spill_path:
+            self._restore(client_id, entry)
+        return entry
+
+    def _measure(self, force: bool, in_use: Optional[str] = None):
+        """Measures the sessions that may have changed.
+
+        Unless forced, sessions measured in the last SESSION_MEASURE_INTERVAL
+        seconds are skipped.
+        """
+        now = time.monotonic()
+        for client_id in list(self._changed):
+            entry = self._entries[client_id]
+            if not force and now - entry.measured_at < SESSION_MEASURE_INTERVAL:
+                continue
+            entry.session_nbytes = session_nbytes(entry.session)
+            entry.measured_at = now
+            # the session in use may still be changed by its caller
+            if client_id != in_use:
+                self._changed.discard(client_id)
+
+    def _enforce_budget(self, in_use: Optional[str]):
+        if self.max_bytes is None:
+            return
+        self._measure(force=False, in_use=in_use)
+        nbytes = sum(entry.nbytes for entry in self._entries.values())
+        if nbytes > self.max_bytes and self._changed:
+            # evict by up-to-date sizes
+            self._measure(force=True, in_use=in_use)
+            nbytes = sum(entry.nbytes for entry in self._entries.values())
+        pyramid_cache.evict(max(0, self.max_bytes - nbytes))
+        for client_id in list(self._entries):
+            if nbytes <= self.max_bytes:
+                break
+            entry = self._entries[client_id]
+            if client_id == in_use or entry.spill_path:
+                continue
+            nbytes -= entry.nbytes
+            if not (self.spill_dir and self._spill(client_id, entry)):
+                self._evict(client_id, EvictionReason.OVER_BUDGET)
+
+    def _evict(self, client_id: str, reason: EvictionReason):
+        entry = self._entries.pop(client_id, None)
+        self._changed.discard(client_id)
+        if entry is None:
+            return
+        if entry.spill_path:
+            _remove_file(entry.spill_path)
+        elif entry.session is not None:
+            self._call_hooks(client_id, entry, reason)
+
+    def _spill(self, client_id: str, entry: _SessionEntry) -> bool:
+        if entry.session is None:
+            return False
+        digest = hashlib.sha256(client_id.encode()).hexdigest()
+        path = os.path.join(self.spill_dir, f"{digest}.pickle")
+        try:
+            with open(path, "wb") as fp:
+                pickle.dump(entry.session, fp, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            logger.warning(f"Could not spill the session of client {client_id}")
+            _remove_file(path)
+            return False
+
+        self._call_hooks(client_id, entry, EvictionReason.SPILLED)
+        entry.session = None
+        entry.image_cache = None
+        entry.session_nbytes = 0
+        self._changed.discard(client_id)
+        entry.spill_path = path
+        return True
+
+    def _restore(self, client_id: str, entry: _SessionEntry):
+        path = entry.spill_path
+        entry.spill_path = None
+        # measured before the next budget check, however recently it was spilled
+        entry.measured_at = float("-inf")
+        try:
+            with open(path, "rb") as fp:
+                entry.session = pickle.load(fp)
+        except Exception:
+            logger.exception(f"Could not restore the session of client {client_id}")
+        finally:
+            _remove_file(path)
+
+    def _call_hooks(self, client_id: str, entry: _SessionEntry, reason):
+        for hook in self._hooks + entry.hooks:
+            try:
+                hook(client_id, entry.session, reason)
+            except Exception:
+                logger.exception(f"Session eviction hook {hook} raised an exception")
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
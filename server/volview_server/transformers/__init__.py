@@ -1,10 +1,27 @@
-from typing import Callable, List, Any
+__all__ = [
+    "Transformer",
+    "TransformDispatcher",
+    "transformer",
+    "convert_itk_to_vtkjs_image",
+    "convert_vtkjs_to_itk_image",
+    "convert_vtkjs_to_itk_image_view",
+    "pipe",
+    "transform_object",
+    "default_serializers",
+    "default_deserializers",
+]
 
-Transformer = Callable[[Any], Any]
+from typing import Callable, List, Any
 
+from volview_server.transformers.registry import (
+    Transformer,
+    TransformDispatcher,
+    transformer,
+)
 from volview_server.transformers.image_data import (
     convert_itk_to_vtkjs_image,
     convert_vtkjs_to_itk_image,
+    convert_vtkjs_to_itk_image_view,
 )
 
 
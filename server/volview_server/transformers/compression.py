@@ -0,0 +1,161 @@
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+COMPRESSION_THRESHOLD = 1 * 1024 * 1024
+# server-side preference, best ratio and speed first
+CODEC_PREFERENCE = ["zstd", "lz4", "deflate"]
+
+Codec = Tuple[Callable[[Any], bytes], Callable[[Any], bytes]]
+
+CODECS: Dict[str, Codec] = {
+    # zlib format, which browsers decode with DecompressionStream("deflate")
+    "deflate": (lambda data: zlib.compress(data, 1), zlib.decompress),
+}
+
+if zstandard is not None:
+    CODECS["zstd"] = (
+        lambda data: zstandard.ZstdCompressor(level=3).compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data),
+    )
+
+if lz4 is not None:
+    CODECS["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+
+
+def available_codecs() -> List[str]:
+    """Lists the codecs this server can use, in order of preference."""
+    return [name for name in CODEC_PREFERENCE if name in CODECS]
+
+
+def negotiate_codec(
+    client_codecs: List[str], server_codecs: Optional[List[str]] = None
+) -> Optional[str]:
+    """Picks the first server codec that the client also supports."""
+    if server_codecs is None:
+        server_codecs = available_codecs()
+    for codec in server_codecs:
+        if codec in CODECS and codec in client_codecs:
+            return codec
+    return None
+
+
+def _is_data_array(obj: Any):
+    return isinstance(obj, dict) and obj.get("vtkClass") == "vtkDataArray"
+
+
+def _is_binary(obj: Any):
+    return isinstance(obj, (bytes, bytearray, memoryview, np.ndarray))
+
+
+def _binary_size(obj) -> int:
+    if isinstance(obj, (memoryview, np.ndarray)):
+        return obj.nbytes
+    return len(obj)
+
+
+def _map_data_arrays(obj: Any, fn: Callable[[Dict], Dict]) -> Any:
+    """Applies fn to every vtkDataArray in a serialized payload.
+
+    Containers are only rebuilt along paths where fn returned a new object.
+    """
+    if _is_data_array(obj):
+        return fn(obj)
+
+    if isinstance(obj, (list, tuple)):
+        items = [_map_data_arrays(item, fn) for item in obj]
+        if all(a is b for a, b in zip(items, obj)):
+            return obj
+        return items
+
+    if isinstance(obj, dict):
+        items = {key: _map_data_arrays(value, fn) for key, value in obj.items()}
+        if all(items[key] is value for key, value in obj.items()):
+            return obj
+        return items
+
+    return obj
+
+
+def _iter_data_arrays(obj: Any):
+    if _is_data_array(obj):
+        yield obj
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            yield from _iter_data_arrays(item)
+    elif isinstance(obj, dict):
+        for value in obj.values():
+            yield from _iter_data_arrays(value)
+
+
+def has_compressible_arrays(obj: Any, threshold: int = COMPRESSION_THRESHOLD):
+    """Checks for vtkDataArray values that are large enough to compress.
+
+    This only walks the payload structure, so it is cheap to run on the
+    event loop before deciding to compress.
+    """
+    return any(
+        "compression" not in array
+        and _is_binary(array.get("values"))
+        and _binary_size(array["values"]) >= threshold
+        for array in _iter_data_arrays(obj)
+    )
+
+
+def has_compressed_arrays(obj: Any):
+    return any("compression" in array for array in _iter_data_arrays(obj))
+
+
+def compress_payload(
+    obj: Any, codec: str, threshold: int = COMPRESSION_THRESHOLD
+) -> Any:
+    """Compresses the values of large vtkDataArrays in a serialized payload.
+
+    Compressed arrays are tagged with a "compression" key naming the codec.
+    Arrays that do not get smaller are sent as-is. The input payload is left
+    untouched.
+    """
+    compress, _ = CODECS[codec]
+
+    def compress_array(array: Dict):
+        values = array.get("values")
+        if (
+            "compression" in array
+            or not _is_binary(values)
+            or _binary_size(values) < threshold
+        ):
+            return array
+        compressed = compress(values)
+        if len(compressed) >= _binary_size(values):
+            return array
+        return {**array, "values": compressed, "compression": codec}
+
+    return _map_data_arrays(obj, compress_array)
+
+
+def decompress_payload(obj: Any) -> Any:
+    """Decompresses all tagged vtkDataArray values in a serialized payload."""
+
+    def decompress_array(array: Dict):
+        codec = array.get("compression")
+        if codec is None:
+            return array
+        if codec not in CODECS:
+            raise ValueError(f"Unsupported compression codec {codec}")
+        _, decompress = CODECS[codec]
+        output = {**array, "values": decompress(array["values"])}
+        del output["compression"]
+        return output
+
+    return _map_data_arrays(obj, decompress_array)
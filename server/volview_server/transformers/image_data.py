@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, Sequence
 
 import itk
 import numpy as np
@@ -8,13 +8,40 @@ from volview_server.transformers.itk_helpers import (
     TYPE_ARRAY_JS_TO_NUMPY,
 )
 from volview_server.transformers.exceptions import ConvertError
+from volview_server.transformers.registry import transformer
 
 
-def vtk_to_itk_image(vtk_image: Dict):
-    """Converts a serialized vtkImageData to an ITK image."""
+def is_itk_image_type(cls: type):
+    return cls.__name__.startswith("itkImage")
+
+
+def is_vtk_image_data(obj):
+    return isinstance(obj, dict) and obj.get("vtkClass", None) == "vtkImageData"
+
+
+def _keep_buffer_alive(itk_image, buffer: np.ndarray):
+    """Keeps a pixel buffer alive for as long as an ITK image uses it.
+
+    GetImageViewFromArray only references the buffer from the Python wrapper,
+    but a pipeline can hold on to the image after the wrapper is gone. The
+    DeleteEvent observer is owned by the C++ image, so its reference to the
+    buffer is only released when the image itself is destroyed.
+    """
+    # the observer must not reference itk_image, or the image is never freed
+    itk_image.AddObserver(itk.DeleteEvent(), lambda: buffer)
+
+
+def vtk_to_itk_image(vtk_image: Dict, view: bool = False):
+    """Converts a serialized vtkImageData to an ITK image.
+
+    By default, the pixel data is copied. With view=True, the ITK image shares
+    memory with the serialized pixel buffer, which is kept alive for as long
+    as the image is. Views of a read-only buffer, such as bytes, must only be
+    used as inputs to filters that do not modify them in place.
+    """
     if not isinstance(vtk_image, dict):
         raise ConvertError("Provided vtk_image is not a dict")
-    if vtk_image.get("vtkClass", None) != "vtkImageData":
+    if not is_vtk_image_data(vtk_image):
         raise ConvertError("Provided vtk_image is not a serialized vtkImageData")
 
     try:
@@ -27,7 +54,7 @@ def vtk_to_itk_image(vtk_image: Dict):
         ]
         if type(vtk_image["direction"]) is list:
             direction = np.array(vtk_image["direction"], dtype=float)
-        elif type(vtk_image["direction"] is bytes):
+        elif isinstance(vtk_image["direction"], (bytes, bytearray, memoryview)):
             direction = np.frombuffer(vtk_image["direction"], dtype=float)
         else:
             raise TypeError("Cannot parse image direction")
@@ -44,7 +71,12 @@ def vtk_to_itk_image(vtk_image: Dict):
             )
 
         pixel_data = np.frombuffer(pixel_data_array["values"], dtype=pixel_dtype)
-        itk_image = itk.GetImageFromArray(np.reshape(pixel_data, dims))
+        pixel_data = np.reshape(pixel_data, dims)
+        if view:
+            itk_image = itk.GetImageViewFromArray(pixel_data)
+            _keep_buffer_alive(itk_image, pixel_data)
+        else:
+            itk_image = itk.GetImageFromArray(pixel_data)
 
         # https://discourse.itk.org/t/set-image-direction-from-numpy-array/844/10
         itk_image.SetDirection(itk.matrix_from_array(direction))
@@ -56,23 +88,32 @@ def vtk_to_itk_image(vtk_image: Dict):
         raise ConvertError("Cannot convert provided vtk_image to an ITK image") from exc
 
 
-def itk_to_vtk_image(itk_image):
-    """Converts an ITK image to a serialized vtkImageData for vtk.js."""
-    if not type(itk_image).__name__.startswith("itkImage"):
-        raise ConvertError("Provided data is not an ITK image")
+def _image_dimension(itk_image) -> int:
+    """Gets the dimension of a 2D or 3D image.
+
+    vtk.js images are always 3D, so 2D images are sent as a single slice.
+    Raises a ConvertError for images of other dimensions.
+    """
+    dimension = itk_image.GetImageDimension()
+    if dimension not in (2, 3):
+        raise ConvertError(f"Cannot convert {dimension}D images, only 2D and 3D")
+    return dimension
 
-    size = list(itk_image.GetLargestPossibleRegion().GetSize())
-    values = itk.GetArrayViewFromImage(itk_image).flatten(order="C")
+
+def _to_3d(values: Sequence, fill) -> list:
+    return list(values) + [fill] * (3 - len(values))
+
+
+def _itk_image_geometry(itk_image):
+    dimension = _image_dimension(itk_image)
+    size = _to_3d(itk_image.GetLargestPossibleRegion().GetSize(), 1)
+    direction = np.eye(3)
+    direction[:dimension, :dimension] = itk.GetArrayFromVnlMatrix(
+        itk_image.GetDirection().GetVnlMatrix().as_matrix()
+    )
     return {
-        "vtkClass": "vtkImageData",
-        "dataDescription": 8,
-        "direction": list(
-            itk.GetArrayFromVnlMatrix(
-                itk_image.GetDirection().GetVnlMatrix().as_matrix()
-            )
-            .transpose()  # vtk.js is column-major, ITK is row-major
-            .flatten()
-        ),
+        # vtk.js is column-major, ITK is row-major
+        "direction": list(direction.transpose().flatten()),
         "extent": [
             0,
             size[0] - 1,
@@ -81,8 +122,24 @@ def itk_to_vtk_image(itk_image):
             0,
             size[2] - 1,
         ],
-        "spacing": list(itk_image.GetSpacing()),
-        "origin": list(itk_image.GetOrigin()),
+        "spacing": _to_3d(itk_image.GetSpacing(), 1.0),
+        "origin": _to_3d(itk_image.GetOrigin(), 0.0),
+    }
+
+
+def itk_to_vtk_image(itk_image):
+    """Converts an ITK image to a serialized vtkImageData for vtk.js."""
+    if not is_itk_image_type(type(itk_image)):
+        raise ConvertError("Provided data is not an ITK image")
+
+    # A view of ITK's pixel buffer, in C order. The view holds a reference to
+    # itk_image, so the buffer stays valid for as long as the serialized
+    # message is being sent.
+    pixels = itk.GetArrayViewFromImage(itk_image)
+    return {
+        "vtkClass": "vtkImageData",
+        "dataDescription": 8,
+        **_itk_image_geometry(itk_image),
         "pointData": {
             "vtkClass": "vtkDataSetAttributes",
             # the index of the only array
@@ -91,8 +148,8 @@ def itk_to_vtk_image(itk_image):
                 {
                     "data": {
                         "vtkClass": "vtkDataArray",
-                        "size": len(values),
-                        "values": values.tobytes(),
+                        "size": pixels.size,
+                        "values": pixels.reshape(-1).view(np.uint8),
                         "dataType": itk_image_pixel_type_to_js(itk_image),
                         "numberOfComponents": itk_image.GetNumberOfComponentsPerPixel(),
                         "name": "Scalars",
@@ -103,13 +160,90 @@ def itk_to_vtk_image(itk_image):
     }
 
 
+def itk_image_header(itk_image):
+    """Serializes an ITK image's geometry and pixel type, without its pixels.
+
+    The client allocates an empty image from the header, then fills it in
+    with regions from itk_region_to_vtk.
+    """
+    if not is_itk_image_type(type(itk_image)):
+        raise ConvertError("Provided data is not an ITK image")
+
+    return {
+        **_itk_image_geometry(itk_image),
+        "dataType": itk_image_pixel_type_to_js(itk_image),
+        "numberOfComponents": itk_image.GetNumberOfComponentsPerPixel(),
+    }
+
+
+def itk_region_to_vtk(itk_image, index: Sequence[int], size: Sequence[int]):
+    """Serializes a region of an ITK image for a sub-extent update.
+
+    The region is given by its index and size in ITK (x, y, z) order, relative
+    to the image's largest possible region, or in (x, y) order for 2D images.
+    The result holds the region's inclusive vtk.js extent and its pixels as a
+    vtkDataArray, so only the region's pixels are copied and sent.
+    """
+    if not is_itk_image_type(type(itk_image)):
+        raise ConvertError("Provided data is not an ITK image")
+    _image_dimension(itk_image)
+
+    image_region = itk_image.GetLargestPossibleRegion()
+    image_start = list(image_region.GetIndex())
+    image_size = list(image_region.GetSize())
+    start = [i - s for i, s in zip(index, image_start)]
+    if (
+        len(start) != len(image_size)
+        or len(size) != len(image_size)
+        or any(i < 0 or n < 1 or i + n > d for i, n, d in zip(start, size, image_size))
+    ):
+        raise ValueError(f"Region {list(index)}, {list(size)} is outside the image")
+
+    # numpy indexes in ZYX order
+    region = tuple(slice(i, i + n) for i, n in zip(reversed(start), reversed(size)))
+    pixels = np.ascontiguousarray(itk.GetArrayViewFromImage(itk_image)[region])
+
+    extent = []
+    for i, n in zip(_to_3d(start, 0), _to_3d(size, 1)):
+        extent += [i, i + n - 1]
+
+    return {
+        "extent": extent,
+        "scalars": {
+            "vtkClass": "vtkDataArray",
+            "size": pixels.size,
+            "values": pixels.reshape(-1).view(np.uint8),
+            "dataType": itk_image_pixel_type_to_js(itk_image),
+            "numberOfComponents": itk_image.GetNumberOfComponentsPerPixel(),
+        },
+    }
+
+
+@transformer(dict)
 def convert_vtkjs_to_itk_image(obj):
+    if not is_vtk_image_data(obj):
+        return obj
     try:
         return vtk_to_itk_image(obj)
     except ConvertError:
         return obj
 
 
+@transformer(dict)
+def convert_vtkjs_to_itk_image_view(obj):
+    """Deserializes images as ITK views of the received pixel buffers.
+
+    Use this in place of convert_vtkjs_to_itk_image to skip copying images.
+    """
+    if not is_vtk_image_data(obj):
+        return obj
+    try:
+        return vtk_to_itk_image(obj, view=True)
+    except ConvertError:
+        return obj
+
+
+@transformer(match=is_itk_image_type)
 def convert_itk_to_vtkjs_image(obj):
     try:
         return itk_to_vtk_image(obj)
@@ -0,0 +1,135 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+Transformer = Callable[[Any], Any]
+TypeMatcher = Callable[[type], bool]
+
+# types that are never traversed, and skipped if no transformer applies to them
+LEAF_TYPES = (
+    type(None),
+    bool,
+    int,
+    float,
+    complex,
+    str,
+    bytes,
+    bytearray,
+    memoryview,
+    np.ndarray,
+)
+
+
+def transformer(*types: type, match: Optional[TypeMatcher] = None):
+    """Declares which input types a transformer applies to.
+
+    Either list the types, or pass a match function that takes an input type.
+    Transformers without declared types are called on every value.
+
+    @transformer(datetime)
+    def encode_datetime(dt):
+        ...
+    """
+    if match is None:
+
+        def match(cls: type):
+            return issubclass(cls, types)
+
+    def decorator(fn: Transformer):
+        fn.transformer_match = match
+        return fn
+
+    return decorator
+
+
+def applies_to(fn: Transformer, cls: type):
+    match = getattr(fn, "transformer_match", None)
+    return match is None or match(cls)
+
+
+class TransformDispatcher:
+    """Transforms nested objects, dispatching transformers by type.
+
+    Each type is matched against the transformers once and the result is
+    cached, so a transformer is only ever called on the types it declared.
+    Transformers run in order, as if every value were piped through all of
+    them: once a transformer changes a value's type, the transformers after
+    it are matched against the new type.
+    Leaf values that no transformer applies to, such as numbers, strings and
+    numpy arrays, are returned as-is without any calls. Lists of such values
+    are copied without visiting each item from Python.
+
+    The cache is rebuilt whenever the list of transformers changes.
+    """
+
+    def __init__(self):
+        self._transformers: Tuple[Transformer, ...] = ()
+        # type -> (position, transformer) of the transformers that apply to it
+        self._dispatch: Dict[type, Tuple[Tuple[int, Transformer], ...]] = {}
+        self._leaf_types = frozenset()
+
+    def transform(self, obj: Any, transformers: List[Transformer]):
+        if tuple(transformers) != self._transformers:
+            self._transformers = tuple(transformers)
+            self._dispatch = {}
+            self._leaf_types = frozenset(
+                cls for cls in LEAF_TYPES if not self._lookup(cls)
+            )
+        return self._transform(obj)
+
+    def _lookup(self, cls: type) -> Tuple[Tuple[int, Transformer], ...]:
+        fns = self._dispatch.get(cls)
+        if fns is None:
+            fns = tuple(
+                (position, fn)
+                for position, fn in enumerate(self._transformers)
+                if applies_to(fn, cls)
+            )
+            self._dispatch[cls] = fns
+        return fns
+
+    def _apply(self, obj: Any, fns: Tuple[Tuple[int, Transformer], ...]):
+        cls = type(obj)
+        for position, fn in fns:
+            obj = fn(obj)
+            if type(obj) is not cls:
+                # the transformers after this one are matched to the new type
+                rest = tuple(
+                    (later, later_fn)
+                    for later, later_fn in self._lookup(type(obj))
+                    if later > position
+                )
+                return self._apply(obj, rest)
+        return obj
+
+    def _transform(self, obj: Any):
+        cls = type(obj)
+        if cls in self._leaf_types:
+            return obj
+
+        fns = self._dispatch.get(cls)
+        if fns is None:
+            fns = self._lookup(cls)
+        if fns:
+            obj = self._apply(obj, fns)
+            cls = type(obj)
+
+        if cls is list or cls is tuple or isinstance(obj, (list, tuple)):
+            leaf_types = self._leaf_types
+            # fast path for lists of numbers and other leaves
+            if leaf_types.issuperset(map(type, obj)):
+                return list(obj)
+            transform = self._transform
+            return [
+                item if type(item) in leaf_types else transform(item) for item in obj
+            ]
+
+        if isinstance(obj, dict):
+            leaf_types = self._leaf_types
+            transform = self._transform
+            return {
+                key: value if type(value) in leaf_types else transform(value)
+                for key, value in obj.items()
+            }
+
+        return obj
@@ -1,22 +1,29 @@
 import socketio
 
 from volview_server.rpc_server import RpcServer
-from volview_server.chunking import CHUNK_SIZE
 from volview_server.api import RpcApi
+from volview_server.metrics import MetricsMiddleware
 
 
 class VolViewApi(RpcApi):
-    def __call__(self, app, server_kwargs={}, asgi_kwargs={}):
+    def __call__(self, app, server_kwargs={}, asgi_kwargs={}, metrics_path=None):
         """Adds ASGI middleware for accessing VolView's API.
 
         Args:
             - app: the ASGI app to extend
             - server_kwargs: RpcServer options
             - asgi_kwargs: socketio.ASGIApp options
+            - metrics_path: path that serves the server's Prometheus metrics.
+              Metrics are not served by default.
 
         RPCServer options:
         https://python-socketio.readthedocs.io/en/latest/api.html#asyncserver-class
 
+        The chunk size limits (chunk_size, min_chunk_size, max_chunk_size,
+        max_message_size, adaptive_chunking) are RPCServer options as well. See
+        ChunkingAsyncServer. The socket.io max_http_buffer_size defaults to
+        max_chunk_size.
+
         ASGIApp options:
         https://python-socketio.readthedocs.io/en/latest/api.html#asgiapp-class
         """
@@ -27,8 +34,8 @@ class VolViewApi(RpcApi):
             async_handlers=True,
             # allow upstream handling of CORS
             cors_allowed_origins=[],
-            # default to chunk size
-            max_http_buffer_size=CHUNK_SIZE,
             **server_kwargs,
         )
+        if metrics_path:
+            app = MetricsMiddleware(server.metrics, app, metrics_path)
         return socketio.ASGIApp(server.sio, app, **asgi_kwargs)
@@ -0,0 +1,332 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import shutil
+import socket
+import tempfile
+import zlib
+from typing import Awaitable, Callable, List, Optional
+
+import aiohttp
+from aiohttp import web
+from multidict import CIMultiDict
+from yarl import URL
+
+from volview_server.cluster import ClusterHub, LocalClusterManager
+from volview_server.metrics import CONTENT_TYPE, merge_metrics
+from volview_server.rpc_server import CLIENT_ID_QS
+
+WORKER_START_TIMEOUT = 60  # seconds
+WORKER_STOP_TIMEOUT = 10  # seconds
+# seconds between checks for workers that exited
+WORKER_CHECK_INTERVAL = 1
+# largest piece of a response body that is relayed at once
+PROXY_CHUNK_SIZE = 256 * 1024  # bytes
+
+# headers that only apply to a single connection
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+}
+
+logger = logging.getLogger("volview_server.workers")
+
+# (client_manager=...) -> app
+AppFactory = Callable[..., Awaitable[web.Application]]
+
+
+def worker_index(client_id: str, workers: int) -> int:
+    """Gets the worker that serves a client.
+
+    The index only depends on the client ID, so a client reaches the same
+    worker with every request and every reconnect.
+    """
+    return zlib.crc32(client_id.encode("utf-8")) % workers
+
+
+def _forwarded_headers(headers) -> CIMultiDict:
+    return CIMultiDict(
+        (name, value)
+        for name, value in headers.items()
+        if name.lower() not in HOP_BY_HOP_HEADERS
+    )
+
+
+def _run_worker(app_factory: AppFactory, socket_path: str, hub_path: str):
+    client_manager = LocalClusterManager(hub_path)
+    web.run_app(
+        app_factory(client_manager=client_manager), path=socket_path, print=None
+    )
+
+
+class WorkerPool:
+    """Runs server processes behind one port, and routes clients to them.
+
+    The workers listen on Unix sockets and share rooms and client RPCs
+    through a ClusterHub. A front process proxies HTTP and websocket requests
+    to the worker of the request's client ID, so a client's socket.io
+    connections, session and rooms stay in one worker. Requests without a
+    client ID go to the first worker. Workers that crash are restarted.
+    """
+
+    def __init__(
+        self,
+        app_factory: AppFactory,
+        workers: int,
+        metrics_path: Optional[str] = None,
+    ):
+        if workers < 1:
+            raise ValueError("Need at least one worker")
+        if not hasattr(socket, "AF_UNIX"):
+            raise RuntimeError("Multiple workers need Unix domain sockets")
+
+        self.app_factory = app_factory
+        self.metrics_path = metrics_path
+        self.runtime_dir = tempfile.mkdtemp(prefix="volview-")
+        self.hub_path = os.path.join(self.runtime_dir, "hub.sock")
+        self.socket_paths = [
+            os.path.join(self.runtime_dir, f"worker-{index}.sock")
+            for index in range(workers)
+        ]
+        # workers inherit the imported API instead of importing it again
+        self._context = mp.get_context("fork")
+        self._processes: List[Optional[mp.Process]] = [None] * workers
+        self._sessions: List[aiohttp.ClientSession] = []
+        self._hub = ClusterHub(self.hub_path)
+        self._supervisor: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start_workers(self):
+        """Starts the worker processes.
+
+        Call this before the front process starts its event loop.
+        """
+        for index in range(len(self.socket_paths)):
+            self._start_worker(index)
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=_run_worker,
+            args=(self.app_factory, self.socket_paths[index], self.hub_path),
+            name=f"volview-worker-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+
+    async def create_app(self) -> web.Application:
+        """Creates the front app, once the workers are ready."""
+        await self._hub.start()
+        for path in self.socket_paths:
+            # long-polling requests hold connections open, so they are not pooled
+            connector = aiohttp.UnixConnector(path, limit=0)
+            self._sessions.append(
+                aiohttp.ClientSession(
+                    connector=connector,
+                    timeout=aiohttp.ClientTimeout(total=None),
+                    auto_decompress=False,
+                )
+            )
+        await asyncio.gather(
+            *(self._wait_ready(index) for index in range(len(self.socket_paths)))
+        )
+        self._supervisor = asyncio.ensure_future(self._supervise())
+
+        app = web.Application(client_max_size=0)
+        if self.metrics_path:
+            app.router.add_get(self.metrics_path, self._handle_metrics)
+        app.router.add_route("*", "/{path:.*}", self._handle)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    def stop_workers(self):
+        """Stops the worker processes, and removes their sockets.
+
+        Blocks until the workers exit.
+        """
+        self._stopping = True
+        for process in self._processes:
+            if process and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process:
+                process.join(WORKER_STOP_TIMEOUT)
+                if process.is_alive():
+                    process.kill()
+                    process.join()
+        shutil.rmtree(self.runtime_dir, ignore_errors=True)
+
+    async def _on_shutdown(self, app):
+        self._stopping = True
+        if self._supervisor:
+            self._supervisor.cancel()
+        for session in self._sessions:
+            await session.close()
+        # the workers use the hub until they exit
+        await asyncio.get_running_loop().run_in_executor(None, self.stop_workers)
+        await self._hub.close()
+
+    async def _wait_ready(self, index: int):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + WORKER_START_TIMEOUT
+        while True:
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_paths[index])
+            except OSError:
+                process = self._processes[index]
+                if process.exitcode is not None:
+                    raise RuntimeError(f"Worker {index} exited while starting")
+                if loop.time() > deadline:
+                    raise RuntimeError(f"Worker {index} did not start in time")
+                await asyncio.sleep(0.1)
+            else:
+                writer.close()
+                return
+
+    async def _supervise(self):
+        while not self._stopping:
+            await asyncio.sleep(WORKER_CHECK_INTERVAL)
+            for index, process in enumerate(self._processes):
+                # workers exit cleanly as the server shuts down
+                if self._stopping or process.exitcode in (None, 0):
+                    continue
+                logger.warning(
+                    f"Worker {index} exited with code {process.exitcode}. "
+                    "Restarting it."
+                )
+                self._start_worker(index)
+
+    def _route(self, request: web.Request) -> int:
+        client_id = request.query.get(CLIENT_ID_QS)
+        if not client_id:
+            return 0
+        return worker_index(client_id, len(self.socket_paths))
+
+    def _worker_url(self, request: web.Request) -> URL:
+        # the host is ignored by the Unix socket connector
+        return URL("http://volview-worker" + request.raw_path, encoded=True)
+
+    async def _handle(self, request: web.Request):
+        index = self._route(request)
+        if request.headers.get("Upgrade", "").lower() == "websocket":
+            return await self._proxy_websocket(request, index)
+        return await self._proxy_http(request, index)
+
+    async def _proxy_http(self, request: web.Request, index: int):
+        """Relays a request to a worker.
+
+        Bodies are streamed in both directions rather than buffered, so large
+        long-polling payloads are not held in the front process.
+        """
+        headers = _forwarded_headers(request.headers)
+        if request.remote:
+            headers.add("X-Forwarded-For", request.remote)
+        try:
+            upstream = await self._sessions[index].request(
+                request.method,
+                self._worker_url(request),
+                headers=headers,
+                data=request.content if request.body_exists else None,
+                allow_redirects=False,
+            )
+        except aiohttp.ClientConnectionError:
+            raise web.HTTPBadGateway(text=f"Worker {index} is unavailable")
+
+        async with upstream:
+            response = web.StreamResponse(
+                status=upstream.status,
+                headers=_forwarded_headers(upstream.headers),
+            )
+            await response.prepare(request)
+            # A worker that exits mid-response raises here. The headers are
+            # sent, so the error drops the connection instead of a 502.
+            async for chunk in upstream.content.iter_chunked(PROXY_CHUNK_SIZE):
+                await response.write(chunk)
+            await response.write_eof()
+        return response
+
+    async def _proxy_websocket(self, request: web.Request, index: int):
+        headers = {
+            name: value
+            for name, value in _forwarded_headers(request.headers).items()
+            if not name.lower().startswith("sec-websocket-")
+        }
+        try:
+            worker_ws = await self._sessions[index].ws_connect(
+                self._worker_url(request),
+                headers=headers,
+                max_msg_size=0,
+                autoping=True,
+            )
+        except aiohttp.ClientError:
+            raise web.HTTPBadGateway(text=f"Worker {index} is unavailable")
+
+        client_ws = web.WebSocketResponse(max_msg_size=0)
+        await client_ws.prepare(request)
+
+        async def pipe(source, target):
+            async for message in source:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    await target.send_str(message.data)
+                elif message.type == aiohttp.WSMsgType.BINARY:
+                    await target.send_bytes(message.data)
+                else:
+                    break
+
+        pipes = [
+            asyncio.ensure_future(pipe(client_ws, worker_ws)),
+            asyncio.ensure_future(pipe(worker_ws, client_ws)),
+        ]
+        try:
+            # either side closing ends the connection
+            await asyncio.wait(pipes, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pipes:
+                task.cancel()
+            await worker_ws.close()
+            await client_ws.close()
+        return client_ws
+
+    async def _handle_metrics(self, request: web.Request):
+        async def fetch(session: aiohttp.ClientSession):
+            try:
+                async with session.get(
+                    f"http://volview-worker{self.metrics_path}"
+                ) as response:
+                    return await response.text()
+            except aiohttp.ClientError:
+                # a restarting worker
+                return ""
+
+        texts = await asyncio.gather(*(fetch(session) for session in self._sessions))
+        return web.Response(
+            body=merge_metrics(texts, "worker").encode("utf-8"),
+            headers={"Content-Type": CONTENT_TYPE},
+        )
+
+
+def run_workers(
+    app_factory: AppFactory,
+    *,
+    workers: int,
+    host: str,
+    port: int,
+    metrics_path: Optional[str] = None,
+):
+    """Runs a server in several worker processes behind one port.
+
+    app_factory(client_manager=...) creates a worker's aiohttp app.
+    """
+    pool = WorkerPool(app_factory, workers, metrics_path=metrics_path)
+    pool.start_workers()
+    try:
+        web.run_app(pool.create_app(), host=host, port=port)
+    finally:
+        pool.stop_workers()
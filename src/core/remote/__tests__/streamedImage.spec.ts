@@ -0,0 +1,129 @@
+import { describe, it, expect } from 'vitest';
+import {
+  ImageStreamMessage,
+  RemoteStreamedImage,
+  StreamedImageHeader,
+} from '@/src/core/remote/streamedImage';
+
+function slab(z: number, values: number[]): ImageStreamMessage {
+  return {
+    type: 'region',
+    region: {
+      extent: [0, 1, 0, 0, z, z],
+      scalars: {
+        dataType: 'Int16Array',
+        numberOfComponents: 1,
+        values: new Int16Array(values).buffer,
+      },
+    },
+  };
+}
+
+function flushPromises() {
+  return new Promise((resolve) => {
+    setTimeout(resolve, 0);
+  });
+}
+
+const imageHeader: StreamedImageHeader = {
+  extent: [0, 1, 0, 0, 0, 2],
+  spacing: [1, 1, 2],
+  origin: [0, 0, 0],
+  direction: [1, 0, 0, 0, 1, 0, 0, 0, 1],
+  dataType: 'Int16Array',
+  numberOfComponents: 1,
+};
+
+const header: ImageStreamMessage = { type: 'image', image: imageHeader };
+
+describe('RemoteStreamedImage', () => {
+  it('fills in the image as slabs arrive', async () => {
+    let send: (message: ImageStreamMessage) => void = () => {};
+    let finish: () => void = () => {};
+    const image = new RemoteStreamedImage('streamed', (onData) => {
+      send = onData;
+      return new Promise((resolve) => {
+        finish = resolve;
+      });
+    });
+
+    image.startLoad();
+    expect(image.isLoading()).toBe(true);
+
+    send(header);
+    send(slab(1, [5, 6]));
+    const imageData = image.getVtkImageData();
+    expect(imageData.getDimensions()).toEqual([2, 1, 3]);
+    expect(image.getStatus()).toBe('incomplete');
+    expect(imageData.getPointData().getScalars().getRange(0)).toEqual([5, 6]);
+
+    send(slab(0, [-3, 1]));
+    send(slab(2, [7, 9]));
+    finish();
+    await flushPromises();
+
+    expect(Array.from(imageData.getPointData().getScalars().getData())).toEqual(
+      [-3, 1, 5, 6, 7, 9]
+    );
+    expect(imageData.getPointData().getScalars().getRange(0)).toEqual([-3, 9]);
+    expect(image.getStatus()).toBe('complete');
+    expect(image.isLoaded()).toBe(true);
+  });
+
+  it('swaps in finer levels once they have loaded', async () => {
+    let send: (message: ImageStreamMessage) => void = () => {};
+    const image = new RemoteStreamedImage('streamed', (onData) => {
+      send = onData;
+      return new Promise(() => {});
+    });
+    image.startLoad();
+
+    send({
+      type: 'image',
+      image: { ...imageHeader, extent: [0, 0, 0, 0, 0, 0], spacing: [2, 1, 6] },
+    });
+    send({
+      type: 'region',
+      region: {
+        extent: [0, 0, 0, 0, 0, 0],
+        scalars: {
+          dataType: 'Int16Array',
+          numberOfComponents: 1,
+          values: new Int16Array([4]).buffer,
+        },
+      },
+    });
+    const coarse = image.getVtkImageData();
+    expect(coarse.getDimensions()).toEqual([1, 1, 1]);
+
+    send({ type: 'level', image: imageHeader });
+    send(slab(0, [-3, 1]));
+    send(slab(1, [5, 6]));
+    send(slab(2, [7, 9]));
+    // the coarse image is shown until the level is ready
+    expect(image.getVtkImageData()).toBe(coarse);
+    expect(coarse.getPointData().getScalars().getRange(0)).toEqual([4, 4]);
+
+    send({ type: 'levelReady' });
+    const imageData = image.getVtkImageData();
+    expect(imageData.getDimensions()).toEqual([2, 1, 3]);
+    expect(Array.from(imageData.getPointData().getScalars().getData())).toEqual(
+      [-3, 1, 5, 6, 7, 9]
+    );
+    expect(imageData.getPointData().getScalars().getRange(0)).toEqual([-3, 9]);
+  });
+
+  it('reports stream errors', async () => {
+    const image = new RemoteStreamedImage('streamed', () =>
+      Promise.reject(new Error('stream failed'))
+    );
+    const errors: Error[] = [];
+    image.addEventListener('error', (err) => errors.push(err));
+
+    image.startLoad();
+    await flushPromises();
+
+    expect(errors.map((err) => err.message)).toEqual(['stream failed']);
+    expect(image.isLoading()).toBe(false);
+  });
+});
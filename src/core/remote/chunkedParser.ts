@@ -57,14 +57,19 @@ function allArrayBufferChunks(chunks: any[]): chunks is ArrayBuffer[] {
  * message.
  *
  * Chunking works on both string and binary messages.
+ *
+ * The chunk size defaults to CHUNK_SIZE and can be changed per encoder, which
+ * is how a client applies the chunk size negotiated with the server.
  */
 class ChunkedEncoder extends BaseParser.Encoder {
+  public chunkSize = CHUNK_SIZE;
+
   encode(packet: Packet) {
     const messages = super.encode(packet);
 
     // All messages are smaller than the chunk size.
     // Skip wrapping the socket.io message with chunking.
-    if (messages.every((m) => getLength(m) <= CHUNK_SIZE)) {
+    if (messages.every((m) => getLength(m) <= this.chunkSize)) {
       return messages;
     }
 
@@ -95,7 +100,7 @@ class ChunkedEncoder extends BaseParser.Encoder {
     const chunks: string[] = [];
     let offset = 0;
     while (offset < str.length) {
-      const chunkEnd = Math.min(offset + CHUNK_SIZE, str.length);
+      const chunkEnd = Math.min(offset + this.chunkSize, str.length);
       chunks.push(str.substring(offset, chunkEnd));
       offset = chunkEnd;
     }
@@ -111,7 +116,7 @@ class ChunkedEncoder extends BaseParser.Encoder {
       const end = view.byteOffset + view.byteLength;
       let offset = view.byteOffset;
       while (offset < end) {
-        const chunkEnd = Math.min(offset + CHUNK_SIZE, end);
+        const chunkEnd = Math.min(offset + this.chunkSize, end);
         chunks.push(new Uint8Array(buffer, offset, chunkEnd - offset));
         offset = chunkEnd;
       }
@@ -122,7 +127,7 @@ class ChunkedEncoder extends BaseParser.Encoder {
     const chunks: Blob[] = [];
     let offset = 0;
     while (offset < binary.size) {
-      const chunkEnd = Math.min(offset + CHUNK_SIZE, binary.size);
+      const chunkEnd = Math.min(offset + this.chunkSize, binary.size);
       chunks.push(binary.slice(offset, chunkEnd));
       offset += chunkEnd;
     }
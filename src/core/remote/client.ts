@@ -6,12 +6,16 @@ import {
 } from '@/src/core/remote/transformers';
 import { Maybe } from '@/src/types';
 import { Deferred, defer } from '@/src/utils';
-import { debug } from '@/src/utils/loggers';
+import { debug, logError } from '@/src/utils/loggers';
 import { flow } from '@/src/utils/functional';
 import { nanoid } from 'nanoid';
 import { Socket, io } from 'socket.io-client';
 import { z } from 'zod';
 import * as ChunkedParser from '@/src/core/remote/chunkedParser';
+import {
+  decompressPayload,
+  getSupportedCodecs,
+} from '@/src/core/remote/compression';
 import { parseUrl } from '@/src/utils/url';
 
 const CLIENT_ID_SIZE = 24;
@@ -20,6 +24,9 @@ const RPC_CALL_EVENT = 'rpc:call';
 const RPC_RESULT_EVENT = 'rpc:result';
 const STREAM_CALL_EVENT = 'stream:call';
 const STREAM_RESULT_EVENT = 'stream:result';
+const STREAM_CREDIT_EVENT = 'stream:credit';
+const CHUNKING_CONFIG_EVENT = 'chunking:config';
+const STREAM_WINDOW = 8;
 
 interface RpcOkResult<R> {
   rpcId: string;
@@ -80,24 +87,37 @@ function validateStreamResult<T>(result: unknown): result is StreamResult<T> {
   return StreamResultSchema.safeParse(result).success;
 }
 
-type StreamCallback<D> = (data: D) => void;
+/**
+ * Handles a stream result. If a promise is returned, no more results are
+ * requested from the server until it settles.
+ */
+type StreamCallback<D> = (data: D) => void | Promise<void>;
 
 export interface RpcCall {
   rpcId: string;
   name: string;
   args?: unknown[];
+  /**
+   * Number of stream results the server may send ahead of the client.
+   */
+  window?: number;
 }
 
 const RpcCallSchema = z.object({
   rpcId: z.string(),
   name: z.string(),
   args: z.array(z.unknown()).optional(),
+  window: z.number().int().positive().optional(),
 });
 
 export function validateRpcCall(data: unknown): data is RpcCall {
   return RpcCallSchema.safeParse(data).success;
 }
 
+const ChunkingConfigSchema = z.object({
+  chunkSize: z.number().int().positive(),
+});
+
 export interface RpcApi {
   [name: string]: (...args: any[]) => any;
 }
@@ -106,6 +126,15 @@ export interface RpcClientOptions {
   serializers?: Array<(input: any) => any>;
   deserializers?: Array<(input: any) => any>;
   path?: string;
+  /**
+   * Preferred message chunk size. The server clamps it to its own limits.
+   */
+  chunkSize?: number;
+  /**
+   * Number of stream results the server may send before the client has
+   * handled them. The server also caps the bytes it sends ahead.
+   */
+  streamWindow?: number;
 }
 
 function justHostUrl(url: string) {
@@ -135,6 +164,11 @@ export default class RpcClient {
   private waiting: Map<string, Promise<unknown>>;
   private pendingRpcs: Map<string, Deferred<any>>;
   private activeStreams: Map<string, StreamCallback<any>>;
+  private streamWindow: number;
+  // Stream results are decompressed asynchronously, so each stream's
+  // results are handled in order through its own chain. A slow consumer
+  // holds back only its own stream.
+  private streamResults: Map<string, Promise<void>>;
 
   constructor(api: RpcApi, options?: RpcClientOptions) {
     this.clientId = `cid_${nanoid(CLIENT_ID_SIZE)}`;
@@ -146,10 +180,14 @@ export default class RpcClient {
     this.waiting = new Map();
     this.pendingRpcs = new Map();
     this.activeStreams = new Map();
+    this.streamResults = new Map();
+    this.streamWindow = options?.streamWindow ?? STREAM_WINDOW;
 
     this.socket = io('', {
       query: {
         clientId: this.clientId,
+        ...(options?.chunkSize ? { chunkSize: options.chunkSize } : {}),
+        codecs: getSupportedCodecs().join(','),
       },
       autoConnect: false,
       parser: ChunkedParser,
@@ -158,6 +196,7 @@ export default class RpcClient {
     this.socket.on(RPC_CALL_EVENT, this.onRpcCallEvent);
     this.socket.on(RPC_RESULT_EVENT, this.onRpcResultEvent);
     this.socket.on(STREAM_RESULT_EVENT, this.onStreamResultEvent);
+    this.socket.on(CHUNKING_CONFIG_EVENT, this.onChunkingConfigEvent);
   }
 
   protected serialize = flow(...this.serializers);
@@ -221,6 +260,17 @@ export default class RpcClient {
     return promise;
   }
 
+  private onChunkingConfigEvent = (config: unknown) => {
+    const result = ChunkingConfigSchema.safeParse(config);
+    if (!result.success) {
+      debug.warn('Received invalid chunking config:', config);
+      return;
+    }
+
+    // @ts-ignore the encoder is internal to the socket.io manager
+    this.socket.io.encoder.chunkSize = result.data.chunkSize;
+  };
+
   /**
    * Calls a remote RPC given some arguments.
    * @param rpcName
@@ -262,7 +312,13 @@ export default class RpcClient {
     this.pendingRpcs.delete(result.rpcId);
 
     if (result.ok) {
-      deferred.resolve(transformObject(result.data, this.deserialize));
+      decompressPayload(result.data)
+        .then((data) => {
+          deferred.resolve(transformObject(data, this.deserialize));
+        })
+        .catch((err) => {
+          deferred.reject(err);
+        });
     } else {
       deferred.reject(new Error(result.error));
     }
@@ -314,6 +370,7 @@ export default class RpcClient {
       rpcId,
       name: methodName,
       args: transformObjects(args ?? [], this.serialize),
+      window: this.streamWindow,
     });
 
     return deferred.promise;
@@ -324,6 +381,20 @@ export default class RpcClient {
       throw new Error('Failed to validate RPC stream result');
     }
 
+    const { rpcId } = result;
+    const chain = (this.streamResults.get(rpcId) ?? Promise.resolve())
+      .then(() => this.handleStreamResult(result))
+      .catch(logError)
+      .then(() => {
+        // the stream has no results left to handle
+        if (this.streamResults.get(rpcId) === chain) {
+          this.streamResults.delete(rpcId);
+        }
+      });
+    this.streamResults.set(rpcId, chain);
+  };
+
+  private async handleStreamResult(result: StreamResult<unknown>) {
     const deferred: Maybe<Deferred<void>> = this.pendingRpcs.get(result.rpcId);
     const callback = this.activeStreams.get(result.rpcId);
     if (!deferred || !callback) {
@@ -342,13 +413,24 @@ export default class RpcClient {
         clearListeners();
         deferred.resolve();
       } else {
-        callback(transformObject(result.data, this.deserialize));
+        try {
+          const data = await decompressPayload(result.data);
+          await callback(transformObject(data, this.deserialize));
+          // let the server send another result
+          this.socket.emit(STREAM_CREDIT_EVENT, {
+            rpcId: result.rpcId,
+            credits: 1,
+          });
+        } catch (err) {
+          clearListeners();
+          deferred.reject(err);
+        }
       }
     } else {
       clearListeners();
       deferred.reject(new Error(result.error));
     }
-  };
+  }
 
   protected sendRpcCall(eventType: string, payload: RpcCall) {
     this.socket.emit(eventType, payload);
@@ -377,7 +459,10 @@ export default class RpcClient {
     }
 
     try {
-      const deserializedArgs = transformObjects(args, this.deserialize);
+      const deserializedArgs = transformObjects(
+        await decompressPayload(args),
+        this.deserialize
+      );
       type RpcMethod = (...args: unknown[]) => unknown;
       const data = await (this.api[name] as RpcMethod)(...deserializedArgs);
       return makeRpcOkResult(transformObject(data, this.serialize));
@@ -0,0 +1,59 @@
+/**
+ * Decompression of image arrays that the server compressed.
+ *
+ * The server compresses large vtkDataArray values with a codec negotiated at
+ * connection time and tags the array with a `compression` key. Browsers can
+ * only decode deflate natively, so that is the only codec advertised.
+ */
+
+const SUPPORTED_CODECS =
+  typeof DecompressionStream === 'undefined' ? [] : ['deflate'];
+
+export function getSupportedCodecs(): string[] {
+  return SUPPORTED_CODECS;
+}
+
+function isBinary(obj: any) {
+  return obj instanceof ArrayBuffer || ArrayBuffer.isView(obj);
+}
+
+function isCompressedDataArray(obj: any) {
+  return (
+    obj?.vtkClass === 'vtkDataArray' && typeof obj.compression === 'string'
+  );
+}
+
+async function decompress(codec: string, values: BlobPart) {
+  if (!SUPPORTED_CODECS.includes(codec)) {
+    throw new Error(`Unsupported compression codec ${codec}`);
+  }
+  const stream = new Blob([values])
+    .stream()
+    .pipeThrough(new DecompressionStream(codec as CompressionFormat));
+  return new Response(stream).arrayBuffer();
+}
+
+/**
+ * Decompresses all compressed vtkDataArrays in a received payload.
+ */
+export async function decompressPayload(obj: any): Promise<any> {
+  if (!obj || typeof obj !== 'object' || isBinary(obj)) {
+    return obj;
+  }
+
+  if (isCompressedDataArray(obj)) {
+    const { compression, values, ...rest } = obj;
+    return { ...rest, values: await decompress(compression, values) };
+  }
+
+  if (Array.isArray(obj)) {
+    return Promise.all(obj.map((item) => decompressPayload(item)));
+  }
+
+  const entries = await Promise.all(
+    Object.entries(obj).map(
+      async ([key, value]) => [key, await decompressPayload(value)] as const
+    )
+  );
+  return Object.fromEntries(entries);
+}
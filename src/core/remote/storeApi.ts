@@ -47,7 +47,33 @@ async function callStoreMethod(
   return method(...args);
 }
 
+// [storeName, propPath] for a property, or [storeName, propPath, args] for a
+// method call. Calls and results are arrays so their contents are transformed.
+type StoreCall = [string, PropKey[]] | [string, PropKey[], unknown[]];
+
+type StoreCallResult = [ok: true, data: unknown] | [ok: false, error: string];
+
+/**
+ * Runs several store accesses in order, so the server can make them in one
+ * round trip. Each access succeeds or fails on its own.
+ */
+async function batchStoreCalls(calls: StoreCall[]) {
+  const results: StoreCallResult[] = [];
+  for (const [storeName, propPath, args] of calls) {
+    try {
+      const data = args
+        ? await callStoreMethod(storeName, propPath, args)
+        : getStoreProperty(storeName, propPath);
+      results.push([true, data]);
+    } catch (err) {
+      results.push([false, String(err)]);
+    }
+  }
+  return results;
+}
+
 export const StoreApi = {
   getStoreProperty,
   callStoreMethod,
+  batchStoreCalls,
 };
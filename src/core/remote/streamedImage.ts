@@ -0,0 +1,222 @@
+import vtkDataArray from '@kitware/vtk.js/Common/Core/DataArray';
+import vtkImageData from '@kitware/vtk.js/Common/DataModel/ImageData';
+import type { TypedArray } from '@kitware/vtk.js/types';
+import mitt, { Emitter } from 'mitt';
+import { computed } from 'vue';
+import { mat3 } from 'gl-matrix';
+import {
+  BaseProgressiveImage,
+  ProgressiveImageEvents,
+} from '@/src/core/progressiveImage';
+import type { TypedArrayConstructorName } from '@/src/types';
+import { ensureError, TypedArrayConstructorNames } from '@/src/utils';
+import { ImageRegionUpdate, writeImageRegion } from '@/src/utils/imageRegion';
+
+const { fastComputeRange } = vtkDataArray;
+
+export interface StreamedImageHeader {
+  extent: number[];
+  spacing: number[];
+  origin: number[];
+  direction: number[];
+  dataType: string;
+  numberOfComponents: number;
+}
+
+/**
+ * Messages produced by volview_server.stream_image() and
+ * volview_server.stream_image_pyramid().
+ *
+ * A 'level' message starts loading a finer level of the image in the
+ * background. The following regions fill in that level, which replaces the
+ * displayed image on 'levelReady'.
+ */
+export type ImageStreamMessage =
+  | { type: 'image'; image: StreamedImageHeader }
+  | { type: 'region'; region: ImageRegionUpdate }
+  | { type: 'level'; image: StreamedImageHeader }
+  | { type: 'levelReady' };
+
+/**
+ * Starts a remote stream, passing each message to onData.
+ * Resolves once the stream is done.
+ */
+export type ImageStreamStarter = (
+  onData: (message: ImageStreamMessage) => void
+) => Promise<void>;
+
+function allocateImage(header: StreamedImageHeader) {
+  if (!TypedArrayConstructorNames.includes(header.dataType)) {
+    throw new Error(`Unsupported pixel type ${header.dataType}`);
+  }
+  const [x0, x1, y0, y1, z0, z1] = header.extent;
+  const numberOfValues =
+    (x1 - x0 + 1) * (y1 - y0 + 1) * (z1 - z0 + 1) * header.numberOfComponents;
+  const ArrayType = globalThis[header.dataType as TypedArrayConstructorName];
+
+  const image = vtkImageData.newInstance();
+  image.setExtent(header.extent);
+  image.setSpacing(header.spacing);
+  image.setOrigin(header.origin);
+  image.setDirection(header.direction as mat3);
+  image.getPointData().setScalars(
+    vtkDataArray.newInstance({
+      numberOfComponents: header.numberOfComponents,
+      values: new ArrayType(numberOfValues),
+    })
+  );
+  return image;
+}
+
+/**
+ * Writes a slab into an image, and widens the image's data range with it.
+ * The range is reset by the first slab.
+ */
+function writeSlab(
+  imageData: vtkImageData,
+  region: ImageRegionUpdate,
+  hasRange: boolean
+) {
+  writeImageRegion(imageData, region);
+
+  // Slabs span whole slices, so they are contiguous in the image's scalars.
+  const scalars = imageData.getPointData().getScalars();
+  const [x0, x1, y0, y1, z0, z1] = region.extent;
+  const [dimX, dimY] = imageData.getDimensions();
+  const numberOfComponents = scalars.getNumberOfComponents();
+  const start = ((z0 * dimY + y0) * dimX + x0) * numberOfComponents;
+  const end = ((z1 * dimY + y1) * dimX + x1 + 1) * numberOfComponents;
+  const values = (scalars.getData() as TypedArray).subarray(start, end);
+
+  for (let comp = 0; comp < numberOfComponents; comp++) {
+    const { min, max } = fastComputeRange(
+      values as unknown as number[],
+      comp,
+      numberOfComponents
+    );
+    const curRange = scalars.getRange(comp);
+    const newMin = hasRange ? Math.min(min, curRange[0]) : min;
+    const newMax = hasRange ? Math.max(max, curRange[1]) : max;
+    scalars.setRange({ min: newMin, max: newMax }, comp);
+  }
+  scalars.modified(); // so image-stats will trigger update of range
+}
+
+/**
+ * An image that is streamed from the remote server, one slab at a time.
+ *
+ * The image is allocated as soon as the stream's header arrives, so it can be
+ * displayed while the remaining slabs are still loading. Streams of image
+ * pyramids send a coarse image first, then replace it with finer levels once
+ * each has loaded.
+ *
+ * const image = new RemoteStreamedImage('CT', (onData) =>
+ *   client.stream('stream_volume', [imageId], onData)
+ * );
+ * useImageCacheStore().addProgressiveImage(image);
+ */
+export class RemoteStreamedImage extends BaseProgressiveImage {
+  private events: Emitter<ProgressiveImageEvents>;
+  private startStream: ImageStreamStarter;
+  private started = false;
+  private hasRange = false;
+  // a finer level that is loading in the background
+  private pendingLevel: vtkImageData | null = null;
+  private pendingHasRange = false;
+
+  constructor(name: string, startStream: ImageStreamStarter) {
+    super();
+
+    this.name.value = name;
+    this.startStream = startStream;
+    this.loaded = computed(() => {
+      return !this.loading.value && this.status.value === 'complete';
+    });
+    this.events = mitt();
+
+    this.addEventListener('loading', (loading) => {
+      this.loading.value = loading;
+    });
+
+    this.addEventListener('status', (status) => {
+      this.status.value = status;
+    });
+  }
+
+  addEventListener<T extends keyof ProgressiveImageEvents>(
+    type: T,
+    callback: (info: ProgressiveImageEvents[T]) => void
+  ): void {
+    this.events.on(type, callback);
+  }
+
+  removeEventListener<T extends keyof ProgressiveImageEvents>(
+    type: T,
+    callback: (info: ProgressiveImageEvents[T]) => void
+  ): void {
+    this.events.off(type, callback);
+  }
+
+  dispose() {
+    super.dispose();
+    this.events.all.clear();
+    this.vtkImageData.value.delete();
+    this.pendingLevel?.delete();
+    this.pendingLevel = null;
+  }
+
+  startLoad() {
+    if (this.started) return;
+    this.started = true;
+    this.events.emit('loading', true);
+
+    this.startStream(this.onStreamData)
+      .then(() => {
+        this.events.emit('status', 'complete');
+      })
+      .catch((err) => {
+        this.events.emit('error', ensureError(err));
+      })
+      .finally(() => {
+        this.events.emit('loading', false);
+      });
+  }
+
+  stopLoad() {
+    // remote streams cannot be stopped once started
+  }
+
+  onStreamData = (message: ImageStreamMessage) => {
+    if (message.type === 'image') {
+      this.vtkImageData.value.delete();
+      this.vtkImageData.value = allocateImage(message.image);
+      this.hasRange = false;
+    } else if (message.type === 'level') {
+      this.pendingLevel?.delete();
+      this.pendingLevel = allocateImage(message.image);
+      this.pendingHasRange = false;
+    } else if (message.type === 'levelReady') {
+      this.swapInLevel();
+    } else if (message.type === 'region') {
+      this.onRegion(message.region);
+    }
+  };
+
+  private onRegion(region: ImageRegionUpdate) {
+    if (this.pendingLevel) {
+      writeSlab(this.pendingLevel, region, this.pendingHasRange);
+      this.pendingHasRange = true;
+    } else {
+      writeSlab(this.vtkImageData.value, region, this.hasRange);
+      this.hasRange = true;
+    }
+  }
+
+  private swapInLevel() {
+    if (!this.pendingLevel) return;
+    this.vtkImageData.value.delete();
+    this.vtkImageData.value = this.pendingLevel;
+    this.hasRange = this.pendingHasRange;
+    this.pendingLevel = null;
+  }
+}
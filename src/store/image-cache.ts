@@ -7,6 +7,8 @@ import { useIdStore } from '@/src/store/id';
 import { useMessageStore } from '@/src/store/messages';
 import { Maybe } from '@/src/types';
 import { ImageMetadata } from '@/src/types/image';
+import { getImageDigest as computeImageDigest } from '@/src/utils/imageDigest';
+import { ImageRegionUpdate, writeImageRegion } from '@/src/utils/imageRegion';
 import vtkImageData from '@kitware/vtk.js/Common/DataModel/ImageData';
 import { defineStore } from 'pinia';
 import { markRaw, reactive, ref } from 'vue';
@@ -41,6 +43,17 @@ export const useImageCacheStore = defineStore('image-cache', () => {
     return data;
   }
 
+  /**
+   * Gets a content digest of a loaded image, or null if it is unavailable.
+   *
+   * The remote server uses this to reuse images it has already fetched.
+   */
+  async function getImageDigest(id: Maybe<string>): Promise<Maybe<string>> {
+    const data = getVtkImageData(id);
+    if (!data) return null;
+    return computeImageDigest(data);
+  }
+
   function getImageMetadata(id: Maybe<string>): Maybe<ImageMetadata> {
     if (!id) return null;
     return imageById[id]?.getImageMetadata() ?? null;
@@ -148,6 +161,17 @@ export const useImageCacheStore = defineStore('image-cache', () => {
     }
   }
 
+  /**
+   * Writes a changed region of pixels into an existing image.
+   *
+   * The remote server uses this to send only the changed part of an image.
+   */
+  function updateVTKImageDataRegion(id: string, region: ImageRegionUpdate) {
+    const imageData = getVtkImageData(id);
+    if (!imageData) throw new Error(`Image ${id} is not loaded`);
+    writeImageRegion(imageData, region);
+  }
+
   return {
     imageIds,
     imageById,
@@ -155,11 +179,13 @@ export const useImageCacheStore = defineStore('image-cache', () => {
     imageLoading,
     imageErrors,
     getVtkImageData,
+    getImageDigest,
     getImageMetadata,
     onImageDeleted,
     addProgressiveImage,
     addVTKImageData,
     updateVTKImageData,
+    updateVTKImageDataRegion,
     removeImage,
   };
 });
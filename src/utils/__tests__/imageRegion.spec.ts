@@ -0,0 +1,102 @@
+import vtkDataArray from '@kitware/vtk.js/Common/Core/DataArray';
+import vtkImageData from '@kitware/vtk.js/Common/DataModel/ImageData';
+import { writeImageRegion } from '@/src/utils/imageRegion';
+import { describe, it, expect } from 'vitest';
+
+function makeImage(dims: number[]) {
+  const image = vtkImageData.newInstance();
+  image.setDimensions(dims);
+  image.getPointData().setScalars(
+    vtkDataArray.newInstance({
+      numberOfComponents: 1,
+      values: new Int16Array(dims[0] * dims[1] * dims[2]),
+    })
+  );
+  return image;
+}
+
+function region(extent: number[], values: number[]) {
+  return {
+    extent,
+    scalars: {
+      dataType: 'Int16Array',
+      numberOfComponents: 1,
+      values: new Int16Array(values).buffer,
+    },
+  };
+}
+
+describe('writeImageRegion', () => {
+  it('writes a block of pixels into place', () => {
+    const image = makeImage([4, 3, 2]);
+    writeImageRegion(image, region([1, 2, 1, 2, 1, 1], [1, 2, 3, 4]));
+
+    const data = image.getPointData().getScalars().getData();
+    const changed = Array.from(data)
+      .map((value, index) => [index, value])
+      .filter(([, value]) => value !== 0);
+    // index = (z * 3 + y) * 4 + x
+    expect(changed).toEqual([
+      [17, 1],
+      [18, 2],
+      [21, 3],
+      [22, 4],
+    ]);
+  });
+
+  it('accepts unaligned byte views', () => {
+    const image = makeImage([2, 1, 1]);
+    const bytes = new Uint8Array(5);
+    bytes.set(new Uint8Array(new Int16Array([7, 8]).buffer), 1);
+
+    writeImageRegion(image, {
+      extent: [0, 1, 0, 0, 0, 0],
+      scalars: {
+        dataType: 'Int16Array',
+        numberOfComponents: 1,
+        values: bytes.subarray(1),
+      },
+    });
+
+    expect(Array.from(image.getPointData().getScalars().getData())).toEqual([
+      7, 8,
+    ]);
+  });
+
+  it('writes 2D regions into a single-slice image', () => {
+    const image = makeImage([3, 2, 1]);
+    writeImageRegion(image, region([1, 2, 1, 1], [5, 6]));
+
+    expect(Array.from(image.getPointData().getScalars().getData())).toEqual([
+      0, 0, 0, 0, 5, 6,
+    ]);
+  });
+
+  it('rejects extents that are neither 2D nor 3D', () => {
+    const image = makeImage([2, 1, 1]);
+    expect(() => writeImageRegion(image, region([0, 1], [1, 2]))).toThrow(
+      /4 \(2D\) or 6 \(3D\)/
+    );
+  });
+
+  it('rejects regions outside the image', () => {
+    const image = makeImage([2, 2, 2]);
+    expect(() =>
+      writeImageRegion(image, region([1, 2, 0, 0, 0, 0], [1, 2]))
+    ).toThrow();
+  });
+
+  it('rejects mismatched pixel types', () => {
+    const image = makeImage([2, 1, 1]);
+    expect(() =>
+      writeImageRegion(image, {
+        extent: [0, 1, 0, 0, 0, 0],
+        scalars: {
+          dataType: 'Float32Array',
+          numberOfComponents: 1,
+          values: new Float32Array(2).buffer,
+        },
+      })
+    ).toThrow();
+  });
+});
@@ -0,0 +1,65 @@
+import vtkImageData from '@kitware/vtk.js/Common/DataModel/ImageData';
+
+interface CachedDigest {
+  mtime: number;
+  digest: string;
+}
+
+const digestCache = new WeakMap<vtkImageData, CachedDigest>();
+
+function toHex(buffer: ArrayBuffer) {
+  return Array.from(new Uint8Array(buffer), (byte) =>
+    byte.toString(16).padStart(2, '0')
+  ).join('');
+}
+
+function getImageMTime(imageData: vtkImageData) {
+  const scalars = imageData.getPointData().getScalars();
+  return Math.max(imageData.getMTime(), scalars?.getMTime() ?? 0);
+}
+
+/**
+ * Computes a SHA-256 digest of an image's geometry and pixel data.
+ *
+ * Digests are cached until the image or its scalars are modified.
+ * Returns null if the Web Crypto API is unavailable, such as on insecure
+ * origins.
+ */
+export async function getImageDigest(
+  imageData: vtkImageData
+): Promise<string | null> {
+  if (!globalThis.crypto?.subtle) return null;
+
+  const mtime = getImageMTime(imageData);
+  const cached = digestCache.get(imageData);
+  if (cached?.mtime === mtime) return cached.digest;
+
+  const scalars = imageData.getPointData().getScalars();
+  const header = new TextEncoder().encode(
+    JSON.stringify({
+      extent: imageData.getExtent(),
+      spacing: imageData.getSpacing(),
+      origin: imageData.getOrigin(),
+      direction: Array.from(imageData.getDirection()),
+      dataType: scalars?.getDataType(),
+      numberOfComponents: scalars?.getNumberOfComponents(),
+    })
+  );
+  const values = scalars?.getData() as ArrayBufferView | undefined;
+  const pixels = values
+    ? new Uint8Array(values.buffer, values.byteOffset, values.byteLength)
+    : new Uint8Array();
+
+  // hash the pixels in place, then combine with the header, so the pixel
+  // data is never copied
+  const pixelDigest = new Uint8Array(
+    await crypto.subtle.digest('SHA-256', pixels)
+  );
+  const message = new Uint8Array(header.byteLength + pixelDigest.byteLength);
+  message.set(header);
+  message.set(pixelDigest, header.byteLength);
+
+  const digest = toHex(await crypto.subtle.digest('SHA-256', message));
+  digestCache.set(imageData, { mtime, digest });
+  return digest;
+}
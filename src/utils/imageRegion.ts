@@ -0,0 +1,102 @@
+import vtkImageData from '@kitware/vtk.js/Common/DataModel/ImageData';
+import type { TypedArray } from '@kitware/vtk.js/types';
+import type { TypedArrayConstructor } from '@/src/types';
+
+export interface ImageRegionUpdate {
+  /**
+   * Inclusive extent of the region, in index space relative to the start of
+   * the image's extent. A 2D region may leave out the z extent.
+   */
+  extent: number[];
+  scalars: {
+    dataType: string;
+    numberOfComponents: number;
+    values: ArrayBuffer | ArrayBufferView;
+  };
+}
+
+function toTypedArray(
+  values: ArrayBuffer | ArrayBufferView,
+  ArrayType: TypedArrayConstructor
+) {
+  if (!ArrayBuffer.isView(values)) {
+    return new ArrayType(values);
+  }
+  if (values.byteOffset % ArrayType.BYTES_PER_ELEMENT !== 0) {
+    // misaligned views cannot be reinterpreted in place
+    return new ArrayType(
+      values.buffer.slice(
+        values.byteOffset,
+        values.byteOffset + values.byteLength
+      )
+    );
+  }
+  return new ArrayType(
+    values.buffer,
+    values.byteOffset,
+    values.byteLength / ArrayType.BYTES_PER_ELEMENT
+  );
+}
+
+function toExtent3D(extent: number[]) {
+  if (extent.length === 4) {
+    // a region of a 2D image, which is a single slice
+    return [...extent, 0, 0];
+  }
+  if (extent.length !== 6) {
+    throw new Error(
+      `Region extent must have 4 (2D) or 6 (3D) values, not ${extent.length}`
+    );
+  }
+  return extent;
+}
+
+/**
+ * Writes a block of pixels into an image's scalars, in place.
+ */
+export function writeImageRegion(
+  imageData: vtkImageData,
+  region: ImageRegionUpdate
+) {
+  const scalars = imageData.getPointData().getScalars();
+  const data = scalars.getData() as TypedArray;
+  const numberOfComponents = scalars.getNumberOfComponents();
+  if (
+    region.scalars.dataType !== scalars.getDataType() ||
+    region.scalars.numberOfComponents !== numberOfComponents
+  ) {
+    throw new Error('Region pixel type does not match the image');
+  }
+
+  const dims = imageData.getDimensions();
+  const [x0, x1, y0, y1, z0, z1] = toExtent3D(region.extent);
+  const inBounds = [
+    [x0, x1],
+    [y0, y1],
+    [z0, z1],
+  ].every(([lo, hi], axis) => lo >= 0 && lo <= hi && hi < dims[axis]);
+  if (!inBounds) {
+    throw new Error('Region is outside the image');
+  }
+
+  const pixels = toTypedArray(
+    region.scalars.values,
+    data.constructor as TypedArrayConstructor
+  );
+  const rowLength = (x1 - x0 + 1) * numberOfComponents;
+  if (pixels.length !== rowLength * (y1 - y0 + 1) * (z1 - z0 + 1)) {
+    throw new Error('Region pixel data does not match its extent');
+  }
+
+  let offset = 0;
+  for (let z = z0; z <= z1; z++) {
+    for (let y = y0; y <= y1; y++) {
+      const start = ((z * dims[1] + y) * dims[0] + x0) * numberOfComponents;
+      data.set(pixels.subarray(offset, offset + rowLength), start);
+      offset += rowLength;
+    }
+  }
+
+  scalars.modified();
+  imageData.modified();
+}